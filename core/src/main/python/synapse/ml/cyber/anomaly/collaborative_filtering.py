@@ -1,15 +1,23 @@
 __author__ = "rolevin"
 
 import os
-from typing import List, Optional, Tuple
-
-from synapse.ml.cyber.anomaly.complement_access import ComplementAccessTransformer
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from synapse.ml.cyber.anomaly.complement_access import (
+    ComplementAccessTransformer,
+    make_group_rng,
+)
+from synapse.ml.cyber.anomaly.local_als import LocalALS, warm_start_factors
+from synapse.ml.cyber.anomaly.packed_model import PackedAccessAnomalyModel, stack_padded
 from synapse.ml.cyber.feature import indexers, scalers
 from synapse.ml.cyber.utils import spark_utils
 
 import numpy as np
+import pandas as pd
 
-from pyspark import SQLContext  # noqa
+from pyspark import SQLContext, StorageLevel, inheritable_thread_target  # noqa
+from pyspark.broadcast import Broadcast
 from pyspark.ml import Estimator, Transformer
 from pyspark.ml.param.shared import Param, Params
 from pyspark.ml.recommendation import ALS
@@ -21,12 +29,58 @@ the term 'res' in this package is a shorthand for resource
 """
 
 
-def _make_dot():
+def _make_dot(scoring_mode: str = "udf") -> Callable[[f.Column, f.Column], f.Column]:
     """
     create a method that performs a dot product between two vectors (list of doubles)
+    where the shorter vector is padded with 1.0 to the length of the longer one (bias padding)
+    :param scoring_mode: one of 'udf' (row-wise python udf), 'pandas' (Arrow-batched pandas udf)
+        or 'native' (Spark SQL higher order functions, no python serialization)
     :return: the method
     """
 
+    if scoring_mode == "native":
+
+        def native_dot(v: f.Column, u: f.Column) -> f.Column:
+            # zip_with pads the shorter array with nulls, which are replaced by the 1.0 bias padding
+            return f.aggregate(
+                f.zip_with(
+                    v,
+                    u,
+                    lambda x, y: f.coalesce(x, f.lit(1.0)) * f.coalesce(y, f.lit(1.0)),
+                ),
+                f.lit(0.0),
+                lambda acc, x: acc + x,
+            )
+
+        return native_dot
+
+    if scoring_mode == "pandas":
+
+        @f.pandas_udf(t.DoubleType())
+        def pandas_dot(v: pd.Series, u: pd.Series) -> pd.Series:
+            res = np.full(len(v), np.nan)
+            valid = (v.notnull() & u.notnull()).to_numpy()
+
+            if valid.any():
+                vv = v[valid]
+                uu = u[valid]
+                v_lengths = vv.map(len).to_numpy()
+                u_lengths = uu.map(len).to_numpy()
+                width = max(v_lengths.max(), u_lengths.max())
+                # entries beyond the length of both vectors are padding on both sides and contribute 1.0 each
+                res[valid] = np.einsum(
+                    "ij,ij->i",
+                    stack_padded(vv, width),
+                    stack_padded(uu, width),
+                ) - (width - np.maximum(v_lengths, u_lengths))
+
+            return pd.Series(res)
+
+        return pandas_dot
+
+    if scoring_mode != "udf":
+        raise ValueError("unsupported scoring_mode: {0}".format(scoring_mode))
+
     @f.udf(t.DoubleType())
     def dot(v, u):
         if (v is not None) and (u is not None):
@@ -58,6 +112,43 @@ def _make_dot():
     return dot
 
 
+def transform_with_packed_model(
+    df: DataFrame,
+    packed_model: PackedAccessAnomalyModel,
+    packed_model_broadcast: Broadcast,
+    preserve_history: bool = True,
+) -> DataFrame:
+    """
+    score a dataframe (batch or streaming) against a broadcast packed model, no joins are involved
+    :param df: the dataframe with the tenant, user and resource columns
+    :param packed_model: the packed model (used on the driver for the column names)
+    :param packed_model_broadcast: the broadcast of packed_model (used by the executors)
+    :param preserve_history: score seen access pairs with zero
+    :return: the dataframe with the output column appended
+    """
+    tenant_col = packed_model.tenant_col
+    user_col = packed_model.user_col
+    res_col = packed_model.res_col
+
+    # same column order as the join based plan
+    cols = [tenant_col, res_col, user_col] + [
+        cc for cc in df.columns if cc not in {tenant_col, user_col, res_col}
+    ]
+
+    schema = t.StructType(
+        [df.schema[cc] for cc in cols]
+        + [t.StructField(packed_model.output_col, t.DoubleType(), True)],
+    )
+
+    def score_batches(pdfs):
+        the_packed_model = packed_model_broadcast.value
+
+        for pdf in pdfs:
+            yield the_packed_model.transform_pandas(pdf, preserve_history)
+
+    return df.select(*cols).mapInPandas(score_batches, schema)
+
+
 class AccessAnomalyConfig:
     """
     Define default values for AccessAnomaly Params
@@ -74,6 +165,11 @@ class AccessAnomalyConfig:
     default_reg_param = 1.0
     default_num_blocks = None  # |tenants| if separate_tenants is False else 10
     default_separate_tenants = False
+    default_max_concurrent_tenants = 4
+
+    # tenants with at most this many distinct access edges have their connected components
+    # computed in memory (see ConnectedComponents)
+    default_max_local_edges = 10000000
 
     default_low_value = 5.0
     default_high_value = 10.0
@@ -84,6 +180,19 @@ class AccessAnomalyConfig:
     default_complementset_factor = 2
     default_neg_score = 1.0
 
+    # one of 'native', 'pandas' or 'udf' (see _make_dot)
+    default_scoring_mode = "native"
+
+    # when set, models whose mappings (users + resources + history) have at most this many rows
+    # are scored against a broadcast numpy copy of the mappings instead of joining with them
+    default_broadcast_max_rows = None
+
+    # the storage level of the intermediate dataframes cached during fit
+    default_storage_level = StorageLevel.MEMORY_AND_DISK
+
+    # the maximal number of scores computed at once (per tenant) by AccessAnomalyModel.top_k
+    default_top_k_block_elements = 1 << 22
+
 
 class _UserResourceFeatureVectorMapping:
     """
@@ -105,6 +214,7 @@ class _UserResourceFeatureVectorMapping:
         res2component_mappings_df: Optional[DataFrame],
         user_feature_vector_mapping_df: DataFrame,
         res_feature_vector_mapping_df: DataFrame,
+        mapping_stats: Optional[Dict[str, int]] = None,
     ):
         self.tenant_col = tenant_col
         self.user_col = user_col
@@ -116,6 +226,8 @@ class _UserResourceFeatureVectorMapping:
         self.res2component_mappings_df = res2component_mappings_df
         self.user_feature_vector_mapping_df = user_feature_vector_mapping_df
         self.res_feature_vector_mapping_df = res_feature_vector_mapping_df
+        # the row and distinct key counts of the mappings (see compute_mapping_stats), if known
+        self.mapping_stats = mapping_stats
 
         assert self.history_access_df is None or set(
             self.history_access_df.schema.fieldNames(),
@@ -150,43 +262,240 @@ class _UserResourceFeatureVectorMapping:
             else self.res_feature_vector_mapping_df,
         )
 
-    def check(self):
+    @staticmethod
+    def _key_stats(df: DataFrame, key_cols: List[str]) -> Tuple[int, int]:
         """
-        check the validity of the model
-        :return: boolean value where True indicating the verification succeeded
+        :return: the number of rows and of distinct keys of df (computed by a single aggregation)
+        """
+        row = (
+            df.groupBy(*key_cols)
+            .agg(f.count(f.lit(1)).alias("rows"))
+            .agg(
+                f.coalesce(f.sum("rows"), f.lit(0)).alias("rows"),
+                f.count(f.lit(1)).alias("keys"),
+            )
+            .collect()[0]
+        )
+
+        return row["rows"], row["keys"]
+
+    def compute_mapping_stats(self) -> Dict[str, int]:
+        """
+        compute the number of rows and of distinct (tenant, name) keys of the user and resource mappings
+        :return: a dictionary with user_mapping_rows, user_mapping_keys, res_mapping_rows and res_mapping_keys
         """
-        return self._check_user_mapping() and self._check_res_mapping()
+        user_rows, user_keys = _UserResourceFeatureVectorMapping._key_stats(
+            self.user_feature_vector_mapping_df,
+            [self.tenant_col, self.user_col],
+        )
+        res_rows, res_keys = _UserResourceFeatureVectorMapping._key_stats(
+            self.res_feature_vector_mapping_df,
+            [self.tenant_col, self.res_col],
+        )
 
-    def _check_user_mapping(self):
-        field_map = {
-            ff.name: ff for ff in self.user_feature_vector_mapping_df.schema.fields
+        return {
+            "user_mapping_rows": user_rows,
+            "user_mapping_keys": user_keys,
+            "res_mapping_rows": res_rows,
+            "res_mapping_keys": res_keys,
         }
 
-        assert field_map.get(self.tenant_col) is not None, field_map
-        assert field_map.get(self.user_col) is not None
+    def check(self):
+        """
+        check the validity of the model (uses the known mapping_stats, e.g., of a loaded model,
+        and otherwise computes them with a single aggregation per mapping)
+        :return: boolean value where True indicating the verification succeeded
+        """
+        self._check_schema(self.user_feature_vector_mapping_df, self.user_col)
+        self._check_schema(self.res_feature_vector_mapping_df, self.res_col)
+
+        mapping_stats = (
+            self.mapping_stats
+            if self.mapping_stats is not None
+            else self.compute_mapping_stats()
+        )
 
         return (
-            self.user_feature_vector_mapping_df.select(self.tenant_col, self.user_col)
-            .distinct()
-            .count()
-            == self.user_feature_vector_mapping_df.count()
+            mapping_stats["user_mapping_rows"] == mapping_stats["user_mapping_keys"]
+            and mapping_stats["res_mapping_rows"] == mapping_stats["res_mapping_keys"]
         )
 
-    def _check_res_mapping(self):
-        field_map = {
-            ff.name: ff for ff in self.res_feature_vector_mapping_df.schema.fields
-        }
+    def _check_schema(self, mapping_df: DataFrame, name_col: str):
+        field_map = {ff.name: ff for ff in mapping_df.schema.fields}
 
         assert field_map.get(self.tenant_col) is not None, field_map
-        assert field_map.get(self.res_col) is not None
+        assert field_map.get(name_col) is not None
+
+
+def _local_top_k(
+    user_vecs: pd.Series,
+    res_vecs: pd.Series,
+    k: int,
+    seen_users: np.ndarray,
+    seen_res: np.ndarray,
+    user_components: Optional[np.ndarray] = None,
+    res_components: Optional[np.ndarray] = None,
+    max_block_elements: int = AccessAnomalyConfig.default_top_k_block_elements,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    find the k highest scoring (user, resource) pairs of a single tenant without computing all the scores:
+    users and resources are scanned in decreasing norm order, blocks of users are scored only against
+    the resources whose norm bound (a score is at most the product of the norms) reaches the current
+    k-th score, and the scan stops once no remaining user can reach it
+    :param user_vecs: the user vectors, ties are broken by the position of the user
+    :param res_vecs: the resource vectors (padded as in _make_dot), ties are broken by the position
+    :param k: the number of pairs
+    :param seen_users: the user positions of the (seen) pairs to exclude
+    :param seen_res: the resource positions of the (seen) pairs to exclude
+    :param user_components: optional components of the users, pairs of different components score +inf
+    :param res_components: the components of the resources (given together with user_components)
+    :param max_block_elements: the maximal number of scores computed at once
+    :return: the user positions, resource positions and scores ordered by decreasing score
+    """
+    num_users = len(user_vecs)
+    num_res = len(res_vecs)
+
+    user_lengths = np.array([len(v) for v in user_vecs], dtype=np.int64)
+    res_lengths = np.array([len(v) for v in res_vecs], dtype=np.int64)
+    width = max(
+        user_lengths.max() if num_users > 0 else 0,
+        res_lengths.max() if num_res > 0 else 0,
+    )
+    uniform = (user_lengths == width).all() and (res_lengths == width).all()
+    user_mat = stack_padded(user_vecs, width)
+    res_mat = stack_padded(res_vecs, width)
 
-        return (
-            self.res_feature_vector_mapping_df.select(self.tenant_col, self.res_col)
-            .distinct()
-            .count()
-            == self.res_feature_vector_mapping_df.count()
+    seen_codes = np.unique(
+        np.asarray(seen_users, dtype=np.int64) * num_res
+        + np.asarray(seen_res, dtype=np.int64),
+    )
+    seen_users = seen_codes // num_res if num_res > 0 else seen_codes
+    seen_res = seen_codes % num_res if num_res > 0 else seen_codes
+
+    top_users = [np.zeros(0, dtype=np.int64)]
+    top_res = [np.zeros(0, dtype=np.int64)]
+    top_scores = [np.zeros(0)]
+    remaining = k if num_users > 0 and num_res > 0 else 0
+
+    if user_components is not None and remaining > 0:
+        # pairs of different components score +inf, so the first ones in (user, resource) order come first
+        res_per_component = pd.Series(res_components).value_counts()
+        cross_counts = num_res - res_per_component.reindex(
+            user_components,
+            fill_value=0,
+        ).to_numpy(dtype=np.int64)
+        seen_cross = user_components[seen_users] != res_components[seen_res]
+        cross_counts -= np.bincount(seen_users[seen_cross], minlength=num_users)
+
+        last = np.searchsorted(np.cumsum(cross_counts), remaining)
+
+        for uu in np.flatnonzero(cross_counts[: last + 1] > 0):
+            rr = np.flatnonzero(res_components != user_components[uu])
+            rr = rr[~np.isin(uu * num_res + rr, seen_codes)][:remaining]
+
+            top_users.append(np.full(len(rr), uu, dtype=np.int64))
+            top_res.append(rr)
+            top_scores.append(np.full(len(rr), np.inf))
+            remaining -= len(rr)
+
+    user_norms = np.linalg.norm(user_mat, axis=1)
+    res_norms = np.linalg.norm(res_mat, axis=1)
+    user_order = np.argsort(-user_norms, kind="stable")
+    res_order = np.argsort(-res_norms, kind="stable")
+    sorted_res_norms = res_norms[res_order]
+
+    # the seen pairs by the scan position of their user
+    user_position = np.empty(num_users, dtype=np.int64)
+    user_position[user_order] = np.arange(num_users)
+    res_position = np.empty(num_res, dtype=np.int64)
+    res_position[res_order] = np.arange(num_res)
+    seen_order = np.argsort(user_position[seen_users], kind="stable")
+    seen_user_positions = user_position[seen_users][seen_order]
+    seen_res_positions = res_position[seen_res][seen_order]
+
+    best_users = np.zeros(0, dtype=np.int64)
+    best_res = np.zeros(0, dtype=np.int64)
+    best_scores = np.zeros(0)
+    threshold = -np.inf
+    start = 0
+
+    while remaining > 0 and start < num_users:
+        # only a positive k-th score bounds the norms (scores are at most the product of the norms)
+        num_candidates = (
+            int((user_norms[user_order[start]] * sorted_res_norms >= threshold).sum())
+            if threshold > 0.0
+            else num_res
         )
 
+        if num_candidates == 0:
+            break
+
+        stop = min(num_users, start + max(1, max_block_elements // num_candidates))
+        rows = user_order[start:stop]
+        cols = res_order[:num_candidates]
+
+        scores = user_mat[rows] @ res_mat[cols].T
+
+        if not uniform:
+            # the padding of both vectors beyond the longer one of the pair
+            scores -= width - np.maximum(
+                user_lengths[rows][:, None],
+                res_lengths[cols][None, :],
+            )
+
+        if user_components is not None:
+            # already taken as +inf
+            scores[
+                user_components[rows][:, None] != res_components[cols][None, :]
+            ] = np.nan
+
+        lo, hi = np.searchsorted(seen_user_positions, [start, stop])
+        in_block = seen_res_positions[lo:hi] < num_candidates
+        scores[
+            seen_user_positions[lo:hi][in_block] - start,
+            seen_res_positions[lo:hi][in_block],
+        ] = np.nan
+
+        block_users, block_res = np.nonzero(scores >= threshold)
+        block_scores = scores[block_users, block_res]
+
+        if len(block_scores) > remaining:
+            kth = np.partition(block_scores, len(block_scores) - remaining)[
+                len(block_scores) - remaining
+            ]
+            keep = block_scores >= kth
+            block_users, block_res, block_scores = (
+                block_users[keep],
+                block_res[keep],
+                block_scores[keep],
+            )
+
+        all_users = np.concatenate([best_users, rows[block_users]])
+        all_res = np.concatenate([best_res, cols[block_res]])
+        all_scores = np.concatenate([best_scores, block_scores])
+        order = np.lexsort((all_res, all_users, -all_scores))[:remaining]
+
+        best_users, best_res, best_scores = (
+            all_users[order],
+            all_res[order],
+            all_scores[order],
+        )
+
+        if len(best_scores) == remaining:
+            threshold = best_scores[-1]
+
+        start = stop
+
+    top_users.append(best_users)
+    top_res.append(best_res)
+    top_scores.append(best_scores)
+
+    return (
+        np.concatenate(top_users),
+        np.concatenate(top_res),
+        np.concatenate(top_scores),
+    )
+
 
 # noinspection PyPep8Naming
 class AccessAnomalyModel(Transformer):
@@ -220,34 +529,37 @@ class AccessAnomalyModel(Transformer):
 
         self.has_components = has_user2component_mappings and has_res2component_mappings
         self.preserve_history = True
+        self.scoring_mode = AccessAnomalyConfig.default_scoring_mode
+        self.broadcast_max_rows = AccessAnomalyConfig.default_broadcast_max_rows
+        self._mapping_rows = None
+        self._packed_model = None
+        self._packed_model_broadcast = None
 
         if self.has_components:
-            self._user_mapping_df = (
+            self._user_mapping_df = spark_utils.CacheScope.keep(
                 self.user_res_feature_vector_mapping.user_feature_vector_mapping_df.join(
                     self.user_res_feature_vector_mapping.user2component_mappings_df,
                     [self.tenant_col, self.user_col],
-                )
-                .select(
+                ).select(
                     self.tenant_col,
                     self.user_col,
                     self.user_vec_col,
                     f.col("component").alias("user_component"),
-                )
-                .cache()
+                ),
+                "AccessAnomalyModel",
             )
 
-            self._res_mapping_df = (
+            self._res_mapping_df = spark_utils.CacheScope.keep(
                 self.user_res_feature_vector_mapping.res_feature_vector_mapping_df.join(
                     self.user_res_feature_vector_mapping.res2component_mappings_df,
                     [self.tenant_col, self.res_col],
-                )
-                .select(
+                ).select(
                     self.tenant_col,
                     self.res_col,
                     self.res_vec_col,
                     f.col("component").alias("res_component"),
-                )
-                .cache()
+                ),
+                "AccessAnomalyModel",
             )
         else:
             self._user_mapping_df = (
@@ -282,9 +594,38 @@ class AccessAnomalyModel(Transformer):
                     t.BooleanType(),
                     False,
                 ),
+                t.StructField("user_mapping_rows", t.LongType(), True),
+                t.StructField("user_mapping_keys", t.LongType(), True),
+                t.StructField("res_mapping_rows", t.LongType(), True),
+                t.StructField("res_mapping_keys", t.LongType(), True),
             ],
         )
 
+    _mapping_stats_fields = [
+        "user_mapping_rows",
+        "user_mapping_keys",
+        "res_mapping_rows",
+        "res_mapping_keys",
+    ]
+
+    def mapping_stats(self) -> Optional[Dict[str, int]]:
+        """
+        :return: the row and distinct key counts of the user and resource mappings
+        (known for a loaded model, otherwise computed once), None if the model lacks a mapping
+        """
+        mapping = self.user_res_feature_vector_mapping
+
+        if (
+            mapping.user_feature_vector_mapping_df is None
+            or mapping.res_feature_vector_mapping_df is None
+        ):
+            return None
+
+        if mapping.mapping_stats is None:
+            mapping.mapping_stats = mapping.compute_mapping_stats()
+
+        return mapping.mapping_stats
+
     def save(self, path: str, path_suffix: str = "", output_format: str = "parquet"):
         dfs = [
             self.user_res_feature_vector_mapping.history_access_df,
@@ -298,6 +639,7 @@ class AccessAnomalyModel(Transformer):
         assert adf is not None
 
         spark = spark_utils.DataFrameUtils.get_spark_session(adf)
+        mapping_stats = self.mapping_stats()
 
         metadata_df = spark.createDataFrame(
             [
@@ -317,6 +659,10 @@ class AccessAnomalyModel(Transformer):
                     is not None,
                     self.user_res_feature_vector_mapping.res_feature_vector_mapping_df
                     is not None,
+                )
+                + tuple(
+                    mapping_stats[ss] if mapping_stats is not None else None
+                    for ss in AccessAnomalyModel._mapping_stats_fields
                 ),
             ],
             AccessAnomalyModel._metadata_schema(),
@@ -372,9 +718,10 @@ class AccessAnomalyModel(Transformer):
         metadata_df = spark.read.format(output_format).load(
             os.path.join(path, "metadata_df"),
         )
-        assert metadata_df.count() == 1
+        metadata_rows = metadata_df.collect()
+        assert len(metadata_rows) == 1
 
-        metadata_row = metadata_df.collect()[0]
+        metadata_row = metadata_rows[0]
 
         tenant_col = metadata_row["tenant_col"]
         user_col = metadata_row["user_col"]
@@ -393,6 +740,26 @@ class AccessAnomalyModel(Transformer):
             "has_res_feature_vector_mapping_df"
         ]
 
+        # models saved before the mapping statistics were added lack them
+        mapping_stats = (
+            {ss: metadata_row[ss] for ss in AccessAnomalyModel._mapping_stats_fields}
+            if all(
+                ss in metadata_df.columns and metadata_row[ss] is not None
+                for ss in AccessAnomalyModel._mapping_stats_fields
+            )
+            else None
+        )
+
+        if mapping_stats is not None and (
+            mapping_stats["user_mapping_rows"] != mapping_stats["user_mapping_keys"]
+            or mapping_stats["res_mapping_rows"] != mapping_stats["res_mapping_keys"]
+        ):
+            raise ValueError(
+                "the saved user or resource mappings have duplicate keys: {0}".format(
+                    mapping_stats,
+                ),
+            )
+
         history_access_df = (
             spark.read.format(output_format).load(
                 os.path.join(path, "history_access_df"),
@@ -445,6 +812,7 @@ class AccessAnomalyModel(Transformer):
                 res2component_mappings_df,
                 user_feature_vector_mapping_df,
                 res_feature_vector_mapping_df,
+                mapping_stats,
             ),
             output_col,
         )
@@ -477,8 +845,187 @@ class AccessAnomalyModel(Transformer):
     def res_mapping_df(self):
         return self._res_mapping_df
 
+    @property
+    def mapping_rows(self) -> int:
+        """
+        the total number of rows in the user, resource and history mappings
+        """
+        if self._mapping_rows is None:
+            history_access_df = self.user_res_feature_vector_mapping.history_access_df
+
+            self._mapping_rows = (
+                self.user_mapping_df.count()
+                + self.res_mapping_df.count()
+                + (history_access_df.count() if history_access_df is not None else 0)
+            )
+
+        return self._mapping_rows
+
+    def to_packed_model(self) -> PackedAccessAnomalyModel:
+        """
+        collect the mappings to the driver and pack them as numpy matrices (the result is memoized)
+        :return: the packed model
+        """
+        if self._packed_model is None:
+            self._packed_model = PackedAccessAnomalyModel.from_model(self)
+
+        return self._packed_model
+
+    def export(self, path: str):
+        """
+        write the model as a single memory mappable file for scoring without spark,
+        use PackedAccessAnomalyModel.load to read it back
+        :param path: the (local) file path
+        """
+        self.to_packed_model().save(path)
+
+    def use_broadcast(self) -> bool:
+        """
+        :return: True if transform scores using the broadcast packed mappings instead of joins
+        """
+        return (
+            self.broadcast_max_rows is not None
+            and self.mapping_rows <= self.broadcast_max_rows
+        )
+
+    def _transform_broadcast(self, df: DataFrame) -> DataFrame:
+        if self._packed_model_broadcast is None:
+            self._packed_model_broadcast = spark_utils.DataFrameUtils.get_spark_session(
+                df,
+            ).sparkContext.broadcast(self.to_packed_model())
+
+        return transform_with_packed_model(
+            df,
+            self.to_packed_model(),
+            self._packed_model_broadcast,
+            self.preserve_history,
+        )
+
+    def top_k(
+        self,
+        k: int,
+        max_block_elements: int = AccessAnomalyConfig.default_top_k_block_elements,
+    ) -> DataFrame:
+        """
+        find the k highest scoring unseen (user, resource) pairs of each tenant, i.e., the first k rows
+        per tenant of transforming all the pairs of users and resources in the mappings (except those in
+        the history) and sorting them by decreasing score, user and resource;
+        the pairs are not materialized, instead each tenant is searched in memory with norm bound pruning
+        (see _local_top_k), so a tenant's mappings and history must fit in the memory of a worker
+        :param k: the number of pairs per tenant
+        :param max_block_elements: the maximal number of scores computed at once per tenant
+        :return: a dataframe with the tenant, user, resource and output columns
+        """
+        if k <= 0:
+            raise ValueError("k must be positive: {0}".format(k))
+
+        tenant_col = self.tenant_col
+        user_col = self.user_col
+        res_col = self.res_col
+        output_col = self.output_col
+        has_components = self.has_components
+
+        kind_token = "__kind__"
+        vec_token = "__vec__"
+        component_token = "__component__"
+
+        user_mapping_df = self.user_mapping_df
+        res_mapping_df = self.res_mapping_df
+        history_access_df = self.user_res_feature_vector_mapping.history_access_df
+
+        def component(component_col: str) -> f.Column:
+            return (
+                f.col(component_col).cast(t.LongType())
+                if has_components
+                else f.lit(None).cast(t.LongType())
+            ).alias(component_token)
+
+        users_df = user_mapping_df.filter(f.col(self.user_vec_col).isNotNull(),).select(
+            tenant_col,
+            f.lit(0).alias(kind_token),
+            user_col,
+            f.lit(None).cast(res_mapping_df.schema[res_col].dataType).alias(res_col),
+            f.col(self.user_vec_col).cast(t.ArrayType(t.DoubleType())).alias(vec_token),
+            component("user_component"),
+        )
+
+        resources_df = res_mapping_df.filter(
+            f.col(self.res_vec_col).isNotNull(),
+        ).select(
+            tenant_col,
+            f.lit(1).alias(kind_token),
+            f.lit(None).cast(user_mapping_df.schema[user_col].dataType).alias(user_col),
+            res_col,
+            f.col(self.res_vec_col).cast(t.ArrayType(t.DoubleType())).alias(vec_token),
+            component("res_component"),
+        )
+
+        the_df = users_df.unionByName(resources_df)
+
+        if history_access_df is not None:
+            the_df = the_df.unionByName(
+                history_access_df.select(
+                    tenant_col,
+                    f.lit(2).alias(kind_token),
+                    user_col,
+                    res_col,
+                    f.lit(None).cast(t.ArrayType(t.DoubleType())).alias(vec_token),
+                    f.lit(None).cast(t.LongType()).alias(component_token),
+                ),
+            )
+
+        schema = t.StructType(
+            [
+                user_mapping_df.schema[tenant_col],
+                t.StructField(
+                    user_col, user_mapping_df.schema[user_col].dataType, True
+                ),
+                t.StructField(res_col, res_mapping_df.schema[res_col].dataType, True),
+                t.StructField(output_col, t.DoubleType(), True),
+            ],
+        )
+
+        def tenant_top_k(pdf: pd.DataFrame) -> pd.DataFrame:
+            kinds = pdf[kind_token].to_numpy()
+            users = pdf[kinds == 0].sort_values(user_col, kind="stable")
+            resources = pdf[kinds == 1].sort_values(res_col, kind="stable")
+            history = pdf[kinds == 2]
+
+            seen_users = pd.Index(users[user_col]).get_indexer(history[user_col])
+            seen_res = pd.Index(resources[res_col]).get_indexer(history[res_col])
+            seen = (seen_users >= 0) & (seen_res >= 0)
+
+            top_users, top_res, top_scores = _local_top_k(
+                users[vec_token],
+                resources[vec_token],
+                k,
+                seen_users[seen],
+                seen_res[seen],
+                users[component_token].to_numpy(dtype=np.int64)
+                if has_components
+                else None,
+                resources[component_token].to_numpy(dtype=np.int64)
+                if has_components
+                else None,
+                max_block_elements,
+            )
+
+            return pd.DataFrame(
+                {
+                    tenant_col: pdf[tenant_col].iloc[0],
+                    user_col: users[user_col].to_numpy()[top_users],
+                    res_col: resources[res_col].to_numpy()[top_res],
+                    output_col: top_scores,
+                },
+            )
+
+        return the_df.groupBy(tenant_col).applyInPandas(tenant_top_k, schema)
+
     def _transform(self, df: DataFrame) -> DataFrame:
-        dot = _make_dot()
+        if self.use_broadcast():
+            return self._transform_broadcast(df)
+
+        dot = _make_dot(self.scoring_mode)
 
         tenant_col = self.tenant_col
         user_col = self.user_col
@@ -535,80 +1082,245 @@ class AccessAnomalyModel(Transformer):
         )
 
 
+def _local_connected_components(
+    user_index: np.ndarray,
+    res_index: np.ndarray,
+    num_nodes: int,
+) -> np.ndarray:
+    """
+    find the connected components of a bipartite graph using a vectorized union-find
+    (hooking of roots followed by pointer jumping)
+    :param user_index: the user node of each edge (in [0, num_nodes))
+    :param res_index: the resource node of each edge (in [0, num_nodes))
+    :param num_nodes: the number of nodes
+    :return: the root of each node, nodes with the same root are in the same component
+    """
+    parent = np.arange(num_nodes)
+
+    while True:
+        user_root = parent[user_index]
+        res_root = parent[res_index]
+
+        if (user_root == res_root).all():
+            return parent
+
+        # hook the larger root under the smaller one, parent[i] <= i so no cycles are created
+        np.minimum.at(
+            parent,
+            np.maximum(user_root, res_root),
+            np.minimum(user_root, res_root),
+        )
+
+        while True:
+            grand_parent = parent[parent]
+
+            if (grand_parent == parent).all():
+                break
+
+            parent = grand_parent
+
+
 # noinspection PyPep8Naming
 class ConnectedComponents:
+    """
+    Find the connected components of the (bipartite) user-resource access graph of each tenant.
+    The component of each user and resource is the (global) index of the smallest user in it.
+
+    When the largest tenant has at most max_local_edges edges the components are computed
+    per tenant in memory (applyInPandas) with a vectorized union-find, otherwise
+    by iterative min-label propagation (at most max_iter rounds if given).
+    """
+
     def __init__(
         self,
         tenantCol: str,
         userCol: str,
         res_col: str,
         componentColName: str = "component",
+        max_local_edges: Optional[int] = AccessAnomalyConfig.default_max_local_edges,
+        max_iter: Optional[int] = None,
     ):
         self.tenant_col = tenantCol
         self.user_col = userCol
         self.res_col = res_col
         self.component_col_name = componentColName
+        self.max_local_edges = max_local_edges
+        self.max_iter = max_iter
 
-    def transform(self, df: DataFrame) -> Tuple[DataFrame, DataFrame]:
-        edges = (
-            df.select(self.tenant_col, self.user_col, self.res_col)
-            .distinct()
-            .orderBy(self.tenant_col, self.user_col, self.res_col)
-            .cache()
+    def _transform_local(
+        self,
+        edges: DataFrame,
+        user2index: DataFrame,
+    ) -> Tuple[DataFrame, DataFrame]:
+        tenant_col = self.tenant_col
+        user_col = self.user_col
+        res_col = self.res_col
+        component_col_name = self.component_col_name
+
+        schema = t.StructType(
+            [
+                edges.schema[tenant_col],
+                t.StructField(user_col, edges.schema[user_col].dataType, True),
+                t.StructField(res_col, edges.schema[res_col].dataType, True),
+                t.StructField(component_col_name, t.LongType(), False),
+            ],
         )
 
-        users = (
-            df.select(self.tenant_col, self.user_col)
-            .distinct()
-            .orderBy(self.tenant_col, self.user_col)
-            .cache()
+        def components(pdf: pd.DataFrame) -> pd.DataFrame:
+            users, user_nodes = np.unique(
+                pdf["user_component"].to_numpy(dtype=np.int64),
+                return_inverse=True,
+            )
+            res_codes, res_values = pd.factorize(pdf[res_col])
+            num_users = len(users)
+            num_nodes = num_users + len(res_values)
+
+            root = _local_connected_components(
+                user_nodes,
+                res_codes + num_users,
+                num_nodes,
+            )
+
+            # users are sorted by their global index, so the first user of each root is the smallest
+            component_of_root = np.full(num_nodes, -1, dtype=np.int64)
+            user_roots = root[:num_users]
+            first = np.unique(user_roots, return_index=True)[1]
+            component_of_root[user_roots[first]] = users[first]
+
+            user_names = (
+                pdf.drop_duplicates("user_component")
+                .set_index("user_component")[user_col]
+                .loc[users]
+                .to_numpy(dtype=object)
+            )
+
+            return pd.DataFrame(
+                {
+                    tenant_col: pdf[tenant_col].iloc[0],
+                    user_col: np.concatenate(
+                        [user_names, np.full(len(res_values), None, dtype=object)],
+                    ),
+                    res_col: np.concatenate(
+                        [
+                            np.full(num_users, None, dtype=object),
+                            np.asarray(res_values, dtype=object),
+                        ],
+                    ),
+                    component_col_name: component_of_root[root],
+                },
+            )
+
+        components_df = (
+            edges.join(user2index, [tenant_col, user_col])
+            .groupBy(tenant_col)
+            .applyInPandas(components, schema)
         )
-        user2index = spark_utils.DataFrameUtils.zip_with_index(
-            users,
-            col_name="user_component",
+        components_df = spark_utils.CacheScope.cache(
+            components_df,
+            "ConnectedComponents",
         )
-        user2components = user2index
-        res2components = None
 
-        chg = True
+        return (
+            components_df.filter(f.col(user_col).isNotNull()).select(
+                tenant_col,
+                user_col,
+                component_col_name,
+            ),
+            components_df.filter(f.col(res_col).isNotNull()).select(
+                tenant_col,
+                res_col,
+                component_col_name,
+            ),
+        )
 
-        while chg:
-            res2components = (
-                edges.join(user2components, [self.tenant_col, self.user_col])
+    def _transform_iterative(
+        self,
+        edges: DataFrame,
+        user2index: DataFrame,
+    ) -> Tuple[DataFrame, DataFrame]:
+        def label_sum(the_df: DataFrame) -> int:
+            # labels only decrease between rounds, so an unchanged sum means convergence
+            return the_df.agg(
+                f.sum(f.col("user_component").cast(t.DecimalType(38, 0))),
+            ).first()[0]
+
+        def propagate(curr_user2components: DataFrame) -> DataFrame:
+            return (
+                edges.join(curr_user2components, [self.tenant_col, self.user_col])
                 .groupBy(self.tenant_col, self.res_col)
                 .agg(f.min("user_component").alias("res_component"))
             )
 
-            next_user2components = (
-                edges.join(res2components, [self.tenant_col, self.res_col])
-                .groupBy(self.tenant_col, self.user_col)
-                .agg(f.min("res_component").alias("user_component"))
-                .cache()
-            )
+        user2components = spark_utils.CacheScope.cache(
+            user2index,
+            "ConnectedComponents",
+        )
+        curr_sum = label_sum(user2components)
+        num_iter = 0
 
-            chg = (
-                user2components.join(
-                    next_user2components,
-                    on=[self.tenant_col, self.user_col, "user_component"],
-                ).count()
-                != user2components.count()
+        while self.max_iter is None or num_iter < self.max_iter:
+            next_user2components = spark_utils.CacheScope.cache(
+                edges.join(
+                    propagate(user2components),
+                    [self.tenant_col, self.res_col],
+                )
+                .groupBy(self.tenant_col, self.user_col)
+                .agg(f.min("res_component").alias("user_component")),
+                "ConnectedComponents",
             )
 
+            next_sum = label_sum(next_user2components)
+            user2components.unpersist()
             user2components = next_user2components
+            num_iter += 1
+
+            if next_sum == curr_sum:
+                break
 
-        assert res2components is not None
+            curr_sum = next_sum
 
         return (
             user2components.select(
                 self.tenant_col,
                 self.user_col,
                 f.col("user_component").alias(self.component_col_name),
-            ).orderBy(self.tenant_col, self.user_col),
-            res2components.select(
+            ),
+            propagate(user2components).select(
                 self.tenant_col,
                 self.res_col,
                 f.col("res_component").alias(self.component_col_name),
-            ).orderBy(self.tenant_col, self.res_col),
+            ),
+        )
+
+    def transform(self, df: DataFrame) -> Tuple[DataFrame, DataFrame]:
+        edges = spark_utils.CacheScope.cache(
+            df.select(self.tenant_col, self.user_col, self.res_col).distinct(),
+            "ConnectedComponents",
+        )
+
+        users = (
+            df.select(self.tenant_col, self.user_col)
+            .distinct()
+            .orderBy(self.tenant_col, self.user_col)
+        )
+        user2index = spark_utils.DataFrameUtils.zip_with_index(
+            users,
+            col_name="user_component",
+        )
+
+        use_local = (
+            self.max_local_edges is not None
+            and (
+                edges.groupBy(self.tenant_col).count().agg(f.max("count")).first()[0]
+                or 0
+            )
+            <= self.max_local_edges
+        )
+
+        return (
+            self._transform_local(edges, user2index)
+            if use_local
+            else self._transform_iterative(edges, user2index)
         )
 
 
@@ -691,6 +1403,13 @@ class AccessAnomaly(Estimator):
         "but will increase accuracy. (defaults to False).",
     )
 
+    maxConcurrentTenants = Param(
+        Params._dummy(),
+        "maxConcurrentTenants",
+        "maxConcurrentTenants is the maximum number of tenants whose models are trained concurrently "
+        "when separateTenants is True (defaults to 4).",
+    )
+
     lowValue = Param(
         Params._dummy(),
         "lowValue",
@@ -743,6 +1462,36 @@ class AccessAnomaly(Estimator):
         "list of seen user resource pairs for which the anomaly score should be zero.",
     )
 
+    initialModel = Param(
+        Params._dummy(),
+        "initialModel",
+        "initialModel is an optional, previously trained AccessAnomalyModel (e.g., as loaded by "
+        "AccessAnomalyModel.load) used to warm start training. "
+        "Its user and resource vocabularies are reused and only extended with new users and resources, "
+        "and its latent vectors seed the factors of known users and resources, "
+        "so a small maxIter is usually sufficient. "
+        "Requires separateTenants=True: Spark's ALS does not accept initial factors, so warm started models "
+        "are trained per tenant with a local (numpy) ALS solver, and each tenant's data must fit "
+        "in the memory of a single worker.",
+    )
+
+    seedParam = Param(
+        Params._dummy(),
+        "seedParam",
+        "seedParam is an optional random seed for the complement set sampling "
+        "and the factor initialization, setting it makes training reproducible "
+        "(the default leaves the complement set sampling non deterministic).",
+    )
+
+    storageLevel = Param(
+        Params._dummy(),
+        "storageLevel",
+        "storageLevel is the pyspark.StorageLevel of the intermediate dataframes cached during fit "
+        "(e.g., StorageLevel.DISK_ONLY to avoid pinning executor memory). "
+        "The intermediates are released when fit completes, "
+        "the bytes each stage pinned are available in cache_report afterwards.",
+    )
+
     def __init__(
         self,
         tenantCol: str = AccessAnomalyConfig.default_tenant_col,
@@ -755,6 +1504,7 @@ class AccessAnomaly(Estimator):
         regParam: float = AccessAnomalyConfig.default_reg_param,
         numBlocks: Optional[int] = AccessAnomalyConfig.default_num_blocks,
         separateTenants: bool = AccessAnomalyConfig.default_separate_tenants,
+        maxConcurrentTenants: int = AccessAnomalyConfig.default_max_concurrent_tenants,
         lowValue: Optional[float] = AccessAnomalyConfig.default_low_value,
         highValue: Optional[float] = AccessAnomalyConfig.default_high_value,
         applyImplicitCf: bool = AccessAnomalyConfig.default_apply_implicit_cf,
@@ -762,8 +1512,12 @@ class AccessAnomaly(Estimator):
         complementsetFactor: Optional[int] = None,
         negScore: Optional[float] = None,
         historyAccessDf: Optional[DataFrame] = None,
+        initialModel: Optional[AccessAnomalyModel] = None,
+        seedParam: Optional[int] = None,
+        storageLevel: StorageLevel = AccessAnomalyConfig.default_storage_level,
     ):
         super().__init__()
+        self.cache_report: Optional[Dict[str, Optional[int]]] = None
 
         if applyImplicitCf:
             alphaParam = (
@@ -787,6 +1541,8 @@ class AccessAnomaly(Estimator):
                 else AccessAnomalyConfig.default_neg_score
             )
 
+        assert maxConcurrentTenants >= 1
+
         # must either both be None or both be not None
         assert (lowValue is None) == (highValue is None)
         assert lowValue is None or lowValue >= 1.0
@@ -807,6 +1563,7 @@ class AccessAnomaly(Estimator):
             regParam=regParam,
             numBlocks=numBlocks,
             separateTenants=separateTenants,
+            maxConcurrentTenants=maxConcurrentTenants,
             lowValue=lowValue,
             highValue=highValue,
             applyImplicitCf=applyImplicitCf,
@@ -814,6 +1571,9 @@ class AccessAnomaly(Estimator):
             complementsetFactor=complementsetFactor,
             negScore=negScore,
             historyAccessDf=historyAccessDf,
+            initialModel=initialModel,
+            seedParam=seedParam,
+            storageLevel=storageLevel,
         )
 
     # --- getters and setters
@@ -868,6 +1628,7 @@ class AccessAnomaly(Estimator):
                     tenant_col,
                     [indexed_user_col, indexed_res_col],
                     complementset_factor,
+                    self.seed_param,
                 )
                 .transform(indexed_df)
                 .withColumn(scaled_likelihood_col, f.lit(neg_score))
@@ -913,9 +1674,349 @@ class AccessAnomaly(Estimator):
 
         return user_mapping_df, res_mapping_df
 
+    def _train_cf_per_tenant(
+        self,
+        als: ALS,
+        df: DataFrame,
+        tenants: List,
+    ) -> Tuple[DataFrame, DataFrame]:
+        """
+        train a separate model for each tenant, running up to max_concurrent_tenants
+        Spark jobs concurrently from a driver thread pool. The latent vectors of each tenant
+        stay distributed: they are checkpointed (see CacheScope.checkpoint)
+        while the tenant's data is still cached, and the results are unioned.
+        """
+        if len(tenants) == 0:
+            raise ValueError(
+                "separateTenants requires at least one tenant, found an empty dataframe"
+            )
+
+        tenant_col = self.tenant_col
+
+        def train(curr_tenant):
+            curr_df = spark_utils.CacheScope.cache(
+                df.filter(f.col(tenant_col) == curr_tenant),
+                "AccessAnomaly.train_cf",
+            )
+
+            try:
+                curr_user_mapping_df, curr_res_mapping_df = self._train_cf(
+                    als.copy(),
+                    curr_df,
+                )
+
+                return (
+                    spark_utils.CacheScope.checkpoint(
+                        curr_user_mapping_df,
+                        "AccessAnomaly.train_cf",
+                    ),
+                    spark_utils.CacheScope.checkpoint(
+                        curr_res_mapping_df,
+                        "AccessAnomaly.train_cf",
+                    ),
+                )
+            finally:
+                curr_df.unpersist()
+
+        with ThreadPoolExecutor(
+            max_workers=min(self.max_concurrent_tenants, len(tenants)),
+        ) as executor:
+            results = list(
+                executor.map(
+                    inheritable_thread_target(
+                        spark_utils.CacheScope.inheritable(train),
+                    ),
+                    tenants,
+                )
+            )
+
+        user_mapping_df = spark_utils.DataFrameUtils.union_all(
+            [user_df for user_df, _ in results]
+        )
+        res_mapping_df = spark_utils.DataFrameUtils.union_all(
+            [res_df for _, res_df in results]
+        )
+
+        return user_mapping_df, res_mapping_df
+
+    @staticmethod
+    def _kind_token() -> str:
+        return "__kind__"
+
+    @staticmethod
+    def _index_token() -> str:
+        return "__index__"
+
+    @staticmethod
+    def _factors_token() -> str:
+        return "__factors__"
+
+    def _get_initial_mappings(self) -> Tuple[DataFrame, DataFrame]:
+        """
+        the user and resource mappings of the initial model, checkpointed so that its lineage
+        (e.g., the whole fit of a model which was not loaded) is not repeated in every plan of this fit
+        """
+        initial_model = self.initial_model
+        assert initial_model is not None
+        mapping = initial_model.user_res_feature_vector_mapping
+
+        return (
+            spark_utils.CacheScope.checkpoint(
+                mapping.user_feature_vector_mapping_df.select(
+                    self.tenant_col,
+                    self.user_col,
+                    mapping.user_vec_col,
+                ),
+                "AccessAnomaly.initial_model",
+            ),
+            spark_utils.CacheScope.checkpoint(
+                mapping.res_feature_vector_mapping_df.select(
+                    self.tenant_col,
+                    self.res_col,
+                    mapping.res_vec_col,
+                ),
+                "AccessAnomaly.initial_model",
+            ),
+        )
+
+    def _create_indexer_model(
+        self,
+        df: DataFrame,
+        initial_mappings: Optional[Tuple[DataFrame, DataFrame]] = None,
+    ) -> indexers.MultiIndexerModel:
+        user_indexer = indexers.IdIndexer(
+            input_col=self.user_col,
+            partition_key=self.tenant_col,
+            output_col=self.indexed_user_col,
+            reset_per_partition=self.separate_tenants,
+        )
+
+        res_indexer = indexers.IdIndexer(
+            input_col=self.res_col,
+            partition_key=self.tenant_col,
+            output_col=self.indexed_res_col,
+            reset_per_partition=self.separate_tenants,
+        )
+
+        initial_model = self.initial_model
+
+        if initial_model is None:
+            return indexers.MultiIndexer(indexers=[user_indexer, res_indexer]).fit(df)
+
+        initial_user_mapping_df, initial_res_mapping_df = (
+            initial_mappings
+            if initial_mappings is not None
+            else self._get_initial_mappings()
+        )
+
+        assert (
+            initial_model.tenant_col == self.tenant_col
+            and initial_model.user_col == self.user_col
+            and initial_model.res_col == self.res_col
+        )
+
+        # reuse the vocabularies of the initial model, only new users and resources get new indices
+        return indexers.MultiIndexerModel(
+            [
+                user_indexer.fit(initial_user_mapping_df).partial_fit(df),
+                res_indexer.fit(initial_res_mapping_df).partial_fit(df),
+            ],
+        )
+
+    def _create_initial_factors_df(
+        self,
+        the_indexer_model: indexers.MultiIndexerModel,
+        initial_mappings: Optional[Tuple[DataFrame, DataFrame]] = None,
+    ) -> DataFrame:
+        """
+        recover the raw latent factors of the initial model (undoing the bias folding done by
+        ModelNormalizeTransformer) keyed by the indices of the given indexer model
+        """
+        initial_model = self.initial_model
+        assert initial_model is not None
+
+        tenant_col = self.tenant_col
+        rank = self.rank_param
+        user_vec_col = initial_model.user_vec_col
+        res_vec_col = initial_model.res_vec_col
+        initial_user_mapping_df, initial_res_mapping_df = (
+            initial_mappings
+            if initial_mappings is not None
+            else self._get_initial_mappings()
+        )
+
+        user_index_model = the_indexer_model.get_model_by_input_col(self.user_col)
+        res_index_model = the_indexer_model.get_model_by_input_col(self.res_col)
+        assert user_index_model is not None and res_index_model is not None
+
+        # normalized user vectors are coeff * [factors, bias, 1.0] and resource vectors are [factors, 1.0, 0.0]
+        user_factors_df = user_index_model.transform(
+            initial_user_mapping_df.filter(
+                f.size(f.col(user_vec_col)) == rank + 2,
+            ).select(
+                tenant_col,
+                self.user_col,
+                f.transform(
+                    f.slice(f.col(user_vec_col), 1, rank),
+                    lambda x: x / f.element_at(f.col(user_vec_col), rank + 2),
+                ).alias(AccessAnomaly._factors_token()),
+            ),
+        ).select(
+            tenant_col,
+            f.lit(0).alias(AccessAnomaly._kind_token()),
+            f.col(self.indexed_user_col)
+            .cast(t.LongType())
+            .alias(AccessAnomaly._index_token()),
+            AccessAnomaly._factors_token(),
+        )
+
+        res_factors_df = res_index_model.transform(
+            initial_res_mapping_df.filter(
+                f.size(f.col(res_vec_col)) == rank + 2,
+            ).select(
+                tenant_col,
+                self.res_col,
+                f.slice(f.col(res_vec_col), 1, rank).alias(
+                    AccessAnomaly._factors_token(),
+                ),
+            ),
+        ).select(
+            tenant_col,
+            f.lit(1).alias(AccessAnomaly._kind_token()),
+            f.col(self.indexed_res_col)
+            .cast(t.LongType())
+            .alias(AccessAnomaly._index_token()),
+            AccessAnomaly._factors_token(),
+        )
+
+        return user_factors_df.unionByName(res_factors_df)
+
+    def _train_cf_warm_start(
+        self,
+        df: DataFrame,
+        initial_factors_df: DataFrame,
+    ) -> Tuple[DataFrame, DataFrame]:
+        """
+        train the latent vectors of each tenant with a local ALS solver (in applyInPandas)
+        starting from the factors of the initial model for known users and resources
+        (Spark's ALS does not support initial factors), only used when separateTenants is True
+        """
+        tenant_col = self.tenant_col
+        indexed_user_col = self.indexed_user_col
+        indexed_res_col = self.indexed_res_col
+        scaled_likelihood_col = self.scaled_likelihood_col
+        kind_token = AccessAnomaly._kind_token()
+        index_token = AccessAnomaly._index_token()
+        factors_token = AccessAnomaly._factors_token()
+        rank = self.rank_param
+        # without a seed draw one per fit (on the driver), so that an unseeded warm start is random
+        # while each tenant's stream stays the same if its task is retried
+        seed = (
+            self.seed_param
+            if self.seed_param is not None
+            else int(np.random.SeedSequence().generate_state(1)[0])
+        )
+
+        als = LocalALS(
+            rank=rank,
+            max_iter=self.max_iter,
+            reg_param=self.reg_param,
+            implicit_prefs=self.apply_implicit_cf,
+            alpha=self.alpha_param if self.alpha_param is not None else 1.0,
+        )
+
+        schema = t.StructType(
+            [
+                df.schema[tenant_col],
+                t.StructField(kind_token, t.IntegerType(), False),
+                t.StructField(index_token, t.LongType(), False),
+                t.StructField(factors_token, t.ArrayType(t.FloatType()), False),
+            ],
+        )
+
+        def train(ratings_pdf: pd.DataFrame, factors_pdf: pd.DataFrame) -> pd.DataFrame:
+            if len(ratings_pdf) == 0:
+                return pd.DataFrame(columns=schema.fieldNames())
+
+            rng = make_group_rng(seed, ratings_pdf[tenant_col].iloc[0])
+            users, user_index = np.unique(
+                ratings_pdf[indexed_user_col].to_numpy(dtype=np.int64),
+                return_inverse=True,
+            )
+            resources, res_index = np.unique(
+                ratings_pdf[indexed_res_col].to_numpy(dtype=np.int64),
+                return_inverse=True,
+            )
+
+            def initial_factors(kind: int, indices: np.ndarray) -> np.ndarray:
+                known_pdf = factors_pdf[factors_pdf[kind_token] == kind]
+
+                return warm_start_factors(
+                    indices,
+                    known_pdf[index_token].to_numpy(dtype=np.int64),
+                    np.stack(known_pdf[factors_token].to_numpy())
+                    if len(known_pdf) > 0
+                    else None,
+                    rank,
+                    rng,
+                )
+
+            user_factors, res_factors = als.fit(
+                user_index,
+                res_index,
+                ratings_pdf[scaled_likelihood_col].to_numpy(dtype=np.float64),
+                initial_factors(0, users),
+                initial_factors(1, resources),
+            )
+
+            return pd.DataFrame(
+                {
+                    tenant_col: ratings_pdf[tenant_col].iloc[0],
+                    kind_token: np.repeat([0, 1], [len(users), len(resources)]),
+                    index_token: np.concatenate([users, resources]),
+                    factors_token: list(
+                        np.concatenate([user_factors, res_factors]).astype(np.float32),
+                    ),
+                },
+            )
+
+        # both sides may originate from the same dataframe, re-alias to avoid an ambiguous self join
+        initial_factors_df = initial_factors_df.select(
+            *[f.col(cc).alias(cc) for cc in initial_factors_df.columns]
+        )
+
+        factors_df = (
+            df.select(
+                tenant_col, indexed_user_col, indexed_res_col, scaled_likelihood_col
+            )
+            .groupBy(tenant_col)
+            .cogroup(initial_factors_df.groupBy(tenant_col))
+            .applyInPandas(train, schema)
+        )
+        factors_df = spark_utils.CacheScope.cache(factors_df, "AccessAnomaly.train_cf")
+
+        user_mapping_df = factors_df.filter(f.col(kind_token) == 0).select(
+            tenant_col,
+            f.col(index_token)
+            .cast(df.schema[indexed_user_col].dataType)
+            .alias(indexed_user_col),
+            f.col(factors_token).alias(self.user_vec_col),
+        )
+
+        res_mapping_df = factors_df.filter(f.col(kind_token) == 1).select(
+            tenant_col,
+            f.col(index_token)
+            .cast(df.schema[indexed_res_col].dataType)
+            .alias(indexed_res_col),
+            f.col(factors_token).alias(self.res_vec_col),
+        )
+
+        return user_mapping_df, res_mapping_df
+
     def create_spark_model_vectors_df(
         self,
         df: DataFrame,
+        initial_factors_df: Optional[DataFrame] = None,
     ) -> _UserResourceFeatureVectorMapping:
         tenant_col = self.tenant_col
         indexed_user_col = self.indexed_user_col
@@ -923,7 +2024,10 @@ class AccessAnomaly(Estimator):
         indexed_res_col = self.indexed_res_col
         res_vec_col = self.res_vec_col
         max_iter = self.max_iter
-        distinct_tenants = df.select(tenant_col).distinct().cache()
+        distinct_tenants = spark_utils.CacheScope.cache(
+            df.select(tenant_col).distinct(),
+            "AccessAnomaly.train_cf",
+        )
         num_tenants = distinct_tenants.count()
         separate_tenants = self.separate_tenants
         num_blocks = (
@@ -951,30 +2055,25 @@ class AccessAnomaly(Estimator):
         if alpha is not None:
             als.setAlpha(alpha)
 
-        if separate_tenants:
+        if self.seed_param is not None:
+            als.setSeed(self.seed_param)
+
+        if initial_factors_df is not None:
+            user_mapping_df, res_mapping_df = self._train_cf_warm_start(
+                df,
+                initial_factors_df,
+            )
+        elif separate_tenants:
             tenants = [
                 row[tenant_col]
                 for row in distinct_tenants.orderBy(tenant_col).collect()
             ]
 
-            user_mapping_df: Optional[DataFrame] = None
-            res_mapping_df: Optional[DataFrame] = None
-
-            for curr_tenant in tenants:
-                curr_df = df.filter(f.col(tenant_col) == curr_tenant).cache()
-                curr_user_mapping_df, curr_res_mapping_df = self._train_cf(als, curr_df)
-
-                user_mapping_df = (
-                    user_mapping_df.union(curr_user_mapping_df)
-                    if user_mapping_df is not None
-                    else curr_user_mapping_df
-                )
-
-                res_mapping_df = (
-                    res_mapping_df.union(curr_res_mapping_df)
-                    if res_mapping_df is not None
-                    else curr_res_mapping_df
-                )
+            user_mapping_df, res_mapping_df = self._train_cf_per_tenant(
+                als,
+                df,
+                tenants,
+            )
         else:
             user_mapping_df, res_mapping_df = self._train_cf(als, df)
 
@@ -993,33 +2092,26 @@ class AccessAnomaly(Estimator):
             res_mapping_df,
         )
 
-    def _fit(self, df: DataFrame) -> AccessAnomalyModel:
-        # index the user and resource columns to allow running the spark ALS algorithm
-        the_indexer = indexers.MultiIndexer(
-            indexers=[
-                indexers.IdIndexer(
-                    input_col=self.user_col,
-                    partition_key=self.tenant_col,
-                    output_col=self.indexed_user_col,
-                    reset_per_partition=self.separate_tenants,
-                ),
-                indexers.IdIndexer(
-                    input_col=self.res_col,
-                    partition_key=self.tenant_col,
-                    output_col=self.indexed_res_col,
-                    reset_per_partition=self.separate_tenants,
-                ),
-            ],
+    def _fit_model(self, df: DataFrame) -> AccessAnomalyModel:
+        initial_mappings = (
+            self._get_initial_mappings() if self.initial_model is not None else None
         )
 
-        the_indexer_model = the_indexer.fit(df)
+        # index the user and resource columns to allow running the spark ALS algorithm
+        the_indexer_model = self._create_indexer_model(df, initial_mappings)
 
         # indexed_df is the dataframe with the indices for user and resource
         indexed_df = the_indexer_model.transform(df)
-        enriched_df = self._enrich_and_normalize(indexed_df).cache()
+        enriched_df = spark_utils.CacheScope.cache(
+            self._enrich_and_normalize(indexed_df),
+            "AccessAnomaly.enrich_and_normalize",
+        )
 
         user_res_feature_vector_mapping_df = self.create_spark_model_vectors_df(
             enriched_df,
+            self._create_initial_factors_df(the_indexer_model, initial_mappings)
+            if initial_mappings is not None
+            else None,
         )
         user_res_norm_cf_df_model = ModelNormalizeTransformer(
             enriched_df,
@@ -1038,12 +2130,15 @@ class AccessAnomaly(Estimator):
         indexed_res_col = self.indexed_res_col
 
         # do the actual index to name mapping (using undo_transform)
+        use_broadcast = the_indexer_model.use_broadcast()
         final_user_mapping_df = user_index_model.undo_transform(
             norm_user_mapping_df,
+            use_broadcast,
         ).drop(indexed_user_col)
-        final_res_mapping_df = res_index_model.undo_transform(norm_res_mapping_df).drop(
-            indexed_res_col,
-        )
+        final_res_mapping_df = res_index_model.undo_transform(
+            norm_res_mapping_df,
+            use_broadcast,
+        ).drop(indexed_res_col)
 
         tenant_col, user_col, res_col = self.tenant_col, self.user_col, self.res_col
 
@@ -1051,7 +2146,10 @@ class AccessAnomaly(Estimator):
         access_df = (
             history_access_df
             if history_access_df is not None
-            else df.select(tenant_col, user_col, res_col).cache()
+            else spark_utils.CacheScope.cache(
+                df.select(tenant_col, user_col, res_col),
+                "ConnectedComponents",
+            )
         )
 
         user2component_mappings_df, res2component_mappings_df = ConnectedComponents(
@@ -1068,14 +2166,43 @@ class AccessAnomaly(Estimator):
                 res_col=self.res_col,
                 res_vec_col=self.res_vec_col,
                 history_access_df=history_access_df,
-                user2component_mappings_df=user2component_mappings_df,
-                res2component_mappings_df=res2component_mappings_df,
-                user_feature_vector_mapping_df=final_user_mapping_df.cache(),
-                res_feature_vector_mapping_df=final_res_mapping_df.cache(),
+                user2component_mappings_df=spark_utils.CacheScope.keep(
+                    user2component_mappings_df,
+                    "AccessAnomalyModel",
+                ),
+                res2component_mappings_df=spark_utils.CacheScope.keep(
+                    res2component_mappings_df,
+                    "AccessAnomalyModel",
+                ),
+                user_feature_vector_mapping_df=spark_utils.CacheScope.keep(
+                    final_user_mapping_df,
+                    "AccessAnomalyModel",
+                ),
+                res_feature_vector_mapping_df=spark_utils.CacheScope.keep(
+                    final_res_mapping_df,
+                    "AccessAnomalyModel",
+                ),
             ),
             self.output_col,
         )
 
+    def _fit(self, df: DataFrame) -> AccessAnomalyModel:
+        if self.initial_model is not None and not self.separate_tenants:
+            # a model trained per tenant differs from a global one (e.g., implicit ALS couples the tenants)
+            raise ValueError(
+                "initialModel requires separateTenants=True, "
+                "as warm started models are trained per tenant"
+            )
+
+        with spark_utils.CacheScope(self.storage_level) as cache_scope:
+            # the model's own dataframes are kept (see CacheScope.keep),
+            # so they do not depend on the intermediates released with the scope
+            model = self._fit_model(df)
+
+        self.cache_report = cache_scope.pinned_bytes
+
+        return model
+
 
 class ModelNormalizeTransformer:
     """
@@ -1088,50 +2215,50 @@ class ModelNormalizeTransformer:
         self.access_df = access_df
         self.rank = rank
 
-    def _make_append_bias(
-        self,
-        user_col: str,
-        res_col: str,
-        col_name: str,
-        target_col_name: str,
+    @staticmethod
+    def _append_user_bias(
+        vec: f.Column,
+        bias: f.Column,
+        coeff: f.Column,
         rank: int,
-    ) -> f.udf:
-        assert col_name == user_col or col_name == res_col
-        assert target_col_name == user_col or target_col_name == res_col
-
-        def value_at(bias: float, value: float, i: int) -> float:
-            if col_name != target_col_name or i < rank:
-                res = value
-            elif col_name == user_col and i == rank:
-                res = bias + value
-            elif col_name == res_col and i == (rank + 1):
-                res = bias + value
-            else:
-                res = value
-
-            assert res == 1.0 if i == rank and col_name == res_col else True
-            assert res == 1.0 if i == (rank + 1) and col_name == user_col else True
-
-            return res
-
-        @f.udf(t.ArrayType(t.DoubleType()))
-        def append_bias(v: List[float], bias: float, coeff: float = 1.0) -> List[float]:
-            assert len(v) == rank or len(v) == rank + 2
-
-            if len(v) == rank:
-                # increase vector size to adjust for bias
-                fix_value = bias if col_name == target_col_name else 0.0
-                u = [fix_value, 1.0] if col_name == user_col else [1.0, fix_value]
-                return [
-                    float(coeff * value)
-                    for value in np.append(np.array(v), np.array(u))
-                ]
-            else:
-                # fix enhanced vector to adjust for another bias
-                assert len(v) == rank + 2
-                return [coeff * value_at(bias, v[i], i) for i in range(len(v))]
-
-        return append_bias
+    ) -> f.Column:
+        """
+        append the bias to a user vector: v + [bias, 1.0] for a vector of length rank,
+        or add it to entry rank of an already enhanced vector (of length rank + 2);
+        the result is multiplied by coeff
+        """
+        the_vec = vec.cast(t.ArrayType(t.DoubleType()))
+
+        enhanced_vec = (
+            f.when(
+                f.size(the_vec) == rank,
+                f.concat(the_vec, f.array(f.lit(0.0), f.lit(1.0))),
+            )
+            .when(f.size(the_vec) == rank + 2, the_vec)
+            .otherwise(f.raise_error(f.lit("unexpected user vector size")))
+        )
+
+        return f.transform(
+            enhanced_vec,
+            lambda x, i: (x + f.when(i == rank, bias).otherwise(f.lit(0.0))) * coeff,
+        )
+
+    @staticmethod
+    def _append_res_bias(vec: f.Column, rank: int) -> f.Column:
+        """
+        enhance a resource vector of length rank to v + [1.0, 0.0] to match an enhanced user vector,
+        already enhanced vectors (of length rank + 2) are kept as is
+        """
+        the_vec = vec.cast(t.ArrayType(t.DoubleType()))
+
+        return (
+            f.when(
+                f.size(the_vec) == rank,
+                f.concat(the_vec, f.array(f.lit(1.0), f.lit(0.0))),
+            )
+            .when(f.size(the_vec) == rank + 2, the_vec)
+            .otherwise(f.raise_error(f.lit("unexpected resource vector size")))
+        )
 
     def transform(
         self,
@@ -1139,7 +2266,7 @@ class ModelNormalizeTransformer:
     ) -> _UserResourceFeatureVectorMapping:
         likelihood_col_token = "__likelihood__"
 
-        dot = _make_dot()
+        dot = _make_dot(AccessAnomalyConfig.default_scoring_mode)
 
         tenant_col = user_res_cf_df_model.tenant_col
         user_col = user_res_cf_df_model.user_col
@@ -1177,19 +2304,11 @@ class ModelNormalizeTransformer:
         per_group_stats: DataFrame = scaler_model.per_group_stats
         assert isinstance(per_group_stats, DataFrame)
 
-        append2user_bias = self._make_append_bias(
-            user_col,
-            res_col,
-            user_col,
-            user_col,
-            self.rank,
-        )
-        append2res_bias = self._make_append_bias(
-            user_col,
-            res_col,
-            res_col,
-            user_col,
-            self.rank,
+        # one row per tenant, cached so the join and the dot products over access_df run once
+        # for both the user and the resource mappings
+        per_group_stats = spark_utils.CacheScope.cache(
+            per_group_stats,
+            "ModelNormalizeTransformer",
         )
 
         fixed_user_mapping_df = (
@@ -1199,7 +2318,7 @@ class ModelNormalizeTransformer:
             ).select(
                 tenant_col,
                 user_col,
-                append2user_bias(
+                ModelNormalizeTransformer._append_user_bias(
                     f.col(user_vec_col),
                     f.lit(-1.0) * f.col(scalers.StandardScalarScalerConfig.mean_token),
                     f.lit(-1.0)
@@ -1207,17 +2326,22 @@ class ModelNormalizeTransformer:
                         f.col(scalers.StandardScalarScalerConfig.std_token) != 0.0,
                         f.col(scalers.StandardScalarScalerConfig.std_token),
                     ).otherwise(f.lit(1.0)),
+                    self.rank,
                 ).alias(user_vec_col),
             )
         )
 
         fixed_res_mapping_df = user_res_cf_df_model.res_feature_vector_mapping_df.join(
-            per_group_stats,
+            f.broadcast(per_group_stats.select(tenant_col)),
             tenant_col,
+            how="left_semi",
         ).select(
             tenant_col,
             res_col,
-            append2res_bias(f.col(res_vec_col), f.lit(0)).alias(res_vec_col),
+            ModelNormalizeTransformer._append_res_bias(
+                f.col(res_vec_col),
+                self.rank,
+            ).alias(res_vec_col),
         )
 
         return user_res_cf_df_model.replace_mappings(
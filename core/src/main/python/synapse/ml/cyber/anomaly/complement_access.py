@@ -1,13 +1,113 @@
 __author__ = "rolevin"
 
-from typing import List, Optional
+import operator
+import zlib
+from functools import reduce
+from typing import Any, List, Optional
 
 from synapse.ml.cyber.utils.spark_utils import DataFrameUtils, ExplainBuilder
 
+import numpy as np
+import pandas as pd
+
 from pyspark.ml import Transformer
 from pyspark.ml.param.shared import Param, Params
 from pyspark.sql import DataFrame, functions as f, types as t
-import random
+
+
+def make_group_rng(seed: Optional[int], key: Any) -> np.random.Generator:
+    """
+    make the random generator of a group (e.g., a tenant);
+    the stream depends only on the seed and the group key so results do not depend on partitioning
+    :param seed: the seed, None for an unseeded (non reproducible) generator
+    :param key: the group key
+    """
+    if seed is None:
+        return np.random.default_rng()
+
+    return np.random.default_rng([seed, zlib.crc32(str(key).encode("utf-8"))])
+
+
+def _encode(tuples: np.ndarray, lows: np.ndarray, radices: np.ndarray) -> np.ndarray:
+    """
+    encode index tuples (rows) as a single int64 using a mixed radix representation
+    """
+    codes = np.zeros(len(tuples), dtype=np.int64)
+
+    for ii in range(tuples.shape[1]):
+        codes = codes * radices[ii] + (tuples[:, ii] - lows[ii])
+
+    return codes
+
+
+def _decode(codes: np.ndarray, lows: np.ndarray, radices: np.ndarray) -> np.ndarray:
+    tuples = np.empty((len(codes), len(radices)), dtype=np.int64)
+
+    for ii in reversed(range(len(radices))):
+        codes, tuples[:, ii] = np.divmod(codes, radices[ii])
+        tuples[:, ii] += lows[ii]
+
+    return tuples
+
+
+default_max_enumerated_cells = 1000000
+default_max_candidates_per_task = 1000000
+
+
+def sample_complement(
+    observed: np.ndarray,
+    num_candidates: int,
+    rng: np.random.Generator,
+    max_enumerated_cells: int = default_max_enumerated_cells,
+) -> np.ndarray:
+    """
+    sample (without duplicates) index tuples within the per column [min, max] limits of
+    the observed tuples which do not occur in the observed tuples
+    :param observed: the observed index tuples, a non empty int matrix (one column per indexed column)
+    :param num_candidates: the number of candidates to draw (before removing duplicates and observed)
+    :param rng: the random generator to draw the candidates with
+    :param max_enumerated_cells: when the index space has at most this many cells the complement
+        is enumerated exactly (with a dense bitmap) and min(num_candidates, |complement|)
+        tuples are sampled from it without replacement, otherwise candidates are drawn
+        uniformly and duplicates and observed tuples are rejected
+    :return: the sampled tuples, an int64 matrix with the same number of columns as observed
+    """
+    lows = observed.min(axis=0)
+    radices = observed.max(axis=0) - lows + 1
+    num_cells = np.prod(radices.astype(float))
+
+    if num_cells >= 2.0**63:
+        raise ValueError("the index space is too large to encode as int64")
+
+    observed_codes = _encode(observed, lows, radices)
+
+    if num_cells <= max_enumerated_cells:
+        seen = np.zeros(int(num_cells), dtype=bool)
+        seen[observed_codes] = True
+        complement = np.flatnonzero(~seen)
+
+        chosen = np.sort(
+            rng.choice(
+                complement,
+                size=min(num_candidates, len(complement)),
+                replace=False,
+            ),
+        )
+
+        return _decode(chosen, lows, radices)
+
+    candidates = np.unique(
+        _encode(
+            rng.integers(lows, lows + radices, size=(num_candidates, len(radices))),
+            lows,
+            radices,
+        ),
+    )
+    return _decode(
+        candidates[~np.isin(candidates, observed_codes)],
+        lows,
+        radices,
+    )
 
 
 class ComplementAccessTransformer(Transformer):
@@ -29,10 +129,36 @@ class ComplementAccessTransformer(Transformer):
         "The estimated average size of the complement set to generate",
     )
 
+    maxEnumeratedCells = Param(
+        Params._dummy(),
+        "maxEnumeratedCells",
+        "Partitions whose index space (the product of the index ranges) has at most this many "
+        "cells have their complement set enumerated exactly rather than sampled by rejection",
+    )
+
+    maxCandidatesPerTask = Param(
+        Params._dummy(),
+        "maxCandidatesPerTask",
+        "Partitions sampled by rejection have their candidates drawn in chunks of at most this many "
+        "tuples (each chunk by its own task), the observed tuples are removed with an anti join",
+    )
+
+    seedParam = Param(
+        Params._dummy(),
+        "seedParam",
+        "The random seed for sampling the complement set (None for a non reproducible sample)",
+    )
+
     """
     Given a dataframe it returns a new dataframe with access patterns sampled from
     the set of possible access patterns which did not occur in the given dataframe
     (i.e., it returns a sample from the complement set).
+
+    The per column limits of each partition are aggregated first. A partition whose index space
+    has at most maxEnumeratedCells cells is sampled by a single pandas worker holding only its
+    distinct observed tuples (at most maxEnumeratedCells of them). Larger partitions never reach
+    a single worker: their candidates are drawn in chunks of at most maxCandidatesPerTask tuples
+    and the duplicates and observed tuples are removed by Spark.
     """
 
     def __init__(
@@ -40,6 +166,9 @@ class ComplementAccessTransformer(Transformer):
         partition_key: Optional[str],
         indexed_col_names_arr: List[str],
         complementset_factor: int,
+        seed: Optional[int] = None,
+        max_enumerated_cells: int = default_max_enumerated_cells,
+        max_candidates_per_task: int = default_max_candidates_per_task,
     ):
         super().__init__()
 
@@ -49,19 +178,14 @@ class ComplementAccessTransformer(Transformer):
             partitionKey=partition_key,
             indexedColNamesArr=indexed_col_names_arr,
             complementsetFactor=complementset_factor,
+            seedParam=seed,
+            maxEnumeratedCells=max_enumerated_cells,
+            maxCandidatesPerTask=max_candidates_per_task,
         )
 
     @staticmethod
-    def _min_index_token(curr_col_name: str) -> str:
-        return "__min_{0}__".format(curr_col_name)
-
-    @staticmethod
-    def _max_index_token(curr_col_name: str) -> str:
-        return "__max_{0}__".format(curr_col_name)
-
-    @staticmethod
-    def _tuple_token() -> str:
-        return "__tuple__"
+    def _dummy_partition_key_token() -> str:
+        return "__dummy_partition_key__"
 
     def _transform(self, df: DataFrame) -> DataFrame:
         """generate a dataframe which consists of a sample from the complement set
@@ -81,128 +205,173 @@ class ComplementAccessTransformer(Transformer):
 
         the_partition_key = self.partition_key
         indexed_col_names_arr = self.indexed_col_names_arr
+        seed = self.seed_param
+        max_enumerated_cells = self.max_enumerated_cells
+        max_candidates_per_task = self.max_candidates_per_task
 
         if the_partition_key is None:
-            partition_key = "__dummy_partition_key__"
-            df = df.withColumn(partition_key, f.lit(0)).cache()
+            partition_key = ComplementAccessTransformer._dummy_partition_key_token()
+            df = df.withColumn(partition_key, f.lit(0))
         else:
             partition_key = the_partition_key
-            df = df.cache()
 
-        limits_dfs = [
-            df.select(partition_key, curr_col_name)
-            .distinct()
-            .groupBy(partition_key)
-            .agg(
-                f.min(curr_col_name).alias(
-                    ComplementAccessTransformer._min_index_token(curr_col_name),
-                ),
-                f.max(curr_col_name).alias(
-                    ComplementAccessTransformer._max_index_token(curr_col_name),
-                ),
-            )
-            .orderBy(partition_key)
-            for curr_col_name in indexed_col_names_arr
+        cols = [partition_key] + indexed_col_names_arr
+
+        schema = t.StructType([df.schema[curr_col_name] for curr_col_name in cols])
+
+        key_token = "__key__"
+        count_token = "__count__"
+        cells_token = "__cells__"
+        chunk_token = "__chunk__"
+        low_tokens = [
+            "__low_{0}__".format(ii) for ii in range(len(indexed_col_names_arr))
+        ]
+        high_tokens = [
+            "__high_{0}__".format(ii) for ii in range(len(indexed_col_names_arr))
         ]
 
-        def make_randint(factor):
-            schema = t.ArrayType(
-                t.StructType(
+        observed_df = df.select(*cols)
+        complete = f.lit(True)
+
+        for curr_col_name in indexed_col_names_arr:
+            complete = complete & f.col(curr_col_name).isNotNull()
+
+        # the limits are taken over the complete tuples while the number of candidates
+        # is proportional to all the rows of the partition;
+        # a partition without complete tuples has null cells and is left out
+        limits_df = (
+            observed_df.groupBy(partition_key)
+            .agg(
+                f.count(f.lit(1)).alias(count_token),
+                *[
+                    agg(f.when(complete, f.col(curr_col_name))).alias(token)
+                    for curr_col_name, low_token, high_token in zip(
+                        indexed_col_names_arr,
+                        low_tokens,
+                        high_tokens,
+                    )
+                    for agg, token in [(f.min, low_token), (f.max, high_token)]
+                ],
+            )
+            .withColumn(
+                cells_token,
+                reduce(
+                    operator.mul,
                     [
-                        t.StructField(curr_col_name, t.IntegerType())
-                        for curr_col_name in indexed_col_names_arr
+                        (f.col(high_token) - f.col(low_token) + 1).cast(t.DoubleType())
+                        for low_token, high_token in zip(low_tokens, high_tokens)
                     ],
                 ),
             )
+            .withColumnRenamed(partition_key, key_token)
+        )
 
-            @f.udf(schema)
-            def randint(min_index_arr, max_index_arr):
-                return [
-                    tuple(
-                        [
-                            random.randint(min_index, max_index)
-                            for min_index, max_index in zip(
-                                min_index_arr,
-                                max_index_arr,
-                            )
-                        ],
-                    )
-                    for _ in range(factor)
-                ]
-
-            return randint
+        def sample(pdf: pd.DataFrame) -> pd.DataFrame:
+            observed = pdf[indexed_col_names_arr].to_numpy(dtype=np.int64)
 
-        pre_complement_candidates_df = df.cache()
+            samples = sample_complement(
+                observed,
+                complementset_factor * int(pdf[count_token].iloc[0]),
+                make_group_rng(seed, pdf[partition_key].iloc[0]),
+                max_enumerated_cells,
+            )
 
-        for limits_df in limits_dfs:
-            pre_complement_candidates_df = pre_complement_candidates_df.join(
-                limits_df,
-                partition_key,
-            ).cache()
+            return pd.DataFrame(
+                {
+                    partition_key: pdf[partition_key].iloc[0],
+                    **{
+                        curr_col_name: samples[:, ii]
+                        for ii, curr_col_name in enumerate(indexed_col_names_arr)
+                    },
+                },
+                columns=cols,
+            )
 
-        cols = [f.col(partition_key)] + [
-            f.col(curr_col_name) for curr_col_name in indexed_col_names_arr
-        ]
-        randint = make_randint(complementset_factor)
-
-        complement_candidates_df = (
-            pre_complement_candidates_df.withColumn(
-                ComplementAccessTransformer._tuple_token(),
-                f.explode(
-                    randint(
-                        f.array(
-                            [
-                                f.col(
-                                    ComplementAccessTransformer._min_index_token(
-                                        curr_col_name,
-                                    ),
-                                )
-                                for curr_col_name in indexed_col_names_arr
-                            ],
-                        ),
-                        f.array(
-                            [
-                                f.col(
-                                    ComplementAccessTransformer._max_index_token(
-                                        curr_col_name,
-                                    ),
-                                )
-                                for curr_col_name in indexed_col_names_arr
-                            ],
-                        ),
-                    ),
+        # small index spaces: each worker gets the distinct observed tuples of a partition,
+        # hashing by the partition key also serves the distinct and the grouping (a single shuffle)
+        enumerated_df = (
+            observed_df.dropna(subset=indexed_col_names_arr)
+            .join(
+                f.broadcast(
+                    limits_df.filter(
+                        f.col(cells_token) <= max_enumerated_cells,
+                    ).select(key_token, count_token),
                 ),
+                f.col(partition_key).eqNullSafe(f.col(key_token)),
             )
-            .select(
-                *(
-                    [partition_key]
-                    + [
-                        f.col(
-                            "{0}.{1}".format(
-                                ComplementAccessTransformer._tuple_token(),
-                                curr_col_name,
-                            ),
-                        ).alias(curr_col_name)
-                        for curr_col_name in indexed_col_names_arr
-                    ]
-                )
-            )
+            .drop(key_token)
+            .repartition(partition_key)
             .distinct()
-            .orderBy(*cols)
+            .groupBy(partition_key)
+            .applyInPandas(sample, schema)
         )
 
-        tuples_df = df.select(*cols).distinct().orderBy(*cols)
+        def draw(pdf: pd.DataFrame) -> pd.DataFrame:
+            row = pdf.iloc[0]
+            chunk = int(row[chunk_token])
+            num_candidates = min(
+                max_candidates_per_task,
+                complementset_factor * int(row[count_token])
+                - chunk * max_candidates_per_task,
+            )
+            lows = row[low_tokens].to_numpy(dtype=np.int64)
+            highs = row[high_tokens].to_numpy(dtype=np.int64)
 
-        res_df = (
-            complement_candidates_df.join(
-                tuples_df,
-                [partition_key] + indexed_col_names_arr,
-                how="left_anti",
+            candidates = make_group_rng(
+                seed,
+                "{0}/{1}".format(row[key_token], chunk),
+            ).integers(lows, highs + 1, size=(num_candidates, len(lows)))
+
+            return pd.DataFrame(
+                {
+                    partition_key: row[key_token],
+                    **{
+                        curr_col_name: candidates[:, ii]
+                        for ii, curr_col_name in enumerate(indexed_col_names_arr)
+                    },
+                },
+                columns=cols,
             )
-            .select(*cols)
-            .orderBy(*cols)
+
+        # large index spaces: the candidates are drawn in bounded chunks (one task each)
+        # and the duplicates and observed tuples are removed by Spark
+        chunks_df = limits_df.filter(
+            f.col(cells_token) > max_enumerated_cells,
+        ).withColumn(
+            chunk_token,
+            f.explode(
+                f.sequence(
+                    f.lit(0).cast(t.LongType()),
+                    f.floor(
+                        (f.col(count_token) * complementset_factor - 1)
+                        / max_candidates_per_task,
+                    ),
+                ),
+            ),
+        )
+
+        observed_tokens = ["__observed_{0}__".format(ii) for ii in range(len(cols))]
+        renamed_observed_df = observed_df.select(
+            *[
+                f.col(curr_col_name).alias(token)
+                for curr_col_name, token in zip(cols, observed_tokens)
+            ],
+        )
+
+        is_observed = f.lit(True)
+
+        for curr_col_name, token in zip(cols, observed_tokens):
+            is_observed = is_observed & f.col(curr_col_name).eqNullSafe(f.col(token))
+
+        rejected_df = (
+            chunks_df.groupBy(key_token, chunk_token)
+            .applyInPandas(draw, schema)
+            .distinct()
+            .join(renamed_observed_df, is_observed, "left_anti")
         )
 
+        res_df = enumerated_df.unionByName(rejected_df)
+
         if the_partition_key is None:
             res_df = res_df.drop(partition_key)
 
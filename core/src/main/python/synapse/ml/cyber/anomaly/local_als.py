@@ -0,0 +1,220 @@
+# Copyright (C) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See LICENSE in project root for information.
+
+from typing import Optional, Tuple
+
+import numpy as np
+
+"""
+A small, in-memory alternating least squares solver (numpy only) mirroring the update rules of
+pyspark.ml.recommendation.ALS (explicit and implicit feedback, regularization scaled by the number
+of ratings, optional non-negativity). Unlike the Spark implementation it accepts initial factors,
+which allows warm starting from a previously trained model.
+It is meant to run on the data of a single tenant (e.g., inside applyInPandas).
+"""
+
+
+def _nnls(ata: np.ndarray, atb: np.ndarray, tol: float = 1e-10) -> np.ndarray:
+    """
+    solve min ||Ax - b|| s.t. x >= 0 given the normal equations (A^T A, A^T b)
+    using the Lawson-Hanson active set method
+    """
+    n = len(atb)
+    x = np.zeros(n)
+    passive = np.zeros(n, dtype=bool)
+    w = atb - ata @ x
+
+    for _ in range(3 * n):
+        if passive.all() or (w[~passive] <= tol).all():
+            break
+
+        passive[np.argmax(np.where(passive, -np.inf, w))] = True
+
+        while True:
+            z = np.zeros(n)
+            z[passive] = np.linalg.solve(ata[np.ix_(passive, passive)], atb[passive])
+
+            if (z[passive] > tol).all():
+                x = z
+                break
+
+            mask = passive & (z <= tol)
+            alpha = np.min(x[mask] / (x[mask] - z[mask]))
+            x = x + alpha * (z - x)
+            passive &= x > tol
+            x[~passive] = 0.0
+
+        w = atb - ata @ x
+
+    return x
+
+
+def random_factors(num: int, rank: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    initialize factors the way Spark's ALS does (normalized absolute gaussian vectors)
+    """
+    factors = np.abs(rng.standard_normal((num, rank)))
+    return factors / np.linalg.norm(factors, axis=1, keepdims=True)
+
+
+class LocalALS:
+    def __init__(
+        self,
+        rank: int,
+        max_iter: int,
+        reg_param: float,
+        implicit_prefs: bool,
+        alpha: float = 1.0,
+        nonnegative: bool = True,
+        chunk_size: int = 1 << 20,
+    ):
+        self.rank = rank
+        self.max_iter = max_iter
+        self.reg_param = reg_param
+        self.implicit_prefs = implicit_prefs
+        self.alpha = alpha
+        self.nonnegative = nonnegative
+        self.chunk_size = chunk_size
+
+    def _solve(
+        self,
+        num_dst: int,
+        dst_index: np.ndarray,
+        src_index: np.ndarray,
+        ratings: np.ndarray,
+        src_factors: np.ndarray,
+    ) -> np.ndarray:
+        """
+        compute the factors of the destination side given the (fixed) factors of the source side
+        """
+        rank = self.rank
+        ata = np.zeros((num_dst, rank, rank))
+        atb = np.zeros((num_dst, rank))
+
+        # as in Spark's ALS, with implicit feedback every rating adds c1 * f f^T (including negative
+        # ratings, whose confidence is alpha * |rating|) but only positive ratings add to A^T b
+        # and count towards the regularization
+        if self.implicit_prefs:
+            c1 = self.alpha * np.abs(ratings)
+            b = np.where(ratings > 0.0, 1.0 + c1, 0.0)
+            num_explicits = np.bincount(
+                dst_index,
+                weights=(ratings > 0.0).astype(float),
+                minlength=num_dst,
+            )
+            ata += src_factors.T @ src_factors
+        else:
+            c1 = np.ones(len(ratings))
+            b = ratings
+            num_explicits = np.bincount(dst_index, minlength=num_dst).astype(float)
+
+        # A^T A is symmetric: accumulate its upper triangle with one (vectorized) bincount per entry
+        upper = np.zeros((num_dst, rank, rank))
+
+        for start in range(0, len(ratings), self.chunk_size):
+            chunk = slice(start, start + self.chunk_size)
+            dst = dst_index[chunk]
+            ff = src_factors[src_index[chunk]]
+            weighted = c1[chunk, None] * ff
+
+            for ii in range(rank):
+                atb[:, ii] += np.bincount(
+                    dst,
+                    weights=b[chunk] * ff[:, ii],
+                    minlength=num_dst,
+                )
+
+                for jj in range(ii, rank):
+                    upper[:, ii, jj] += np.bincount(
+                        dst,
+                        weights=weighted[:, ii] * ff[:, jj],
+                        minlength=num_dst,
+                    )
+
+        rows, cols = np.triu_indices(rank, 1)
+        upper[:, cols, rows] = upper[:, rows, cols]
+        ata += upper
+
+        ata += (self.reg_param * num_explicits)[:, None, None] * np.eye(rank)
+
+        # entities without any (positive) rating keep a zero vector, as their system is singular
+        solvable = num_explicits > 0
+        dst_factors = np.zeros((num_dst, rank))
+
+        if solvable.any():
+            dst_factors[solvable] = np.linalg.solve(
+                ata[solvable],
+                atb[solvable][:, :, None],
+            )[:, :, 0]
+
+        if self.nonnegative:
+            for ii in np.nonzero(solvable & (dst_factors < 0.0).any(axis=1))[0]:
+                dst_factors[ii] = _nnls(ata[ii], atb[ii])
+
+        return dst_factors
+
+    def fit(
+        self,
+        user_index: np.ndarray,
+        item_index: np.ndarray,
+        ratings: np.ndarray,
+        user_factors: np.ndarray,
+        item_factors: np.ndarray,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        run max_iter alternating iterations starting from the given factors
+        :param user_index: dense (0-based) user index of each rating
+        :param item_index: dense (0-based) item index of each rating
+        :param ratings: the ratings
+        :param user_factors: initial user factors of shape (num_users, rank)
+        :param item_factors: initial item factors of shape (num_items, rank)
+        :return: the trained user and item factors
+        """
+        assert user_factors.shape[1] == self.rank and item_factors.shape[1] == self.rank
+
+        ratings = ratings.astype(float)
+
+        for _ in range(self.max_iter):
+            item_factors = self._solve(
+                len(item_factors),
+                item_index,
+                user_index,
+                ratings,
+                user_factors,
+            )
+            user_factors = self._solve(
+                len(user_factors),
+                user_index,
+                item_index,
+                ratings,
+                item_factors,
+            )
+
+        return user_factors, item_factors
+
+
+def warm_start_factors(
+    indices: np.ndarray,
+    known_indices: np.ndarray,
+    known_factors: Optional[np.ndarray],
+    rank: int,
+    rng: np.random.Generator,
+) -> np.ndarray:
+    """
+    build the initial factors for the given entities, reusing known factors where available
+    and initializing the rest randomly
+    :param indices: the (sorted, unique) entity indices to build factors for
+    :param known_indices: the entity indices which have known factors
+    :param known_factors: the known factors (aligned with known_indices)
+    :return: a matrix of shape (len(indices), rank)
+    """
+    factors = random_factors(len(indices), rank, rng)
+
+    if known_factors is not None and len(known_indices) > 0:
+        order = np.argsort(known_indices)
+        sorted_known = known_indices[order]
+        pos = np.minimum(np.searchsorted(sorted_known, indices), len(sorted_known) - 1)
+        found = sorted_known[pos] == indices
+        factors[found] = known_factors[order][pos[found]]
+
+    return factors
@@ -0,0 +1,523 @@
+# Copyright (C) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See LICENSE in project root for information.
+
+import json
+import numbers
+import struct
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+"""
+In-memory (numpy only) representation of an AccessAnomalyModel.
+The latent vectors are packed into dense matrices and the (tenant, name) keys
+are kept sorted so that lookups are vectorized binary searches.
+This module intentionally does not depend on pyspark.
+
+PackedAccessAnomalyModel.save writes a single file which load maps back with np.memmap:
+    magic (8 bytes) | header length (little endian uint64) | json header | arrays
+The header holds the column names and the dtype, shape and offset of every array;
+each array starts at a 64 byte aligned offset. Latent vectors are stored as float32 matrices,
+keys as sorted fixed width byte strings prefixed by the tenant (so the keys of a tenant
+form a contiguous sorted range) and components as int64.
+
+A key encodes each of its values as utf-8 followed by a 0xFF terminator (a byte which utf-8 never uses)
+and a null value as 0xFE 0xFF, so keys never end with a NUL byte (which numpy strips from byte strings)
+and distinct values (including the empty string and null) never collide.
+"""
+
+_key_terminator = b"\xff"
+_null_key_value = b"\xfe"
+_file_magic = b"SMLAAM02"
+_file_alignment = 64
+
+
+def stack_padded(arrays: pd.Series, width: int) -> np.ndarray:
+    """
+    stack a series of 1-D arrays into a 2-D matrix padding shorter rows with 1.0 (bias padding)
+    :param arrays: the arrays to stack (must not contain nulls)
+    :param width: the number of columns of the resulting matrix
+    :return: a matrix of shape (len(arrays), width)
+    """
+    lengths = np.array([len(a) for a in arrays], dtype=np.int64)
+    mat = np.ones((len(arrays), width))
+
+    if len(arrays) > 0 and lengths.sum() > 0:
+        mat[np.arange(width) < lengths[:, None]] = np.concatenate(arrays.to_numpy())
+
+    return mat
+
+
+def _encode_key_value(value: Any) -> bytes:
+    """
+    encode a single value of a key, integral numbers are encoded the same whatever their type
+    (e.g., a tenant 1 read as int64 or as float64 because of nulls in its column)
+    """
+    if value is None or (not isinstance(value, (str, bytes)) and pd.isna(value)):
+        encoded = _null_key_value
+    elif isinstance(value, (bool, np.bool_)):
+        encoded = str(bool(value)).encode("utf-8")
+    elif isinstance(value, numbers.Integral):
+        encoded = str(int(value)).encode("utf-8")
+    elif isinstance(value, numbers.Real) and float(value).is_integer():
+        encoded = str(int(value)).encode("utf-8")
+    elif isinstance(value, numbers.Real):
+        encoded = repr(float(value)).encode("utf-8")
+    else:
+        encoded = str(value).encode("utf-8")
+
+    return encoded + _key_terminator
+
+
+def make_keys(*cols: Any) -> np.ndarray:
+    """
+    make sortable byte string keys out of the given columns (e.g., tenant and user)
+    :param cols: pandas series, numpy arrays or lists of equal lengths
+    :return: a numpy array of byte strings
+    """
+    assert len(cols) > 0
+
+    encoded_cols = [
+        [_encode_key_value(vv) for vv in pd.Series(col, dtype=object)] for col in cols
+    ]
+
+    return np.array(
+        [b"".join(values) for values in zip(*encoded_cols)], dtype=np.bytes_
+    )
+
+
+def make_key(*values: Any) -> bytes:
+    """
+    the scalar version of make_keys
+    """
+    return b"".join(_encode_key_value(vv) for vv in values)
+
+
+def sorted_find(sorted_keys: np.ndarray, key: bytes) -> int:
+    """
+    the scalar version of sorted_lookup
+    """
+    if len(sorted_keys) == 0:
+        return -1
+
+    pos = min(int(np.searchsorted(sorted_keys, key)), len(sorted_keys) - 1)
+    return pos if sorted_keys[pos] == key else -1
+
+
+def sorted_lookup(sorted_keys: np.ndarray, keys: np.ndarray) -> np.ndarray:
+    """
+    find the positions of keys in sorted_keys
+    :return: the position of each key or -1 if the key is missing
+    """
+    if len(sorted_keys) == 0:
+        return np.full(len(keys), -1, dtype=np.int64)
+
+    pos = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+    return np.where(sorted_keys[pos] == keys, pos, -1).astype(np.int64)
+
+
+class PackedLatentMapping:
+    """
+    A mapping from (tenant, name) to a latent vector, and optionally a connected component.
+    Vectors are stored as rows of a dense matrix padded with 1.0 to a common width;
+    the original lengths are kept so padding semantics match the row-wise dot product.
+    """
+
+    def __init__(
+        self,
+        keys: np.ndarray,
+        vectors: np.ndarray,
+        lengths: np.ndarray,
+        components: Optional[np.ndarray] = None,
+    ):
+        assert len(keys) == vectors.shape[0] == len(lengths)
+        assert components is None or len(components) == len(keys)
+
+        self.keys = keys
+        self.vectors = vectors
+        self.lengths = lengths
+        self.components = components
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def width(self) -> int:
+        return self.vectors.shape[1]
+
+    @staticmethod
+    def from_pandas(
+        pdf: pd.DataFrame,
+        tenant_col: str,
+        name_col: str,
+        vec_col: str,
+        component_col: Optional[str] = None,
+        width: Optional[int] = None,
+    ) -> "PackedLatentMapping":
+        keys = make_keys(pdf[tenant_col], pdf[name_col])
+        order = np.argsort(keys, kind="stable")
+        vectors = pdf[vec_col].iloc[order]
+        lengths = vectors.map(len).to_numpy(dtype=np.int64)
+        the_width = (
+            width if width is not None else (int(lengths.max()) if len(lengths) else 0)
+        )
+
+        return PackedLatentMapping(
+            keys[order],
+            stack_padded(vectors, the_width),
+            lengths,
+            pdf[component_col].to_numpy(dtype=np.int64)[order]
+            if component_col is not None
+            else None,
+        )
+
+    def lookup(self, keys: np.ndarray) -> np.ndarray:
+        return sorted_lookup(self.keys, keys)
+
+    def find(self, key: bytes) -> int:
+        return sorted_find(self.keys, key)
+
+    def to_arrays(self, prefix: str) -> Dict[str, np.ndarray]:
+        arrays = {
+            prefix + "_keys": self.keys,
+            prefix + "_vectors": self.vectors.astype(np.float32),
+            prefix + "_lengths": self.lengths.astype(np.int32),
+        }
+
+        if self.components is not None:
+            arrays[prefix + "_components"] = self.components.astype(np.int64)
+
+        return arrays
+
+    @staticmethod
+    def from_arrays(
+        arrays: Dict[str, np.ndarray],
+        prefix: str,
+    ) -> "PackedLatentMapping":
+        return PackedLatentMapping(
+            arrays[prefix + "_keys"],
+            arrays[prefix + "_vectors"],
+            arrays[prefix + "_lengths"],
+            arrays.get(prefix + "_components"),
+        )
+
+
+class PackedAccessAnomalyModel:
+    """
+    A numpy only scorer which reproduces the scores of an AccessAnomalyModel.
+    Use from_model to build it out of a (fitted or loaded) AccessAnomalyModel.
+    """
+
+    def __init__(
+        self,
+        tenant_col: str,
+        user_col: str,
+        res_col: str,
+        output_col: str,
+        users: PackedLatentMapping,
+        resources: PackedLatentMapping,
+        history_keys: Optional[np.ndarray] = None,
+    ):
+        assert users.width == resources.width
+        assert (users.components is None) == (resources.components is None)
+
+        self.tenant_col = tenant_col
+        self.user_col = user_col
+        self.res_col = res_col
+        self.output_col = output_col
+        self.users = users
+        self.resources = resources
+        self.history_keys = history_keys
+
+    @property
+    def has_components(self) -> bool:
+        return self.users.components is not None
+
+    @property
+    def num_rows(self) -> int:
+        return (
+            len(self.users)
+            + len(self.resources)
+            + (len(self.history_keys) if self.history_keys is not None else 0)
+        )
+
+    @staticmethod
+    def from_model(model: Any) -> "PackedAccessAnomalyModel":
+        """
+        collect the mappings of an AccessAnomalyModel to the driver and pack them
+        :param model: the AccessAnomalyModel
+        :return: the packed model
+        """
+        tenant_col = model.tenant_col
+        user_col = model.user_col
+        res_col = model.res_col
+
+        user_pdf = model.user_mapping_df.toPandas()
+        res_pdf = model.res_mapping_df.toPandas()
+
+        width = max(
+            [
+                int(pdf[vec_col].map(len).max())
+                for pdf, vec_col in [
+                    (user_pdf, model.user_vec_col),
+                    (res_pdf, model.res_vec_col),
+                ]
+                if len(pdf) > 0
+            ]
+            + [0]
+        )
+
+        history_access_df = model.user_res_feature_vector_mapping.history_access_df
+
+        if history_access_df is not None:
+            history_pdf = history_access_df.toPandas()
+            history_keys = np.unique(
+                make_keys(
+                    history_pdf[tenant_col],
+                    history_pdf[user_col],
+                    history_pdf[res_col],
+                ),
+            )
+        else:
+            history_keys = None
+
+        return PackedAccessAnomalyModel(
+            tenant_col,
+            user_col,
+            res_col,
+            model.output_col,
+            PackedLatentMapping.from_pandas(
+                user_pdf,
+                tenant_col,
+                user_col,
+                model.user_vec_col,
+                "user_component" if model.has_components else None,
+                width,
+            ),
+            PackedLatentMapping.from_pandas(
+                res_pdf,
+                tenant_col,
+                res_col,
+                model.res_vec_col,
+                "res_component" if model.has_components else None,
+                width,
+            ),
+            history_keys,
+        )
+
+    def score(
+        self,
+        tenants: Any,
+        users: Any,
+        resources: Any,
+        preserve_history: bool = True,
+    ) -> np.ndarray:
+        """
+        score user, resource access pairs
+        :return: the anomaly scores (nan where either the user or the resource is unknown)
+        """
+        user_rows = self.users.lookup(make_keys(tenants, users))
+        res_rows = self.resources.lookup(make_keys(tenants, resources))
+
+        scores = np.full(len(user_rows), np.nan)
+        found = (user_rows >= 0) & (res_rows >= 0)
+        uu = user_rows[found]
+        rr = res_rows[found]
+
+        # entries beyond the length of both vectors are padding on both sides and contribute 1.0 each
+        values = np.einsum(
+            "ij,ij->i",
+            self.users.vectors[uu],
+            self.resources.vectors[rr],
+            dtype=np.float64,
+        ) - (
+            self.users.width
+            - np.maximum(self.users.lengths[uu], self.resources.lengths[rr])
+        )
+
+        if self.has_components:
+            values = np.where(
+                self.users.components[uu] == self.resources.components[rr],
+                values,
+                np.inf,
+            )
+
+        scores[found] = values
+
+        if preserve_history and self.history_keys is not None:
+            seen = (
+                sorted_lookup(self.history_keys, make_keys(tenants, users, resources))
+                >= 0
+            )
+            scores[seen] = 0.0
+
+        return scores
+
+    def transform_pandas(
+        self,
+        pdf: pd.DataFrame,
+        preserve_history: bool = True,
+    ) -> pd.DataFrame:
+        """
+        add the anomaly score column to a pandas dataframe
+        :param pdf: a dataframe with the tenant, user and resource columns
+        :param preserve_history: score seen access pairs with zero
+        :return: the dataframe with the output column appended
+        """
+        return pdf.assign(
+            **{
+                self.output_col: self.score(
+                    pdf[self.tenant_col],
+                    pdf[self.user_col],
+                    pdf[self.res_col],
+                    preserve_history,
+                ),
+            }
+        )
+
+    def score_one(
+        self,
+        tenant: Any,
+        user: Any,
+        res: Any,
+        preserve_history: bool = True,
+    ) -> float:
+        """
+        score a single access event, this avoids the (pandas) overhead of score
+        :return: the anomaly score (nan if either the user or the resource is unknown)
+        """
+        if (
+            preserve_history
+            and self.history_keys is not None
+            and sorted_find(self.history_keys, make_key(tenant, user, res)) >= 0
+        ):
+            return 0.0
+
+        uu = self.users.find(make_key(tenant, user))
+        rr = self.resources.find(make_key(tenant, res))
+
+        if uu < 0 or rr < 0:
+            return np.nan
+
+        if (
+            self.has_components
+            and self.users.components[uu] != self.resources.components[rr]
+        ):
+            return np.inf
+
+        return float(
+            np.dot(self.users.vectors[uu], self.resources.vectors[rr])
+            - (
+                self.users.width
+                - max(self.users.lengths[uu], self.resources.lengths[rr])
+            )
+        )
+
+    def save(self, path: str):
+        """
+        write the model to a single file (see the module documentation for the layout)
+        :param path: the file path
+        """
+        arrays = {
+            **self.users.to_arrays("user"),
+            **self.resources.to_arrays("res"),
+        }
+
+        if self.history_keys is not None:
+            arrays["history_keys"] = self.history_keys
+
+        def align(offset: int) -> int:
+            return -(-offset // _file_alignment) * _file_alignment
+
+        # the offsets depend on the header length, so lay out the arrays relative to the data start
+        layout = {}
+        offset = 0
+
+        for name, arr in arrays.items():
+            layout[name] = {
+                "dtype": arr.dtype.str,
+                "shape": list(arr.shape),
+                "offset": offset,
+            }
+            offset = align(offset + arr.nbytes)
+
+        header = json.dumps(
+            {
+                "tenant_col": self.tenant_col,
+                "user_col": self.user_col,
+                "res_col": self.res_col,
+                "output_col": self.output_col,
+                "arrays": layout,
+            },
+        ).encode("utf-8")
+
+        data_start = align(len(_file_magic) + 8 + len(header))
+
+        with open(path, "wb") as fp:
+            fp.write(_file_magic)
+            fp.write(struct.pack("<Q", len(header)))
+            fp.write(header)
+
+            for name, arr in arrays.items():
+                fp.seek(data_start + layout[name]["offset"])
+                fp.write(np.ascontiguousarray(arr).tobytes())
+
+            fp.truncate(data_start + offset)
+
+    @staticmethod
+    def load(path: str, mmap_mode: Optional[str] = "r") -> "PackedAccessAnomalyModel":
+        """
+        load a model written by save
+        :param path: the file path
+        :param mmap_mode: the np.memmap mode ('r' maps the file read only),
+        None reads the arrays into memory
+        :return: the packed model
+        """
+        with open(path, "rb") as fp:
+            magic = fp.read(len(_file_magic))
+
+            if magic != _file_magic:
+                raise ValueError(f"{path} is not a packed access anomaly model")
+
+            (header_len,) = struct.unpack("<Q", fp.read(8))
+            header = json.loads(fp.read(header_len).decode("utf-8"))
+
+        data_start = -(-(len(_file_magic) + 8 + header_len) // _file_alignment) * (
+            _file_alignment
+        )
+
+        arrays = {}
+
+        for name, spec in header["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            shape = tuple(spec["shape"])
+            offset = data_start + spec["offset"]
+
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.empty(shape, dtype=dtype)
+            elif mmap_mode is not None:
+                arrays[name] = np.memmap(
+                    path,
+                    dtype=dtype,
+                    mode=mmap_mode,
+                    offset=offset,
+                    shape=shape,
+                )
+            else:
+                arrays[name] = np.fromfile(
+                    path,
+                    dtype=dtype,
+                    count=int(np.prod(shape)),
+                    offset=offset,
+                ).reshape(shape)
+
+        return PackedAccessAnomalyModel(
+            header["tenant_col"],
+            header["user_col"],
+            header["res_col"],
+            header["output_col"],
+            PackedLatentMapping.from_arrays(arrays, "user"),
+            PackedLatentMapping.from_arrays(arrays, "res"),
+            arrays.get("history_keys"),
+        )
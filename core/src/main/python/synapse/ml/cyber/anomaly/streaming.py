@@ -0,0 +1,150 @@
+# Copyright (C) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See LICENSE in project root for information.
+
+import threading
+import time
+from collections import deque
+from typing import Callable, List, NamedTuple, Optional
+
+from synapse.ml.cyber.anomaly.collaborative_filtering import (
+    AccessAnomalyModel,
+    transform_with_packed_model,
+)
+from synapse.ml.cyber.anomaly.packed_model import PackedAccessAnomalyModel
+from synapse.ml.cyber.utils import spark_utils
+
+from pyspark.broadcast import Broadcast
+from pyspark.sql import DataFrame
+from pyspark.sql.streaming import DataStreamWriter
+
+
+class ScoringBatchMetrics(NamedTuple):
+    batch_id: int
+    model_version: int
+    # the end-to-end time of the micro-batch: scoring is lazy, so it runs within the sink's write
+    batch_seconds: float
+
+
+class _ModelSnapshot(NamedTuple):
+    version: int
+    packed_model: PackedAccessAnomalyModel
+    packed_model_broadcast: Broadcast
+
+
+class StreamingAccessAnomalyScorer:
+    """
+    Score a Structured Streaming dataframe of access events with an AccessAnomalyModel.
+    The model is collected once into a packed (numpy) snapshot which is broadcast to the executors,
+    so micro-batches are scored without joining with the model's mappings.
+    swap_model replaces the snapshot while the query is running;
+    the next micro-batch is scored with the new model.
+
+    Usage:
+        scorer = StreamingAccessAnomalyScorer(model, lambda df, batch_id: df.write.saveAsTable(...))
+        query = scorer.write_stream(access_stream_df).start()
+        ...
+        scorer.swap_model(retrained_model)
+    """
+
+    def __init__(
+        self,
+        model: AccessAnomalyModel,
+        sink: Callable[[DataFrame, int], None],
+        preserve_history: bool = True,
+        max_metrics: int = 1000,
+    ):
+        """
+        :param model: the initial model
+        :param sink: called with the scored dataframe and the batch id of every micro-batch
+        :param preserve_history: score seen access pairs with zero
+        :param max_metrics: the number of most recent micro-batch metrics to keep
+        """
+        self.sink = sink
+        self.preserve_history = preserve_history
+        self._metrics = deque(maxlen=max_metrics)
+        self._lock = threading.Lock()
+        self._snapshot: Optional[_ModelSnapshot] = None
+        self.swap_model(model)
+
+    @property
+    def model_version(self) -> int:
+        """
+        the version of the current snapshot (1 for the initial model, incremented by swap_model)
+        """
+        assert self._snapshot is not None
+        return self._snapshot.version
+
+    @property
+    def batch_metrics(self) -> List[ScoringBatchMetrics]:
+        """
+        the metrics of the most recent micro-batches (oldest first)
+        """
+        with self._lock:
+            return list(self._metrics)
+
+    def swap_model(self, model: AccessAnomalyModel) -> int:
+        """
+        replace the model used to score subsequent micro-batches
+        :param model: the new model
+        :return: the version of the new snapshot
+        """
+        packed_model = model.to_packed_model()
+        packed_model_broadcast = spark_utils.DataFrameUtils.get_spark_session(
+            model.user_mapping_df,
+        ).sparkContext.broadcast(packed_model)
+
+        with self._lock:
+            old_snapshot = self._snapshot
+            self._snapshot = _ModelSnapshot(
+                old_snapshot.version + 1 if old_snapshot is not None else 1,
+                packed_model,
+                packed_model_broadcast,
+            )
+            version = self._snapshot.version
+
+        # executors still scoring with the old snapshot re-fetch it from the driver if needed
+        if old_snapshot is not None:
+            old_snapshot.packed_model_broadcast.unpersist()
+
+        return version
+
+    def transform(self, df: DataFrame) -> DataFrame:
+        """
+        score a (batch or streaming) dataframe with the current snapshot
+        """
+        with self._lock:
+            snapshot = self._snapshot
+
+        return self._transform_snapshot(df, snapshot)
+
+    def _transform_snapshot(self, df: DataFrame, snapshot: _ModelSnapshot) -> DataFrame:
+        return transform_with_packed_model(
+            df,
+            snapshot.packed_model,
+            snapshot.packed_model_broadcast,
+            self.preserve_history,
+        )
+
+    def process_batch(self, batch_df: DataFrame, batch_id: int):
+        """
+        score a micro-batch and pass it to the sink (the foreachBatch function)
+        """
+        with self._lock:
+            snapshot = self._snapshot
+
+        start = time.perf_counter()
+        self.sink(self._transform_snapshot(batch_df, snapshot), batch_id)
+        batch_seconds = time.perf_counter() - start
+
+        with self._lock:
+            self._metrics.append(
+                ScoringBatchMetrics(batch_id, snapshot.version, batch_seconds),
+            )
+
+    def write_stream(self, stream_df: DataFrame) -> DataStreamWriter:
+        """
+        :param stream_df: a streaming dataframe with the tenant, user and resource columns
+        :return: a writer (to configure the trigger, checkpoint location, etc. and start)
+        which scores every micro-batch and passes it to the sink
+        """
+        return stream_df.writeStream.foreachBatch(self.process_batch)
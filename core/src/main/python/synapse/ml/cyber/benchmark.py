@@ -0,0 +1,542 @@
+# Copyright (C) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See LICENSE in project root for information.
+
+import argparse
+import functools
+import json
+import tempfile
+import time
+import urllib.request
+from typing import Any, Dict, List, Optional, Tuple
+
+from synapse.ml.cyber.anomaly.collaborative_filtering import (
+    AccessAnomaly,
+    AccessAnomalyConfig,
+    AccessAnomalyModel,
+    ConnectedComponents,
+    ModelNormalizeTransformer,
+    _UserResourceFeatureVectorMapping,
+)
+from synapse.ml.cyber.anomaly.complement_access import ComplementAccessTransformer
+from synapse.ml.cyber.dataset import DistributedDataFactory
+from synapse.ml.cyber.feature.indexers import MultiIndexerModel
+from synapse.ml.cyber.utils.spark_utils import CacheScope
+
+from pyspark.sql import DataFrame, SparkSession, Window, functions as f
+
+"""
+End-to-end benchmark of AccessAnomaly.fit and AccessAnomalyModel.transform on generated data
+(see DistributedDataFactory) at several scales, reported as JSON.
+
+Every scale is run twice:
+the first run measures the total fit and transform wall time as is,
+the second measures every stage (the functions in benchmark_stages) by materializing its output,
+so that lazily evaluated work is attributed to the stage which defines it rather than to its consumer.
+When the Spark UI is enabled, the shuffle bytes of each stage (through the job group of its jobs)
+and the peak executor memory are taken from the UI's REST API.
+Optionally, AccessAnomalyModel.top_k is compared with scoring all the unseen pairs and sorting them,
+and the scoring modes of AccessAnomalyModel (see _make_dot) are compared on the training data.
+
+Usage:
+    python -m synapse.ml.cyber.benchmark --scales tiny,small --top-k 100 --output results.json
+    python -m synapse.ml.cyber.benchmark --scales small --compare-scoring-modes
+"""
+
+# stage name -> (owner, function name)
+benchmark_stages = {
+    "indexing": (AccessAnomaly, "_create_indexer_model"),
+    "scaling": (AccessAnomaly, "_get_scaled_df"),
+    "complement_sampling": (ComplementAccessTransformer, "_transform"),
+    "als": (AccessAnomaly, "create_spark_model_vectors_df"),
+    "normalization": (ModelNormalizeTransformer, "transform"),
+    "connected_components": (ConnectedComponents, "transform"),
+    "scoring": (AccessAnomalyModel, "_transform"),
+}
+
+# scale name -> (DistributedDataFactory arguments, ratio of each department's resources accessed by a user)
+benchmark_scales = {
+    "tiny": ({"num_tenants": 2}, 0.25),
+    "small": (
+        {
+            "num_tenants": 4,
+            "department_sizes": {"hr": (70, 300), "fin": (50, 250), "eng": (100, 500)},
+        },
+        0.1,
+    ),
+    "medium": (
+        {
+            "num_tenants": 10,
+            "department_sizes": {
+                "hr": (700, 3000),
+                "fin": (500, 2500),
+                "eng": (1000, 5000),
+            },
+        },
+        0.02,
+    ),
+    "large": (
+        {
+            "num_tenants": 20,
+            "department_sizes": {
+                "hr": (7000, 30000),
+                "fin": (5000, 25000),
+                "eng": (10000, 50000),
+            },
+        },
+        0.002,
+    ),
+}
+
+
+def _materialize(result: Any, stage: str) -> Any:
+    """
+    compute (and cache, so consumers do not recompute it) every dataframe in result
+    """
+    if isinstance(result, DataFrame):
+        CacheScope.cache(result, stage).count()
+    elif isinstance(result, tuple):
+        for rr in result:
+            _materialize(rr, stage)
+    elif isinstance(result, _UserResourceFeatureVectorMapping):
+        _materialize(result.user_feature_vector_mapping_df, stage)
+        _materialize(result.res_feature_vector_mapping_df, stage)
+    elif isinstance(result, MultiIndexerModel):
+        for model in result.models:
+            _materialize(model.vocab_df, stage)
+
+    return result
+
+
+class StageTimer:
+    """
+    Time the benchmark stages while active (a context manager which wraps their functions).
+    Nested stages are timed inclusively, without materialize the times are those of the calls only
+    (i.e., of the eagerly evaluated parts of the stages).
+    """
+
+    def __init__(self, spark: SparkSession, materialize: bool = True):
+        self.spark = spark
+        self.materialize = materialize
+        self.seconds: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+        self.job_groups: Dict[str, str] = {}
+        self._originals: List[Tuple[Any, str, Any]] = []
+        self._run_id = "{0}".format(time.time_ns())
+
+    def _wrap(self, stage: str, func):
+        timer = self
+        sc = self.spark.sparkContext
+        job_group = "benchmark-{0}-{1}".format(self._run_id, stage)
+        self.job_groups[stage] = job_group
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            previous_group = sc.getLocalProperty("spark.jobGroup.id")
+            sc.setLocalProperty("spark.jobGroup.id", job_group)
+            start = time.perf_counter()
+
+            try:
+                result = func(*args, **kwargs)
+
+                if timer.materialize:
+                    _materialize(result, stage)
+            finally:
+                timer.seconds[stage] = (
+                    timer.seconds.get(stage, 0.0) + time.perf_counter() - start
+                )
+                timer.calls[stage] = timer.calls.get(stage, 0) + 1
+                sc.setLocalProperty("spark.jobGroup.id", previous_group)
+
+            return result
+
+        return timed
+
+    def __enter__(self) -> "StageTimer":
+        for stage, (owner, name) in benchmark_stages.items():
+            original = owner.__dict__[name]
+            self._originals.append((owner, name, original))
+            wrapped = (
+                staticmethod(self._wrap(stage, original.__func__))
+                if isinstance(original, staticmethod)
+                else self._wrap(stage, original)
+            )
+            setattr(owner, name, wrapped)
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for owner, name, original in reversed(self._originals):
+            setattr(owner, name, original)
+
+        self._originals = []
+
+
+class SparkMetrics:
+    """
+    Read stage and executor metrics from the REST API of the Spark UI (None when the UI is disabled)
+    """
+
+    def __init__(self, spark: SparkSession):
+        self.spark = spark
+        sc = spark.sparkContext
+        self.base_url = (
+            "{0}/api/v1/applications/{1}".format(sc.uiWebUrl, sc.applicationId)
+            if sc.uiWebUrl is not None
+            else None
+        )
+
+    def _get(self, endpoint: str) -> Optional[Any]:
+        if self.base_url is None:
+            return None
+
+        # the status store is updated by the listener bus, wait for the pending events
+        self.spark.sparkContext._jsc.sc().listenerBus().waitUntilEmpty()
+
+        with urllib.request.urlopen(self.base_url + endpoint) as response:
+            return json.loads(response.read().decode("utf-8"))
+
+    def shuffle_bytes(self, job_group: str) -> Optional[Dict[str, int]]:
+        """
+        :return: the shuffle bytes read and written by the jobs of the given job group
+        """
+        tracker = self.spark.sparkContext.statusTracker()
+        job_infos = [
+            tracker.getJobInfo(job_id)
+            for job_id in tracker.getJobIdsForGroup(job_group)
+        ]
+        stage_ids = set(
+            stage_id
+            for job_info in job_infos
+            if job_info is not None
+            for stage_id in job_info.stageIds
+        )
+
+        stages = self._get("/stages") if len(stage_ids) > 0 else []
+
+        if stages is None:
+            return None
+
+        selected = [ss for ss in stages if ss["stageId"] in stage_ids]
+
+        return {
+            "shuffle_read_bytes": sum(ss.get("shuffleReadBytes", 0) for ss in selected),
+            "shuffle_write_bytes": sum(
+                ss.get("shuffleWriteBytes", 0) for ss in selected
+            ),
+        }
+
+    def peak_executor_memory(self) -> Optional[int]:
+        """
+        :return: the maximal peak JVM (heap and off heap) memory over the executors, if reported
+        """
+        executors = self._get("/allexecutors")
+
+        if executors is None:
+            return None
+
+        peaks = [
+            ee["peakMemoryMetrics"].get("JVMHeapMemory", 0)
+            + ee["peakMemoryMetrics"].get("JVMOffHeapMemory", 0)
+            for ee in executors
+            if ee.get("peakMemoryMetrics") is not None
+        ]
+
+        return max(peaks) if len(peaks) > 0 else None
+
+
+def compare_top_k(model: AccessAnomalyModel, k: int) -> Dict[str, Any]:
+    """
+    time AccessAnomalyModel.top_k against transforming all the unseen pairs and sorting them per tenant
+    :return: the JSON serializable results of the comparison
+    """
+    tenant_col = model.tenant_col
+    user_col = model.user_col
+    res_col = model.res_col
+    output_col = model.output_col
+    history_access_df = model.user_res_feature_vector_mapping.history_access_df
+
+    candidates_df = model.user_mapping_df.select(tenant_col, user_col).join(
+        model.res_mapping_df.select(tenant_col, res_col),
+        tenant_col,
+    )
+
+    if history_access_df is not None:
+        candidates_df = candidates_df.join(
+            history_access_df,
+            [tenant_col, user_col, res_col],
+            how="left_anti",
+        )
+
+    num_candidates = candidates_df.count()
+    rank_token = "__rank__"
+
+    start = time.perf_counter()
+    sorted_rows = (
+        model.transform(candidates_df)
+        .filter(f.col(output_col).isNotNull())
+        .withColumn(
+            rank_token,
+            f.row_number().over(
+                Window.partitionBy(tenant_col).orderBy(
+                    f.desc(output_col),
+                    user_col,
+                    res_col,
+                ),
+            ),
+        )
+        .filter(f.col(rank_token) <= k)
+        .select(tenant_col, user_col, res_col)
+        .collect()
+    )
+    transform_sort_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    top_k_rows = model.top_k(k).select(tenant_col, user_col, res_col).collect()
+    top_k_seconds = time.perf_counter() - start
+
+    return {
+        "k": k,
+        "num_candidates": num_candidates,
+        "transform_sort_seconds": transform_sort_seconds,
+        "top_k_seconds": top_k_seconds,
+        "same_pairs": set(sorted_rows) == set(top_k_rows),
+    }
+
+
+def compare_scoring_modes(model: AccessAnomalyModel, df: DataFrame) -> Dict[str, Any]:
+    """
+    time AccessAnomalyModel.transform of df with each scoring mode and compare their scores
+    :return: the JSON serializable results of the comparison
+    """
+    original_scoring_mode = model.scoring_mode
+    key_cols = [model.tenant_col, model.user_col, model.res_col]
+    output_col = model.output_col
+    results = {}
+    scores = {}
+
+    try:
+        for scoring_mode in ["native", "pandas", "udf"]:
+            model.scoring_mode = scoring_mode
+            start = time.perf_counter()
+            scores[scoring_mode] = (
+                model.transform(df)
+                .select(*key_cols, f.col(output_col).alias(scoring_mode))
+                .cache()
+            )
+            scores[scoring_mode].count()
+            results[scoring_mode] = {"seconds": time.perf_counter() - start}
+    finally:
+        model.scoring_mode = original_scoring_mode
+
+    joined_df = scores["native"]
+
+    for scoring_mode in ["pandas", "udf"]:
+        joined_df = joined_df.join(scores[scoring_mode], key_cols)
+
+    max_abs_diff = joined_df.select(
+        f.max(f.abs(f.col("native") - f.col("pandas"))).alias("pandas"),
+        f.max(f.abs(f.col("native") - f.col("udf"))).alias("udf"),
+    ).first()
+
+    for scoring_mode in ["pandas", "udf"]:
+        results[scoring_mode]["max_abs_diff_from_native"] = max_abs_diff[scoring_mode]
+
+    for scored_df in scores.values():
+        scored_df.unpersist()
+
+    return results
+
+
+def stage_results(timer: StageTimer, metrics: SparkMetrics) -> Dict[str, Any]:
+    """
+    :return: the JSON serializable results of every benchmark stage,
+    stages which did not run with the given arguments (e.g., complement sampling,
+    which only runs with applyImplicitCf=False) are reported as skipped
+    """
+    stages = {}
+
+    for stage in benchmark_stages:
+        if stage not in timer.seconds:
+            stages[stage] = {"skipped": True, "calls": 0}
+            continue
+
+        stages[stage] = {
+            "skipped": False,
+            "seconds": timer.seconds[stage],
+            "calls": timer.calls[stage],
+        }
+        shuffle_bytes = metrics.shuffle_bytes(timer.job_groups[stage])
+
+        if shuffle_bytes is not None:
+            stages[stage].update(shuffle_bytes)
+
+    return stages
+
+
+def run_scale(
+    spark: SparkSession,
+    scale: str,
+    factory_args: Dict[str, Any],
+    ratio: float,
+    access_anomaly_args: Optional[Dict[str, Any]] = None,
+    top_k: Optional[int] = None,
+    scoring_modes: bool = False,
+) -> Dict[str, Any]:
+    """
+    benchmark AccessAnomaly on a single scale
+    :param top_k: if given, also compare AccessAnomalyModel.top_k with transform and sort (see compare_top_k)
+    :param scoring_modes: whether to also compare the scoring modes (see compare_scoring_modes)
+    :return: the JSON serializable results of the scale
+    """
+    metrics = SparkMetrics(spark)
+    training_df = CacheScope.cache(
+        DistributedDataFactory(**factory_args).create_clustered_training_data(
+            spark,
+            ratio,
+        ),
+        "benchmark",
+    )
+    num_edges = training_df.count()
+
+    def run(
+        materialize: bool,
+    ) -> Tuple[float, float, StageTimer, AccessAnomalyModel]:
+        estimator = AccessAnomaly(
+            tenantCol=AccessAnomalyConfig.default_tenant_col,
+            **(access_anomaly_args or {}),
+        )
+
+        with StageTimer(spark, materialize) as timer:
+            start = time.perf_counter()
+            model = estimator.fit(training_df)
+            fit_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            model.transform(training_df).count()
+            transform_seconds = time.perf_counter() - start
+
+        return fit_seconds, transform_seconds, timer, model
+
+    # the totals without materializing the stages
+    fit_seconds, transform_seconds, _, _ = run(False)
+    spark.catalog.clearCache()
+    CacheScope.cache(training_df, "benchmark").count()
+
+    _, _, timer, model = run(True)
+
+    result = {
+        "scale": scale,
+        "num_edges": num_edges,
+        "fit_seconds": fit_seconds,
+        "transform_seconds": transform_seconds,
+        "stages": stage_results(timer, metrics),
+        "peak_executor_memory_bytes": metrics.peak_executor_memory(),
+    }
+
+    if top_k is not None:
+        result["top_k"] = compare_top_k(model, top_k)
+
+    if scoring_modes:
+        result["scoring_modes"] = compare_scoring_modes(model, training_df)
+
+    spark.catalog.clearCache()
+
+    return result
+
+
+def run_benchmark(
+    spark: SparkSession,
+    scales: List[str],
+    access_anomaly_args: Optional[Dict[str, Any]] = None,
+    top_k: Optional[int] = None,
+    scoring_modes: bool = False,
+) -> Dict[str, Any]:
+    """
+    :param scales: names of scales in benchmark_scales
+    :param access_anomaly_args: additional arguments of AccessAnomaly
+    :param top_k: if given, also compare AccessAnomalyModel.top_k with transform and sort
+    :param scoring_modes: whether to also compare the scoring modes of AccessAnomalyModel
+    :return: the JSON serializable results of all the scales
+    """
+    for scale in scales:
+        if scale not in benchmark_scales:
+            raise ValueError("unknown scale: {0}".format(scale))
+
+    sc = spark.sparkContext
+
+    # ALS truncates the lineage of its iterations only when a checkpoint directory is set
+    if sc._jsc.sc().getCheckpointDir().isEmpty():
+        sc.setCheckpointDir(tempfile.mkdtemp(prefix="cyber_benchmark_"))
+
+    return {
+        "spark_version": spark.version,
+        "default_parallelism": spark.sparkContext.defaultParallelism,
+        "shuffle_partitions": int(spark.conf.get("spark.sql.shuffle.partitions")),
+        "results": [
+            run_scale(
+                spark,
+                scale,
+                benchmark_scales[scale][0],
+                benchmark_scales[scale][1],
+                access_anomaly_args,
+                top_k,
+                scoring_modes,
+            )
+            for scale in scales
+        ],
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="benchmark synapse.ml.cyber")
+    parser.add_argument(
+        "--scales",
+        default="tiny,small",
+        help="comma separated scales ({0})".format(", ".join(benchmark_scales)),
+    )
+    parser.add_argument("--master", default="local[*]")
+    parser.add_argument("--driver-memory", default="4g")
+    parser.add_argument(
+        "--access-anomaly-args",
+        default="{}",
+        help="AccessAnomaly arguments as JSON, e.g., '{\"applyImplicitCf\": false}'",
+    )
+    parser.add_argument(
+        "--top-k",
+        type=int,
+        default=None,
+        help="compare AccessAnomalyModel.top_k with transform and sort for this k",
+    )
+    parser.add_argument(
+        "--compare-scoring-modes",
+        action="store_true",
+        help="time AccessAnomalyModel.transform with each scoring mode and compare their scores",
+    )
+    parser.add_argument("--output", default=None, help="a JSON file (default stdout)")
+    args = parser.parse_args(argv)
+
+    spark = (
+        SparkSession.builder.master(args.master)
+        .appName("synapse.ml.cyber benchmark")
+        .config("spark.driver.memory", args.driver_memory)
+        .getOrCreate()
+    )
+
+    results = run_benchmark(
+        spark,
+        args.scales.split(","),
+        json.loads(args.access_anomaly_args),
+        args.top_k,
+        args.compare_scoring_modes,
+    )
+    output = json.dumps(results, indent=2)
+
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
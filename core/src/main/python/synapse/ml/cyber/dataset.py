@@ -1,12 +1,15 @@
 # Copyright (C) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License. See LICENSE in project root for information.
 
-from typing import List, Set, Optional, Tuple
+from typing import Dict, Iterator, List, Set, Optional, Tuple
+import numpy as np
 import pandas as pd
 import random
 
 from synapse.ml.cyber.anomaly.collaborative_filtering import AccessAnomalyConfig
 
+from pyspark.sql import DataFrame, SparkSession, types as t
+
 
 class DataFactory:
     def __init__(
@@ -276,3 +279,282 @@ class DataFactory:
         ]
 
         return self.to_pdf(users, resources, likelihoods)
+
+
+class DistributedDataFactory:
+    """
+    Generate access data with the cluster structure of DataFactory.create_clustered_training_data
+    (departments whose users access the department's resources, optionally all joined by a shared
+    'ffa' resource) at benchmark scale.
+
+    The edges are generated by Spark tasks (mapInPandas over blocks of users) with vectorized numpy
+    random generators seeded by (seed, tenant, department, block), so the output is reproducible
+    and does not depend on the number of executors.
+    Resource popularity within a department follows a power law, and cross-department noise
+    edges can be added.
+
+    Usage:
+        factory = DistributedDataFactory(
+            num_tenants=100,
+            department_sizes={"hr": (70000, 30000), "fin": (50000, 25000), "eng": (100000, 50000)},
+        )
+        factory.create_clustered_training_data(spark, ratio=0.001).write.parquet(path)
+    """
+
+    default_department_sizes = {"hr": (7, 30), "fin": (5, 25), "eng": (10, 50)}
+
+    def __init__(
+        self,
+        num_tenants: int = 1,
+        department_sizes: Optional[Dict[str, Tuple[int, int]]] = None,
+        single_component: bool = True,
+        popularity_exponent: float = 1.0,
+        users_per_block: int = 10000,
+        seed: int = 42,
+    ):
+        """
+        :param num_tenants: the number of tenants (each with its own copy of the departments)
+        :param department_sizes: the number of users and resources of each department
+        (defaults to those of DataFactory)
+        :param single_component: whether all users also access the shared 'ffa' resource
+        :param popularity_exponent: the exponent of the power law of resource popularity
+        (the k-th most popular resource of a department is accessed with probability ~ 1 / k^exponent),
+        0 means uniform popularity
+        :param users_per_block: the number of users whose edges are generated by a single task
+        :param seed: the random seed
+        """
+        assert num_tenants > 0
+        assert users_per_block > 0
+
+        self.num_tenants = num_tenants
+        self.department_sizes = (
+            department_sizes
+            if department_sizes is not None
+            else DistributedDataFactory.default_department_sizes
+        )
+        self.single_component = single_component
+        self.popularity_exponent = popularity_exponent
+        self.users_per_block = users_per_block
+        self.seed = seed
+
+    @staticmethod
+    def _schema() -> t.StructType:
+        return t.StructType(
+            [
+                t.StructField(AccessAnomalyConfig.default_tenant_col, t.StringType()),
+                t.StructField(AccessAnomalyConfig.default_user_col, t.StringType()),
+                t.StructField(AccessAnomalyConfig.default_res_col, t.StringType()),
+                t.StructField(
+                    AccessAnomalyConfig.default_likelihood_col, t.DoubleType()
+                ),
+            ],
+        )
+
+    def _blocks(self) -> pd.DataFrame:
+        """
+        :return: a row per task: tenant, department (index), block (index) and range of users
+        """
+        rows = []
+
+        for tenant in range(self.num_tenants):
+            for dep, (num_users, _) in enumerate(self.department_sizes.values()):
+                for block, start in enumerate(
+                    range(0, num_users, self.users_per_block)
+                ):
+                    rows.append(
+                        (
+                            tenant,
+                            dep,
+                            block,
+                            start,
+                            min(start + self.users_per_block, num_users),
+                        ),
+                    )
+
+        return pd.DataFrame(
+            rows,
+            columns=["tenant", "dep", "block", "start", "end"],
+        ).astype(np.int64)
+
+    def _generate(
+        self,
+        spark: SparkSession,
+        kind: int,
+        ratio: float,
+        noise_ratio: float,
+    ) -> DataFrame:
+        """
+        :param kind: 0 for training data, 1 for inter-department test data (only noise edges)
+        :param ratio: the (approximate) fraction of the department's resources accessed by each user
+        :param noise_ratio: the (approximate) fraction of the other departments' resources
+        accessed by each user
+        """
+        department_names = list(self.department_sizes.keys())
+        department_sizes = list(self.department_sizes.values())
+        num_resources = np.array([nr for _, nr in department_sizes], dtype=np.int64)
+        # the resources of all the departments, numbered consecutively
+        resource_offsets = np.concatenate([[0], np.cumsum(num_resources)])
+        seed = self.seed
+        single_component = self.single_component
+        exponent = self.popularity_exponent
+        users_per_block = self.users_per_block
+
+        def popularity_cdf(nr: int) -> np.ndarray:
+            weights = 1.0 / np.arange(1, nr + 1, dtype=np.float64) ** exponent
+            cdf = np.cumsum(weights)
+            return cdf / cdf[-1]
+
+        def block_edges(
+            rng: np.random.Generator,
+            dep: int,
+            block: int,
+            start: int,
+            end: int,
+        ) -> Tuple[np.ndarray, np.ndarray]:
+            users = np.arange(start, end, dtype=np.int64)
+            nr = num_resources[dep]
+            edge_users = []
+            edge_resources = []
+
+            if kind == 0 and nr > 0:
+                # every user accesses at least one resource of the department
+                counts = np.maximum(rng.binomial(nr, ratio, size=len(users)), 1)
+                edge_users.append(np.repeat(users, counts))
+                edge_resources.append(
+                    resource_offsets[dep]
+                    + np.minimum(
+                        np.searchsorted(
+                            popularity_cdf(nr),
+                            rng.random(counts.sum()),
+                            side="right",
+                        ),
+                        nr - 1,
+                    ),
+                )
+
+                # every resource is accessed by at least one user (each block covers a share of them)
+                num_blocks = -(-department_sizes[dep][0] // users_per_block)
+                covered = np.arange(block, nr, num_blocks, dtype=np.int64)
+                edge_users.append(rng.integers(start, end, size=len(covered)))
+                edge_resources.append(resource_offsets[dep] + covered)
+
+            num_other = resource_offsets[-1] - nr
+
+            if noise_ratio > 0.0 and num_other > 0:
+                counts = rng.binomial(num_other, noise_ratio, size=len(users))
+                other = rng.integers(0, num_other, size=counts.sum())
+                edge_users.append(np.repeat(users, counts))
+                # skip over the resources of the user's own department
+                edge_resources.append(
+                    np.where(other < resource_offsets[dep], other, other + nr),
+                )
+
+            if len(edge_users) == 0:
+                return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+            # drop duplicate edges
+            codes = np.unique(
+                np.concatenate(edge_users) * resource_offsets[-1]
+                + np.concatenate(edge_resources),
+            )
+
+            return codes // resource_offsets[-1], codes % resource_offsets[-1]
+
+        def resource_names(resources: np.ndarray) -> pd.Series:
+            deps = np.searchsorted(resource_offsets, resources, side="right") - 1
+            prefixes = pd.Series(
+                [department_names[dd] + "_res_" for dd in range(len(department_names))],
+            )
+
+            return prefixes.iloc[deps].reset_index(drop=True) + pd.Series(
+                resources - resource_offsets[deps]
+            ).astype(str)
+
+        def generate(it: Iterator[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+            for blocks_pdf in it:
+                for tenant, dep, block, start, end in blocks_pdf.itertuples(
+                    index=False,
+                ):
+                    rng = np.random.default_rng([seed, kind, tenant, dep, block])
+                    users, resources = block_edges(rng, dep, block, start, end)
+                    user_names = (
+                        department_names[dep]
+                        + "_user_"
+                        + pd.Series(
+                            users,
+                        ).astype(str)
+                    )
+
+                    pdfs = [
+                        pd.DataFrame(
+                            {
+                                AccessAnomalyConfig.default_user_col: user_names,
+                                AccessAnomalyConfig.default_res_col: resource_names(
+                                    resources,
+                                ),
+                            },
+                        ),
+                    ]
+
+                    if single_component:
+                        pdfs.append(
+                            pd.DataFrame(
+                                {
+                                    AccessAnomalyConfig.default_user_col: department_names[
+                                        dep
+                                    ]
+                                    + "_user_"
+                                    + pd.Series(np.arange(start, end)).astype(str),
+                                    AccessAnomalyConfig.default_res_col: "ffa",
+                                },
+                            ),
+                        )
+
+                    # plain python strings (pyarrow backed string columns are chunked, which Spark does not accept)
+                    pdf = pd.concat(pdfs, ignore_index=True).astype(object)
+                    pdf.insert(
+                        0,
+                        AccessAnomalyConfig.default_tenant_col,
+                        pd.Series(["tenant_" + str(tenant)] * len(pdf), dtype=object),
+                    )
+                    pdf[AccessAnomalyConfig.default_likelihood_col] = rng.integers(
+                        500,
+                        1001,
+                        size=len(pdf),
+                    ).astype(np.float64)
+
+                    yield pdf
+
+        blocks_pdf = self._blocks()
+
+        return (
+            spark.createDataFrame(blocks_pdf)
+            .repartition(len(blocks_pdf))
+            .mapInPandas(generate, DistributedDataFactory._schema())
+        )
+
+    def create_clustered_training_data(
+        self,
+        spark: SparkSession,
+        ratio: float = 0.25,
+        noise_ratio: float = 0.0,
+    ) -> DataFrame:
+        """
+        the counterpart of DataFactory.create_clustered_training_data (with a tenant column)
+        :param ratio: the (approximate) fraction of the department's resources accessed by each user
+        :param noise_ratio: the (approximate) fraction of the other departments' resources
+        accessed by each user (cross-cluster noise)
+        """
+        return self._generate(spark, 0, ratio, noise_ratio)
+
+    def create_clustered_inter_test_data(
+        self,
+        spark: SparkSession,
+        ratio: float = 0.03,
+    ) -> DataFrame:
+        """
+        the counterpart of DataFactory.create_clustered_inter_test_data (with a tenant column),
+        i.e., users accessing resources of other departments
+        :param ratio: the (approximate) fraction of the other departments' resources accessed by each user
+        """
+        return self._generate(spark, 1, 0.0, ratio)
@@ -1,17 +1,36 @@
 __author__ = "rolevin"
 
-from typing import List
+import os
+from typing import List, Optional
 
 from synapse.ml.cyber.utils.spark_utils import (
+    CacheScope,
     DataFrameUtils,
     ExplainBuilder,
     HasSetInputCol,
     HasSetOutputCol,
 )
 
+from pyspark import SQLContext
 from pyspark.ml import Estimator, Transformer
 from pyspark.ml.param.shared import HasInputCol, HasOutputCol, Param, Params
-from pyspark.sql import DataFrame, functions as f
+from pyspark.sql import DataFrame, functions as f, types as t
+from pyspark.sql.window import Window
+
+# MultiIndexerModel applies all vocabularies with broadcast joins (a single pass without shuffles)
+# when the largest vocabulary has at most this many rows
+default_broadcast_max_rows = 1000000
+
+"""
+The layout of a saved IdIndexerModel (see IdIndexerModel.save), all written and read with spark:
+    metadata_df             the columns and reset_per_partition (a single row)
+    versions_df             the vocabulary versions (one row per version, appended by every update)
+    vocab/<version>         the vocabulary entries of each version, version 0 holds the initial vocabulary
+                            and every IdIndexerModel.update adds a version with only the new values
+    partition_max/<version> the maximal index of each partition in a version (one row per partition),
+                            so that update can number the new values without aggregating the vocabulary
+"""
+_vocab_store_format_version = 1
 
 
 class IdIndexerModel(Transformer, HasSetInputCol, HasSetOutputCol):
@@ -28,6 +47,7 @@ class IdIndexerModel(Transformer, HasSetInputCol, HasSetOutputCol):
         partition_key: str,
         output_col: str,
         vocab_df: DataFrame,
+        reset_per_partition: bool = True,
     ):
         super().__init__()
         ExplainBuilder.build(
@@ -37,19 +57,304 @@ class IdIndexerModel(Transformer, HasSetInputCol, HasSetOutputCol):
             outputCol=output_col,
         )
         self._vocab_df = vocab_df
+        self._reset_per_partition = reset_per_partition
+        self._vocab_size = None
+        self._store_path: Optional[str] = None
+
+    @property
+    def vocab_df(self) -> DataFrame:
+        return self._vocab_df
+
+    @property
+    def reset_per_partition(self) -> bool:
+        return self._reset_per_partition
+
+    @property
+    def vocab_size(self) -> int:
+        """
+        the number of rows in the vocabulary (the result is memoized)
+        """
+        if self._vocab_size is None:
+            self._vocab_size = self._vocab_df.count()
+
+        return self._vocab_size
+
+    @staticmethod
+    def _offset_token() -> str:
+        return "__offset__"
+
+    def _partition_max_df(self, vocab_df: DataFrame) -> DataFrame:
+        """
+        :return: the maximal index of each partition of vocab_df (as the column _offset_token)
+        """
+        return vocab_df.groupBy(self.partition_key).agg(
+            f.max(self.output_col).alias(IdIndexerModel._offset_token()),
+        )
 
-    def undo_transform(self, df: DataFrame) -> DataFrame:
-        ucols = [self.partition_key, self.output_col]
+    def _new_values_df(self, df: DataFrame) -> DataFrame:
+        """
+        :return: the distinct (partition key, value) pairs of df which are not in the vocabulary
+        """
+        ucols = [self.partition_key, self.input_col]
+
+        return (
+            df.select(ucols)
+            .distinct()
+            .join(self._vocab_df.select(ucols), ucols, "left_anti")
+        )
+
+    def _index_new_values(
+        self,
+        new_values_df: DataFrame,
+        partition_max_df: DataFrame,
+    ) -> DataFrame:
+        """
+        number the new values consecutively after the maximal index
+        (of their partition if reset_per_partition is True)
+        :param new_values_df: the new (partition key, value) pairs
+        :param partition_max_df: the maximal index of each partition (see _partition_max_df)
+        :return: the vocabulary entries of the new values
+        """
+        partition_key = self.partition_key
+        input_col = self.input_col
+        output_col = self.output_col
+        offset_token = IdIndexerModel._offset_token()
+
+        if self.reset_per_partition:
+            return (
+                DataFrameUtils.zip_with_index(
+                    df=new_values_df,
+                    start_index=1,
+                    col_name=output_col,
+                    partition_col=partition_key,
+                    order_by_col=input_col,
+                )
+                .join(partition_max_df, partition_key, how="left")
+                .select(
+                    partition_key,
+                    input_col,
+                    (
+                        f.col(output_col) + f.coalesce(f.col(offset_token), f.lit(0))
+                    ).alias(
+                        output_col,
+                    ),
+                )
+            )
+        else:
+            offset = partition_max_df.agg(f.max(offset_token)).first()[0]
+
+            return DataFrameUtils.zip_with_index(
+                df=new_values_df.orderBy(partition_key, input_col),
+                start_index=(offset if offset is not None else 0) + 1,
+                col_name=output_col,
+            )
+
+    def partial_fit(self, df: DataFrame) -> "IdIndexerModel":
+        """extend the vocabulary with the values of df which it does not contain yet (append-only)
+
+        Existing values keep their indices; new values are numbered consecutively after the current
+        maximal index (of their partition if reset_per_partition is True).
+
+        Parameters
+        ----------
+        df: a dataframe containing the partition key and input columns
+
+        Returns
+        -------
+        a new model with the extended vocabulary
+        """
         vocab_df = self._vocab_df
+        new_vocab_df = self._index_new_values(
+            self._new_values_df(df),
+            self._partition_max_df(vocab_df),
+        )
+
+        return IdIndexerModel(
+            self.input_col,
+            self.partition_key,
+            self.output_col,
+            CacheScope.cache(vocab_df.unionByName(new_vocab_df), "IdIndexer"),
+            self.reset_per_partition,
+        )
+
+    @staticmethod
+    def _version_name(version: int) -> str:
+        return "v{0:05d}".format(version)
+
+    @staticmethod
+    def _metadata_schema() -> t.StructType:
+        return t.StructType(
+            [
+                t.StructField("format_version", t.IntegerType(), False),
+                t.StructField("input_col", t.StringType(), False),
+                t.StructField("partition_key", t.StringType(), False),
+                t.StructField("output_col", t.StringType(), False),
+                t.StructField("reset_per_partition", t.BooleanType(), False),
+            ],
+        )
+
+    @staticmethod
+    def _versions_schema() -> t.StructType:
+        return t.StructType([t.StructField("version", t.StringType(), False)])
+
+    def _write_version(self, path: str, version: str, vocab_df: DataFrame):
+        """
+        write the vocabulary entries of a version and the maximal index of each of their partitions,
+        the version is visible to load only once it is appended to versions_df
+        """
+        spark = DataFrameUtils.get_spark_session(vocab_df)
+        vocab_path = os.path.join(path, "vocab", version)
+
+        vocab_df.write.parquet(vocab_path)
+
+        # aggregate the written entries rather than computing vocab_df again
+        self._partition_max_df(spark.read.parquet(vocab_path)).write.parquet(
+            os.path.join(path, "partition_max", version),
+        )
+
+        spark.createDataFrame(
+            [(version,)],
+            IdIndexerModel._versions_schema(),
+        ).write.mode("append").parquet(os.path.join(path, "versions_df"))
+
+    @staticmethod
+    def _read_versions(spark: SQLContext, path: str) -> List[str]:
+        return sorted(
+            row["version"]
+            for row in spark.read.parquet(os.path.join(path, "versions_df")).collect()
+        )
+
+    def save(self, path: str):
+        """save the vocabulary as version 0 of a vocabulary store (see update)
+
+        Parameters
+        ----------
+        path: a directory on a filesystem accessible to spark (the store is only accessed through spark)
+        """
+        spark = DataFrameUtils.get_spark_session(self._vocab_df)
+
+        spark.createDataFrame(
+            [
+                (
+                    _vocab_store_format_version,
+                    self.input_col,
+                    self.partition_key,
+                    self.output_col,
+                    self.reset_per_partition,
+                ),
+            ],
+            IdIndexerModel._metadata_schema(),
+        ).write.parquet(os.path.join(path, "metadata_df"))
+
+        self._write_version(path, IdIndexerModel._version_name(0), self._vocab_df)
+        self._store_path = path
+
+    @staticmethod
+    def load(spark: SQLContext, path: str) -> "IdIndexerModel":
+        """load a model saved with save (including all the versions appended by update)"""
+        metadata_rows = spark.read.parquet(os.path.join(path, "metadata_df")).collect()
+        assert len(metadata_rows) == 1
+
+        metadata_row = metadata_rows[0]
+
+        if metadata_row["format_version"] != _vocab_store_format_version:
+            raise ValueError(
+                "unsupported vocabulary store version: {0}".format(
+                    metadata_row["format_version"],
+                ),
+            )
+
+        model = IdIndexerModel(
+            metadata_row["input_col"],
+            metadata_row["partition_key"],
+            metadata_row["output_col"],
+            CacheScope.cache(
+                spark.read.parquet(
+                    *[
+                        os.path.join(path, "vocab", version)
+                        for version in IdIndexerModel._read_versions(spark, path)
+                    ],
+                ),
+                "IdIndexer",
+            ),
+            metadata_row["reset_per_partition"],
+        )
+        model._store_path = path
+
+        return model
+
+    def update(self, df: DataFrame) -> "IdIndexerModel":
+        """append-only update of the saved vocabulary with the values of df which it does not contain yet
+
+        Existing values keep their indices; new values are numbered as in partial_fit.
+        The new values are found with an anti-join of the distinct values of df against the vocabulary
+        (which is read by spark but never collected), they are numbered from the stored maximal index
+        of each partition and only they are written (as a new version of the store).
+
+        Parameters
+        ----------
+        df: a dataframe containing the partition key and input columns
+
+        Returns
+        -------
+        a new model (bound to the same store) with the extended vocabulary
+        """
+        path = self._store_path
+
+        if path is None:
+            raise ValueError("update requires a model which was saved or loaded")
+
+        spark = DataFrameUtils.get_spark_session(df)
+        versions = IdIndexerModel._read_versions(spark, path)
+
+        with CacheScope():
+            new_values_df = CacheScope.cache(
+                self._new_values_df(df),
+                "IdIndexerModel.update",
+            )
+
+            if new_values_df.first() is None:
+                return self
+
+            partition_max_df = self._partition_max_df(
+                spark.read.parquet(
+                    *[
+                        os.path.join(path, "partition_max", version)
+                        for version in versions
+                    ],
+                ).withColumnRenamed(IdIndexerModel._offset_token(), self.output_col),
+            )
+
+            self._write_version(
+                path,
+                IdIndexerModel._version_name(len(versions)),
+                self._index_new_values(new_values_df, partition_max_df),
+            )
+
+        return IdIndexerModel.load(spark, path)
+
+    def undo_transform(self, df: DataFrame, use_broadcast: bool = False) -> DataFrame:
+        ucols = [self.partition_key, self.output_col]
+        vocab_df = f.broadcast(self._vocab_df) if use_broadcast else self._vocab_df
 
         return df.join(vocab_df, on=ucols, how="left_outer")
 
     def _transform(self, df):
+        return self.index(df)
+
+    def index(self, df: DataFrame, use_broadcast: bool = False) -> DataFrame:
+        """replace the input column with its index (0 for values missing from the vocabulary)
+
+        Parameters
+        ----------
+        df: a dataframe containing the partition key and input columns
+        use_broadcast: join with a broadcast vocabulary (avoids shuffling df)
+        """
         ucols = [self.partition_key, self.input_col]
 
         input_col = self.input_col
         output_col = self.output_col
-        vocab_df = self._vocab_df
+        vocab_df = f.broadcast(self._vocab_df) if use_broadcast else self._vocab_df
 
         return (
             df.join(vocab_df, on=ucols, how="left_outer")
@@ -120,7 +425,8 @@ class IdIndexer(Estimator, HasSetInputCol, HasSetOutputCol):
             self.input_col,
             self.partition_key,
             self.output_col,
-            self._make_vocab_df(df).cache(),
+            CacheScope.cache(self._make_vocab_df(df), "IdIndexer"),
+            self.reset_per_partition,
         )
 
 
@@ -128,6 +434,15 @@ class MultiIndexerModel(Transformer):
     def __init__(self, models: List[IdIndexerModel]):
         super().__init__()
         self.models = models
+        self.broadcast_max_rows: Optional[int] = default_broadcast_max_rows
+
+    def use_broadcast(self) -> bool:
+        """
+        :return: True if the vocabularies are small enough to be applied with broadcast joins
+        """
+        return self.broadcast_max_rows is not None and all(
+            m.vocab_size <= self.broadcast_max_rows for m in self.models
+        )
 
     def get_model_by_input_col(self, input_col):
         for m in self.models:
@@ -144,20 +459,23 @@ class MultiIndexerModel(Transformer):
         return None
 
     def undo_transform(self, df: DataFrame) -> DataFrame:
-        curr_df = df.cache()
+        use_broadcast = self.use_broadcast()
+        curr_df = df
 
+        # with broadcast vocabularies all the joins run in the same stage as the scan of df
         for model in self.models:
-            curr_df = model.undo_transform(curr_df).cache()
+            curr_df = model.undo_transform(curr_df, use_broadcast)
 
-        return curr_df
+        return CacheScope.cache(curr_df, "MultiIndexerModel.undo_transform")
 
     def _transform(self, df: DataFrame) -> DataFrame:
-        curr_df = df.cache()
+        use_broadcast = self.use_broadcast()
+        curr_df = df
 
         for model in self.models:
-            curr_df = model.transform(curr_df).cache()
+            curr_df = model.index(curr_df, use_broadcast)
 
-        return curr_df
+        return CacheScope.cache(curr_df, "MultiIndexerModel.transform")
 
 
 class MultiIndexer(Estimator):
@@ -165,5 +483,147 @@ class MultiIndexer(Estimator):
         super().__init__()
         self.indexers = indexers
 
+    @staticmethod
+    def _col_token() -> str:
+        return "__col__"
+
+    @staticmethod
+    def _value_token(ii: int) -> str:
+        return "__value_{0}__".format(ii)
+
+    @staticmethod
+    def _index_token() -> str:
+        return "__index__"
+
+    @staticmethod
+    def _add_partition_offsets(
+        df: DataFrame,
+        partition_key: str,
+        col_token: str,
+        index_token: str,
+    ) -> DataFrame:
+        """
+        turn indices numbered within each (partition, column) into indices numbered within each column
+        ordered by partition, using the prefix sums of the partition sizes (one row per partition and column)
+        """
+        size_token = "__size__"
+        offset_token = "__offset__"
+        offset_partition_token = "__offset_partition__"
+        offset_col_token = "__offset_col__"
+
+        offsets_df = (
+            df.groupBy(partition_key, col_token)
+            .agg(f.count("*").alias(size_token))
+            .select(
+                f.col(partition_key).alias(offset_partition_token),
+                f.col(col_token).alias(offset_col_token),
+                (
+                    f.sum(size_token).over(
+                        Window.partitionBy(col_token)
+                        .orderBy(partition_key)
+                        .rowsBetween(Window.unboundedPreceding, Window.currentRow),
+                    )
+                    - f.col(size_token)
+                ).alias(offset_token),
+            )
+        )
+
+        return df.join(
+            f.broadcast(offsets_df),
+            (f.col(col_token) == f.col(offset_col_token))
+            & f.col(partition_key).eqNullSafe(f.col(offset_partition_token)),
+        ).select(
+            *[cn for cn in df.columns if cn != index_token],
+            (f.col(index_token) + f.col(offset_token)).alias(index_token),
+        )
+
+    def _fit_stacked(self, df: DataFrame) -> List[IdIndexerModel]:
+        """
+        build the vocabularies of all the indexers (which share the partition key and reset_per_partition)
+        with a single distinct over the stacked values of all input columns
+        and a single window which numbers the values of each column within each partition
+        """
+        indexers = self.indexers
+        partition_key = indexers[0].partition_key
+        reset_per_partition = indexers[0].reset_per_partition
+        col_token = MultiIndexer._col_token()
+        index_token = MultiIndexer._index_token()
+        value_tokens = [MultiIndexer._value_token(ii) for ii in range(len(indexers))]
+
+        # row ii of the stack holds the value of column ii in its own slot (and nulls in the others)
+        # so that each slot keeps the type of its column
+        stacked_df = df.select(
+            partition_key,
+            f.explode(
+                f.array(
+                    *[
+                        f.struct(
+                            f.lit(ii).alias(col_token),
+                            *[
+                                (
+                                    f.col(indexer.input_col)
+                                    if jj == ii
+                                    else f.lit(None).cast(
+                                        df.schema[indexer.input_col].dataType,
+                                    )
+                                ).alias(value_tokens[jj])
+                                for jj, indexer in enumerate(indexers)
+                            ],
+                        )
+                        for ii in range(len(indexers))
+                    ],
+                ),
+            ).alias("__stacked__"),
+        ).select(partition_key, "__stacked__.*")
+
+        # same numbering as IdIndexer: by value within the partition or by (partition, value)
+        vocabs_df = CacheScope.cache(
+            stacked_df.distinct().withColumn(
+                index_token,
+                f.row_number().over(
+                    Window.partitionBy(partition_key, col_token).orderBy(*value_tokens),
+                ),
+            ),
+            "IdIndexer",
+        )
+
+        if not reset_per_partition:
+            # a single window ordered by (partition, value) would number a whole vocabulary in one task,
+            # instead shift the numbering within each partition by the sizes of the preceding partitions
+            vocabs_df = MultiIndexer._add_partition_offsets(
+                vocabs_df,
+                partition_key,
+                col_token,
+                index_token,
+            )
+
+        return [
+            IdIndexerModel(
+                indexer.input_col,
+                partition_key,
+                indexer.output_col,
+                vocabs_df.filter(f.col(col_token) == ii).select(
+                    partition_key,
+                    f.col(value_tokens[ii]).alias(indexer.input_col),
+                    (
+                        f.col(index_token)
+                        if reset_per_partition
+                        else f.col(index_token).cast(t.LongType())
+                    ).alias(indexer.output_col),
+                ),
+                reset_per_partition,
+            )
+            for ii, indexer in enumerate(indexers)
+        ]
+
     def _fit(self, df: DataFrame) -> MultiIndexerModel:
+        indexers = self.indexers
+
+        if (
+            len(indexers) > 1
+            and len({i.partition_key for i in indexers}) == 1
+            and len({i.reset_per_partition for i in indexers}) == 1
+        ):
+            return MultiIndexerModel(self._fit_stacked(df))
+
         return MultiIndexerModel([i.fit(df) for i in self.indexers])
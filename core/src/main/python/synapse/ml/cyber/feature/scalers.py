@@ -1,9 +1,12 @@
 __author__ = "rolevin"
 
+import importlib
+import os
 from abc import ABC, abstractmethod
-from typing import Callable, Dict, List, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, Union
 
 from synapse.ml.cyber.utils.spark_utils import (
+    CacheScope,
     ExplainBuilder,
     HasSetInputCol,
     HasSetOutputCol,
@@ -11,7 +14,17 @@ from synapse.ml.cyber.utils.spark_utils import (
 
 from pyspark.ml import Estimator, Transformer
 from pyspark.ml.param.shared import HasInputCol, HasOutputCol, Param, Params
-from pyspark.sql import DataFrame, functions as f, types as t
+from pyspark.sql import (
+    Column,
+    DataFrame,
+    SparkSession,
+    SQLContext,
+    functions as f,
+    types as t,
+)
+
+# models with statistics for at most this many partitions join them with broadcast joins (no shuffle)
+default_broadcast_max_rows = 1000000
 
 
 def _pyudf(func, use_pandas):
@@ -48,6 +61,8 @@ class PerPartitionScalarScalerModel(ABC, Transformer, HasSetInputCol, HasSetOutp
         )
         self._per_group_stats = per_group_stats
         self._use_pandas = use_pandas
+        self.broadcast_max_rows: Optional[int] = default_broadcast_max_rows
+        self._stats_rows = None
 
     @property
     def per_group_stats(self):
@@ -92,6 +107,156 @@ class PerPartitionScalarScalerModel(ABC, Transformer, HasSetInputCol, HasSetOutp
             else _pyudf(self._make_unpartitioned_stats_method(), self.use_pandas)
         )
 
+    @abstractmethod
+    def _stats_cols(self) -> List[Column]:
+        """
+        :return: the aggregations computing the statistics of inputCol (of a partition or of all rows)
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def _merge_stats_cols(
+        self,
+        old_col: Callable[[str], Column],
+        new_col: Callable[[str], Column],
+    ) -> List[Column]:
+        """
+        :param old_col: the column of a statistic (by name) of the current model, null if a partition has none
+        :param new_col: the column of a statistic (by name) of the new batch, null if a partition has none
+        :return: the merged statistics (aliased as the statistics of _stats_cols)
+        """
+        raise NotImplementedError
+
+    def _extra_args(self) -> Dict[str, Any]:
+        """
+        :return: the constructor arguments of the concrete model besides the common ones (used by save)
+        """
+        return {}
+
+    def _with_stats(
+        self,
+        per_group_stats: Union[DataFrame, Dict[str, float]],
+    ) -> "PerPartitionScalarScalerModel":
+        return type(self)(
+            input_col=self.input_col,
+            partition_key=self.partition_key,
+            output_col=self.output_col,
+            per_group_stats=per_group_stats,
+            use_pandas=self.use_pandas,
+            **self._extra_args(),
+        )
+
+    def _check_mergeable_stats(self, stats_names: List[str]):
+        """
+        raise a ValueError if the statistics of the model lack any of the given statistics
+        (e.g., the model was fitted or saved before its statistics could be merged)
+        """
+        model_stats_names = (
+            self.per_group_stats.columns
+            if isinstance(self.per_group_stats, DataFrame)
+            else self.per_group_stats.keys()
+        )
+        missing = [name for name in stats_names if name not in model_stats_names]
+
+        if len(missing) > 0:
+            raise ValueError(
+                "partial_fit requires the statistics {0} which the model does not have, "
+                "refit the model on all the data instead".format(", ".join(missing)),
+            )
+
+    def partial_fit(self, df: DataFrame) -> "PerPartitionScalarScalerModel":
+        """merge the statistics of a new batch into the statistics of the model
+
+        Only df is scanned, the result is the same (up to floating point error)
+        as fitting on all the batches the model was fitted on together with df.
+
+        Parameters
+        ----------
+        df: a dataframe containing the input column (and the partition key if the model is partitioned)
+
+        Returns
+        -------
+        a new model with the merged statistics
+        """
+        old_prefix = "__old__"
+        new_prefix = "__new__"
+
+        def old_col(name: str) -> Column:
+            return f.col(old_prefix + name)
+
+        def new_col(name: str) -> Column:
+            return f.col(new_prefix + name)
+
+        if self.is_partitioned():
+            partition_key = self.partition_key
+            new_stats_df = df.groupBy(partition_key).agg(*self._stats_cols())
+            self._check_mergeable_stats(new_stats_df.columns[1:])
+
+            def prefixed(stats_df: DataFrame, prefix: str) -> DataFrame:
+                return stats_df.select(
+                    partition_key,
+                    *[
+                        f.col(cn).alias(prefix + cn)
+                        for cn in stats_df.columns
+                        if cn != partition_key
+                    ],
+                )
+
+            per_group_stats = CacheScope.cache(
+                prefixed(self.per_group_stats, old_prefix)
+                .join(
+                    prefixed(new_stats_df, new_prefix),
+                    partition_key,
+                    how="full_outer",
+                )
+                .select(partition_key, *self._merge_stats_cols(old_col, new_col)),
+                "PerPartitionScalarScaler",
+            )
+        else:
+            new_stats_df = df.agg(*self._stats_cols())
+            self._check_mergeable_stats(new_stats_df.columns)
+            rows = (
+                new_stats_df.select(
+                    *[
+                        (
+                            f.lit(value)
+                            if value is not None
+                            else f.lit(None).cast(t.DoubleType())
+                        ).alias(old_prefix + name)
+                        for name, value in self.per_group_stats.items()
+                    ],
+                    *[f.col(cn).alias(new_prefix + cn) for cn in new_stats_df.columns],
+                )
+                .select(*self._merge_stats_cols(old_col, new_col))
+                .collect()
+            )
+            assert len(rows) == 1
+            per_group_stats = rows[0].asDict()
+
+        return self._with_stats(per_group_stats)
+
+    @property
+    def stats_rows(self) -> int:
+        """
+        the number of partitions with statistics (memoized)
+        """
+        assert self.is_partitioned()
+
+        if self._stats_rows is None:
+            self._stats_rows = self.per_group_stats.count()
+
+        return self._stats_rows
+
+    def use_broadcast(self) -> bool:
+        """
+        :return: True if transform joins the per partition statistics with a broadcast join
+        """
+        return (
+            self.is_partitioned()
+            and self.broadcast_max_rows is not None
+            and self.stats_rows <= self.broadcast_max_rows
+        )
+
     def _transform(self, df: DataFrame) -> DataFrame:
         stats_method = self._make_stats_method()
         input_col = self.input_col
@@ -101,12 +266,119 @@ class PerPartitionScalarScalerModel(ABC, Transformer, HasSetInputCol, HasSetOutp
             partition_key = self.partition_key
             per_group_stats = self.per_group_stats
 
-            with_stats_df = df.join(per_group_stats, partition_key, how="left")
+            # the statistics have a single row per partition, so they are usually small enough
+            # to be joined without shuffling the input
+            with_stats_df = df.join(
+                f.broadcast(per_group_stats)
+                if self.use_broadcast()
+                else per_group_stats,
+                partition_key,
+                how="left",
+            )
         else:
             with_stats_df = df
 
         return with_stats_df.withColumn(output_col, stats_method(f.col(input_col)))
 
+    @staticmethod
+    def _metadata_schema() -> t.StructType:
+        return t.StructType(
+            [
+                t.StructField("model_module", t.StringType(), False),
+                t.StructField("model_class", t.StringType(), False),
+                t.StructField("input_col", t.StringType(), False),
+                t.StructField("partition_key", t.StringType(), True),
+                t.StructField("output_col", t.StringType(), False),
+                t.StructField("use_pandas", t.BooleanType(), False),
+                t.StructField(
+                    "extra_args",
+                    t.MapType(t.StringType(), t.DoubleType()),
+                    False,
+                ),
+                t.StructField(
+                    "per_group_stats",
+                    t.MapType(t.StringType(), t.DoubleType()),
+                    True,
+                ),
+            ],
+        )
+
+    def save(self, path: str):
+        """save the model (the statistics as parquet for a partitioned model) so it can be reused without refitting
+
+        Parameters
+        ----------
+        path: a directory on a filesystem accessible to spark (the model is only written through spark)
+        """
+        partitioned = self.is_partitioned()
+
+        if partitioned:
+            spark = self.per_group_stats.sparkSession
+            self.per_group_stats.write.parquet(os.path.join(path, "per_group_stats"))
+        else:
+            spark = SparkSession.builder.getOrCreate()
+
+        def as_doubles(values: Dict[str, Any]) -> Dict[str, Optional[float]]:
+            return {
+                kk: float(vv) if vv is not None else None for kk, vv in values.items()
+            }
+
+        # the concrete class is recorded by its module and name so that load finds any (indirect) subclass
+        spark.createDataFrame(
+            [
+                (
+                    type(self).__module__,
+                    type(self).__qualname__,
+                    self.input_col,
+                    self.partition_key,
+                    self.output_col,
+                    self.use_pandas,
+                    as_doubles(self._extra_args()),
+                    None if partitioned else as_doubles(self.per_group_stats),
+                ),
+            ],
+            PerPartitionScalarScalerModel._metadata_schema(),
+        ).write.parquet(os.path.join(path, "metadata_df"))
+
+    @staticmethod
+    def load(spark: SQLContext, path: str) -> "PerPartitionScalarScalerModel":
+        """load a model saved with save"""
+        metadata_rows = spark.read.parquet(os.path.join(path, "metadata_df")).collect()
+        assert len(metadata_rows) == 1
+
+        metadata_row = metadata_rows[0]
+        model_class = getattr(
+            importlib.import_module(metadata_row["model_module"]),
+            metadata_row["model_class"],
+            None,
+        )
+
+        if not (
+            isinstance(model_class, type)
+            and issubclass(model_class, PerPartitionScalarScalerModel)
+        ):
+            raise ValueError(
+                "unsupported scaler model: {0}.{1}".format(
+                    metadata_row["model_module"],
+                    metadata_row["model_class"],
+                ),
+            )
+
+        per_group_stats = (
+            spark.read.parquet(os.path.join(path, "per_group_stats"))
+            if metadata_row["partition_key"] is not None
+            else dict(metadata_row["per_group_stats"])
+        )
+
+        return model_class(
+            input_col=metadata_row["input_col"],
+            partition_key=metadata_row["partition_key"],
+            output_col=metadata_row["output_col"],
+            per_group_stats=per_group_stats,
+            use_pandas=metadata_row["use_pandas"],
+            **metadata_row["extra_args"],
+        )
+
 
 class PerPartitionScalarScalerEstimator(
     ABC,
@@ -160,7 +432,11 @@ class PerPartitionScalarScalerEstimator(
             assert len(rows) == 1
             per_group_stats = rows[0].asDict()
         else:
-            per_group_stats = df.groupBy(partition_key).agg(*apply_on_cols)
+            # cached as the model counts it (to decide on a broadcast join) before joining with it
+            per_group_stats = CacheScope.cache(
+                df.groupBy(partition_key).agg(*apply_on_cols),
+                "PerPartitionScalarScaler",
+            )
 
         assert per_group_stats is not None
         return self._create_model(per_group_stats)
@@ -169,10 +445,13 @@ class PerPartitionScalarScalerEstimator(
 class StandardScalarScalerConfig:
     """
     The tokens to use for temporary representation of mean and standard deviation
+    (and of the count and sum of squared deviations from the mean, which make the statistics mergeable)
     """
 
     mean_token = "__mean__"
     std_token = "__std__"
+    count_token = "__count__"
+    m2_token = "__m2__"
 
 
 class StandardScalarScalerModel(PerPartitionScalarScalerModel):
@@ -200,6 +479,59 @@ class StandardScalarScalerModel(PerPartitionScalarScalerModel):
         )
         self.coefficient_factor = coefficient_factor
 
+    @staticmethod
+    def _input_stats_cols(input_col: str) -> List[Column]:
+        return [
+            f.mean(f.col(input_col)).alias(StandardScalarScalerConfig.mean_token),
+            f.stddev_pop(f.col(input_col)).alias(StandardScalarScalerConfig.std_token),
+            f.count(f.col(input_col)).alias(StandardScalarScalerConfig.count_token),
+            (f.var_pop(f.col(input_col)) * f.count(f.col(input_col))).alias(
+                StandardScalarScalerConfig.m2_token,
+            ),
+        ]
+
+    def _stats_cols(self) -> List[Column]:
+        return StandardScalarScalerModel._input_stats_cols(self.input_col)
+
+    def _merge_stats_cols(
+        self,
+        old_col: Callable[[str], Column],
+        new_col: Callable[[str], Column],
+    ) -> List[Column]:
+        # Chan et al.'s parallel update of the mean and the sum of squared deviations (M2)
+        old_count = f.coalesce(
+            old_col(StandardScalarScalerConfig.count_token), f.lit(0)
+        )
+        new_count = f.coalesce(
+            new_col(StandardScalarScalerConfig.count_token), f.lit(0)
+        )
+        count = old_count + new_count
+        old_mean = f.coalesce(
+            old_col(StandardScalarScalerConfig.mean_token), f.lit(0.0)
+        )
+        new_mean = f.coalesce(
+            new_col(StandardScalarScalerConfig.mean_token), f.lit(0.0)
+        )
+        delta = new_mean - old_mean
+
+        mean = f.when(count > 0, old_mean + delta * new_count / count)
+        m2 = f.when(
+            count > 0,
+            f.coalesce(old_col(StandardScalarScalerConfig.m2_token), f.lit(0.0))
+            + f.coalesce(new_col(StandardScalarScalerConfig.m2_token), f.lit(0.0))
+            + delta * delta * old_count * new_count / count,
+        )
+
+        return [
+            mean.alias(StandardScalarScalerConfig.mean_token),
+            f.sqrt(m2 / count).alias(StandardScalarScalerConfig.std_token),
+            count.alias(StandardScalarScalerConfig.count_token),
+            m2.alias(StandardScalarScalerConfig.m2_token),
+        ]
+
+    def _extra_args(self) -> Dict[str, Any]:
+        return {"coefficient_factor": self.coefficient_factor}
+
     def _make_partitioned_stats_method(self) -> Callable:
         assert isinstance(self.per_group_stats, DataFrame)
         coefficient_factor = self.coefficient_factor
@@ -251,12 +583,7 @@ class StandardScalarScaler(PerPartitionScalarScalerEstimator):
         self.coefficient_factor = coefficient_factor
 
     def _apply_on_cols(self) -> List[Callable]:
-        input_col = self.input_col
-
-        return [
-            f.mean(f.col(input_col)).alias(StandardScalarScalerConfig.mean_token),
-            f.stddev_pop(f.col(input_col)).alias(StandardScalarScalerConfig.std_token),
-        ]
+        return StandardScalarScalerModel._input_stats_cols(self.input_col)
 
     def _create_model(
         self,
@@ -298,6 +625,43 @@ class LinearScalarScalerModel(PerPartitionScalarScalerModel):
         self.min_required_value = min_required_value
         self.max_required_value = max_required_value
 
+    @staticmethod
+    def _input_stats_cols(input_col: str) -> List[Column]:
+        return [
+            f.min(f.col(input_col)).alias(
+                LinearScalarScalerConfig.min_actual_value_token,
+            ),
+            f.max(f.col(input_col)).alias(
+                LinearScalarScalerConfig.max_actual_value_token,
+            ),
+        ]
+
+    def _stats_cols(self) -> List[Column]:
+        return LinearScalarScalerModel._input_stats_cols(self.input_col)
+
+    def _merge_stats_cols(
+        self,
+        old_col: Callable[[str], Column],
+        new_col: Callable[[str], Column],
+    ) -> List[Column]:
+        # least and greatest skip nulls, i.e., a side without values
+        return [
+            f.least(
+                old_col(LinearScalarScalerConfig.min_actual_value_token),
+                new_col(LinearScalarScalerConfig.min_actual_value_token),
+            ).alias(LinearScalarScalerConfig.min_actual_value_token),
+            f.greatest(
+                old_col(LinearScalarScalerConfig.max_actual_value_token),
+                new_col(LinearScalarScalerConfig.max_actual_value_token),
+            ).alias(LinearScalarScalerConfig.max_actual_value_token),
+        ]
+
+    def _extra_args(self) -> Dict[str, Any]:
+        return {
+            "min_required_value": self.min_required_value,
+            "max_required_value": self.max_required_value,
+        }
+
     def _make_partitioned_stats_method(self) -> Callable:
         req_delta = self.max_required_value - self.min_required_value
 
@@ -382,16 +746,7 @@ class LinearScalarScaler(PerPartitionScalarScalerEstimator):
         self.max_required_value = max_required_value
 
     def _apply_on_cols(self) -> List[Callable]:
-        input_col = self.input_col
-
-        return [
-            f.min(f.col(input_col)).alias(
-                LinearScalarScalerConfig.min_actual_value_token,
-            ),
-            f.max(f.col(input_col)).alias(
-                LinearScalarScalerConfig.max_actual_value_token,
-            ),
-        ]
+        return LinearScalarScalerModel._input_stats_cols(self.input_col)
 
     def _create_model(
         self,
@@ -1,10 +1,15 @@
-from typing import Any, List, Union
+import contextvars
+import functools
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
+from py4j.protocol import Py4JError
+from pyspark import StorageLevel
 from pyspark.ml.param.shared import HasInputCol, HasOutputCol, Param
 from pyspark.sql import DataFrame, SparkSession, functions as f, types as t
 from pyspark.sql.window import Window
 
-__all__ = ["DataFrameUtils", "ExplainBuilder"]
+__all__ = ["CacheScope", "DataFrameUtils", "ExplainBuilder"]
 
 
 class DataFrameUtils:
@@ -36,6 +41,53 @@ class DataFrameUtils:
         """
         return DataFrameUtils.get_spark_session(df).createDataFrame([], df.schema)
 
+    @staticmethod
+    def union_all(dfs: List[DataFrame]) -> DataFrame:
+        """union dataframes of the same schema
+
+        Parameters
+        ----------
+        dfs : List[DataFrame]
+            the dataframes to union, at least one
+
+        Returns the union of the dataframes, built as a balanced tree
+        so that the depth of the plan is logarithmic in their number
+        -------
+
+        """
+        if len(dfs) == 0:
+            raise ValueError("dfs cannot be empty")
+
+        while len(dfs) > 1:
+            dfs = [
+                dfs[i].union(dfs[i + 1]) if i + 1 < len(dfs) else dfs[i]
+                for i in range(0, len(dfs), 2)
+            ]
+
+        return dfs[0]
+
+    @staticmethod
+    def truncate_lineage(df: DataFrame) -> DataFrame:
+        """materialize a dataframe and truncate its lineage
+
+        Parameters
+        ----------
+        df : DataFrame
+            the dataframe to materialize
+
+        Returns a reliably checkpointed dataframe if a checkpoint directory is set,
+        otherwise a locally checkpointed one (kept in the executors' block managers)
+        -------
+
+        """
+        sc = DataFrameUtils.get_spark_session(df).sparkContext
+
+        # noinspection PyProtectedMember
+        if sc._jsc.sc().getCheckpointDir().isDefined():
+            return df.checkpoint()
+        else:
+            return df.localCheckpoint()
+
     # noinspection PyDefaultArgument
     @staticmethod
     def zip_with_index(
@@ -96,14 +148,310 @@ class DataFrameUtils:
                 order_by_columns = [f.col(cn) for cn in order_by_col]
                 df = df.orderBy(*order_by_columns)
 
-            output_schema = t.StructType(
-                df.schema.fields + [t.StructField(col_name, t.LongType(), True)],
+            try:
+                return DataFrameUtils._zip_with_sequence(df, start_index, col_name)
+            except (AttributeError, Py4JError):
+                # withSequenceColumn is private to Spark (and there is no _jdf with Spark Connect)
+                return DataFrameUtils._zip_with_rdd_index(df, start_index, col_name)
+
+    @staticmethod
+    def _zip_with_sequence(
+        df: DataFrame,
+        start_index: int,
+        col_name: str,
+    ) -> DataFrame:
+        # the same numbering as RDD.zipWithIndex, computed over the JVM's internal rows
+        # (this is what pandas on Spark uses for its 'distributed-sequence' index)
+        # instead of pickling every row through Python and back;
+        # the dataset is used as is: its physical operator copies the (reused) internal rows
+        # before numbering them, whereas their raw RDD (queryExecution().toRdd()) must not be
+        # consumed without copying every row, which cannot be done from Python
+        spark = DataFrameUtils.get_spark_session(df)
+        sequence_col = "__zip_sequence__"
+        indexed_df = DataFrame(
+            df._jdf.toDF().withSequenceColumn(sequence_col),
+            spark,
+        )
+
+        return indexed_df.select(
+            *[f.col(cn) for cn in df.columns],
+            (f.col(sequence_col) + start_index).alias(col_name),
+        )
+
+    @staticmethod
+    def _zip_with_rdd_index(
+        df: DataFrame,
+        start_index: int,
+        col_name: str,
+    ) -> DataFrame:
+        output_schema = t.StructType(
+            df.schema.fields + [t.StructField(col_name, t.LongType(), True)],
+        )
+
+        return (
+            df.rdd.zipWithIndex()
+            .map(lambda line: (list(line[0]) + [line[1] + start_index]))
+            .toDF(output_schema)
+        )
+
+
+class CacheScope:
+    """
+    Track the intermediate dataframes cached within a scope (e.g., a fit) and release them together.
+
+    Usage:
+        with CacheScope(StorageLevel.DISK_ONLY) as scope:
+            ...
+            df = CacheScope.cache(df, "some_stage")
+            ...
+        print(scope.pinned_bytes)
+
+    CacheScope.cache persists at the storage level of the innermost active scope,
+    outside of any scope it is equivalent to df.cache().
+    CacheScope.checkpoint truncates the lineage of a dataframe (see DataFrameUtils.truncate_lineage),
+    within a scope the local checkpoint is released with the scope as well.
+    Dataframes which must outlive the scope (e.g., the mappings of a fitted model)
+    should be checkpointed with CacheScope.keep, they are reported but not released.
+
+    The active scopes are tracked per thread (and asyncio task), so concurrent fits do not
+    release each other's dataframes. Use CacheScope.inheritable to run a function in another thread
+    (e.g., of a thread pool) within the scopes of the thread which wraps it.
+    """
+
+    _scopes: contextvars.ContextVar = contextvars.ContextVar(
+        "CacheScope._scopes",
+        default=(),
+    )
+    _lock = threading.Lock()
+
+    def __init__(self, storage_level: StorageLevel = StorageLevel.MEMORY_AND_DISK):
+        self.storage_level = storage_level
+        self._cached: List[Tuple[str, DataFrame]] = []
+        self._checkpointed: List[Tuple[str, DataFrame]] = []
+        self._kept: List[Tuple[str, DataFrame]] = []
+        self._pinned_bytes: Optional[Dict[str, Optional[int]]] = None
+        self._token: Optional[contextvars.Token] = None
+
+    def __enter__(self) -> "CacheScope":
+        self._token = CacheScope._scopes.set(CacheScope._scopes.get() + (self,))
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        CacheScope._scopes.reset(self._token)
+        self._token = None
+        self.release()
+
+    @staticmethod
+    def current() -> Optional["CacheScope"]:
+        """
+        :return: the innermost active scope of the calling thread (None if there is none)
+        """
+        scopes = CacheScope._scopes.get()
+        return scopes[-1] if len(scopes) > 0 else None
+
+    @staticmethod
+    def inheritable(func: Callable) -> Callable:
+        """
+        wrap a function so that it runs within the scopes active in the calling thread (when wrapping)
+        in whichever thread it is called, similarly to pyspark.inheritable_thread_target
+        :param func: the function
+        :return: the wrapped function
+        """
+        scopes = CacheScope._scopes.get()
+
+        @functools.wraps(func)
+        def wrapped(*args, **kwargs):
+            token = CacheScope._scopes.set(scopes)
+
+            try:
+                return func(*args, **kwargs)
+            finally:
+                CacheScope._scopes.reset(token)
+
+        return wrapped
+
+    @staticmethod
+    def cache(df: DataFrame, stage: str) -> DataFrame:
+        """
+        cache an intermediate dataframe in the innermost active scope (or with df.cache() if there is none)
+        :param df: the dataframe
+        :param stage: the name of the stage the dataframe is attributed to in the report
+        :return: the cached dataframe
+        """
+        scope = CacheScope.current()
+        return scope.persist(df, stage) if scope is not None else df.cache()
+
+    @staticmethod
+    def checkpoint(df: DataFrame, stage: str) -> DataFrame:
+        """
+        truncate the lineage of a dataframe in the innermost active scope, which releases it when it exits
+        (or with DataFrameUtils.truncate_lineage if there is none)
+        :param df: the dataframe
+        :param stage: the name of the stage the dataframe is attributed to in the report
+        :return: the checkpointed dataframe
+        """
+        checkpointed_df = DataFrameUtils.truncate_lineage(df)
+        scope = CacheScope.current()
+
+        if scope is not None:
+            with CacheScope._lock:
+                scope._checkpointed.append((stage, checkpointed_df))
+
+        return checkpointed_df
+
+    @staticmethod
+    def keep(df: DataFrame, stage: str) -> DataFrame:
+        """
+        checkpoint a dataframe which outlives the innermost active scope (or cache it with df.cache()
+        if there is none), it is reported by the scope but not released;
+        its lineage is truncated (see DataFrameUtils.truncate_lineage) as it may include
+        checkpoints and caches released with the scope
+        :param df: the dataframe
+        :param stage: the name of the stage the dataframe is attributed to in the report
+        :return: the kept dataframe
+        """
+        scope = CacheScope.current()
+
+        if scope is None:
+            return df.cache()
+
+        kept_df = DataFrameUtils.truncate_lineage(df)
+
+        with CacheScope._lock:
+            scope._kept.append((stage, kept_df))
+
+        return kept_df
+
+    def persist(self, df: DataFrame, stage: str) -> DataFrame:
+        """
+        persist a dataframe at the storage level of this scope and release it when the scope exits
+        """
+        with CacheScope._lock:
+            self._cached.append((stage, df))
+
+        return df.persist(self.storage_level)
+
+    @staticmethod
+    def _cached_bytes(df: DataFrame) -> Optional[int]:
+        """
+        :return: the size of the materialized cache of df (0 if not materialized yet)
+        or None if it cannot be determined
+        """
+        try:
+            # noinspection PyProtectedMember
+            cached_data = (
+                DataFrameUtils.get_spark_session(
+                    df,
+                )
+                ._jsparkSession.sharedState()
+                .cacheManager()
+                .lookupCachedData(df._jdf)
             )
+
+            if not cached_data.isDefined():
+                return None
+
+            builder = cached_data.get().cachedRepresentation().cacheBuilder()
             return (
-                df.rdd.zipWithIndex()
-                .map(lambda line: (list(line[0]) + [line[1] + start_index]))
-                .toDF(output_schema)
+                int(builder.sizeInBytesStats().value())
+                if builder.isCachedColumnBuffersLoaded()
+                else 0
             )
+        except Exception:
+            return None
+
+    @staticmethod
+    def _checkpoint_rdd(df: DataFrame) -> Optional[Any]:
+        """
+        :return: the (JVM) RDD holding the blocks of a locally checkpointed dataframe
+        or None if it cannot be determined (e.g., for a reliable checkpoint)
+        """
+        try:
+            # noinspection PyProtectedMember
+            plan = df._jdf.queryExecution().analyzed()
+
+            if plan.nodeName() != "LogicalRDD":
+                return None
+
+            rdd = plan.rdd()
+            return rdd if rdd.getStorageLevel().isValid() else None
+        except Exception:
+            return None
+
+    @staticmethod
+    def _checkpointed_bytes(df: DataFrame) -> Optional[int]:
+        """
+        :return: the size of the blocks of a locally checkpointed dataframe
+        or None if it cannot be determined
+        """
+        rdd = CacheScope._checkpoint_rdd(df)
+
+        if rdd is None:
+            return None
+
+        try:
+            # noinspection PyProtectedMember
+            return sum(
+                int(info.memSize()) + int(info.diskSize())
+                for info in DataFrameUtils.get_spark_session(df)
+                ._jsc.sc()
+                .getRDDStorageInfo()
+                if info.id() == rdd.id()
+            )
+        except Exception:
+            return None
+
+    def report(self) -> Dict[str, Optional[int]]:
+        """
+        :return: the number of bytes currently pinned by each stage in this scope
+        (None for stages whose size cannot be determined)
+        """
+        with CacheScope._lock:
+            cached = [
+                (stage, df, CacheScope._cached_bytes) for stage, df in self._cached
+            ] + [
+                (stage, df, CacheScope._checkpointed_bytes)
+                for stage, df in self._checkpointed + self._kept
+            ]
+
+        res: Dict[str, Optional[int]] = {}
+
+        for stage, df, cached_bytes in cached:
+            size = cached_bytes(df)
+            prev = res.get(stage, 0)
+            res[stage] = prev + size if prev is not None and size is not None else None
+
+        return res
+
+    @property
+    def pinned_bytes(self) -> Dict[str, Optional[int]]:
+        """
+        the bytes each stage pinned, as measured when the scope was released
+        (or the current values while the scope is still active)
+        """
+        return self._pinned_bytes if self._pinned_bytes is not None else self.report()
+
+    def release(self):
+        """
+        unpersist all the dataframes cached (or locally checkpointed) in this scope,
+        except for the kept ones
+        """
+        self._pinned_bytes = self.report()
+
+        with CacheScope._lock:
+            cached = self._cached
+            checkpointed = self._checkpointed
+            self._cached = []
+            self._checkpointed = []
+
+        for _, df in cached:
+            df.unpersist()
+
+        for _, df in checkpointed:
+            rdd = CacheScope._checkpoint_rdd(df)
+
+            if rdd is not None:
+                rdd.unpersist(False)
 
 
 def to_camel_case(prefix: str, varname: str) -> str:
@@ -5,7 +5,10 @@ import os
 import tempfile
 import unittest
 from typing import Dict, Optional, Set, Type, Union
+import numpy as np
+import pandas as pd
 from pandas.testing import assert_frame_equal
+from pyspark import StorageLevel
 from pyspark.sql import DataFrame, types as t, functions as f
 from synapse.ml.cyber.feature import indexers
 from synapse.ml.cyber import DataFactory
@@ -16,6 +19,14 @@ from synapse.ml.cyber.anomaly.collaborative_filtering import (
     ConnectedComponents,
     ModelNormalizeTransformer,
     _UserResourceFeatureVectorMapping as UserResourceFeatureVectorMapping,
+    _make_dot,
+)
+from synapse.ml.cyber.anomaly.packed_model import (
+    PackedAccessAnomalyModel,
+    PackedLatentMapping,
+    make_key,
+    make_keys,
+    sorted_find,
 )
 
 from synapsemltest.cyber.explain_tester import ExplainTester
@@ -529,6 +540,7 @@ class TestAccessAnomalyExplain(ExplainTester):
             "regParam",
             "numBlocks",
             "separateTenants",
+            "maxConcurrentTenants",
             "lowValue",
             "highValue",
             "applyImplicitCf",
@@ -536,6 +548,9 @@ class TestAccessAnomalyExplain(ExplainTester):
             "complementsetFactor",
             "negScore",
             "historyAccessDf",
+            "initialModel",
+            "seedParam",
+            "storageLevel",
         ]
 
         types = [str, int, float, None]
@@ -603,6 +618,358 @@ class TestAccessAnomaly(unittest.TestCase):
                 inter_test_scored_tag.toPandas(),
             )
 
+    def test_save_and_load_mapping_stats(self):
+        model = data_set.get_default_access_anomaly_model()
+        mapping = model.user_res_feature_vector_mapping
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            model.save(tmpdirname)
+            loaded_mapping = AccessAnomalyModel.load(
+                sc,
+                tmpdirname,
+            ).user_res_feature_vector_mapping
+
+            # the statistics are restored from the metadata rather than recomputed
+            assert loaded_mapping.mapping_stats == mapping.compute_mapping_stats()
+            assert (
+                loaded_mapping.mapping_stats["user_mapping_rows"]
+                == mapping.user_feature_vector_mapping_df.count()
+            )
+            assert loaded_mapping.check()
+
+        duplicated_model = AccessAnomalyModel(
+            mapping.replace_mappings(
+                user_feature_vector_mapping_df=mapping.user_feature_vector_mapping_df.union(
+                    mapping.user_feature_vector_mapping_df.limit(1),
+                ),
+            ),
+            model.output_col,
+        )
+        assert not duplicated_model.user_res_feature_vector_mapping.check()
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            duplicated_model.save(tmpdirname)
+
+            with self.assertRaises(ValueError):
+                AccessAnomalyModel.load(sc, tmpdirname)
+
+    def test_make_dot_modes(self):
+        vec_type = t.ArrayType(t.DoubleType())
+        schema = t.StructType(
+            [
+                t.StructField("id", t.IntegerType()),
+                t.StructField("v", vec_type),
+                t.StructField("u", vec_type),
+            ]
+        )
+        rng = np.random.default_rng(0)
+
+        def vec(size: int):
+            return [float(x) for x in rng.normal(size=size)]
+
+        rows = [
+            (0, [1.0, 2.0, 3.0], [4.0, 5.0, 6.0]),
+            # the shorter vector is padded with 1.0
+            (1, [1.0, 2.0], [4.0, 5.0, 6.0]),
+            (2, [1.0, 2.0, 3.0], [4.0]),
+            (3, [], [4.0, 5.0]),
+            (4, [], []),
+            # nulls propagate
+            (5, None, [4.0, 5.0]),
+            (6, [1.0], None),
+            (7, None, None),
+        ] + [(8 + i, vec(1 + i % 5), vec(1 + (i * 7) % 5)) for i in range(50)]
+
+        df = spark.createDataFrame(rows, schema)
+
+        def dots(scoring_mode: str):
+            dot = _make_dot(scoring_mode)
+            return [
+                row["dot"]
+                for row in df.select("id", dot(f.col("v"), f.col("u")).alias("dot"))
+                .orderBy("id")
+                .collect()
+            ]
+
+        expected = []
+        for _, v, u in rows:
+            if v is None or u is None:
+                expected.append(None)
+            else:
+                width = max(len(v), len(u))
+                expected.append(
+                    float(
+                        np.dot(
+                            np.pad(v, (0, width - len(v)), constant_values=1.0),
+                            np.pad(u, (0, width - len(u)), constant_values=1.0),
+                        )
+                    )
+                )
+
+        for scoring_mode in ["native", "pandas", "udf"]:
+            actual = dots(scoring_mode)
+            assert len(actual) == len(expected)
+
+            for a, e in zip(actual, expected):
+                if e is None:
+                    assert a is None or np.isnan(a), scoring_mode
+                else:
+                    assert abs(a - e) < epsilon, scoring_mode
+
+        with self.assertRaises(ValueError):
+            _make_dot("unknown")
+
+    def test_scoring_modes(self):
+        model = data_set.get_default_access_anomaly_model()
+
+        tenant_col = model.tenant_col
+        user_col = model.user_col
+        res_col = model.res_col
+
+        def score(scoring_mode: str):
+            model.scoring_mode = scoring_mode
+
+            return (
+                model.transform(data_set.inter_test.union(data_set.intra_test))
+                .orderBy(tenant_col, user_col, res_col)
+                .toPandas()
+            )
+
+        try:
+            udf_scored = score("udf")
+            assert_frame_equal(udf_scored, score("pandas"), check_exact=False)
+            assert_frame_equal(udf_scored, score("native"), check_exact=False)
+        finally:
+            model.scoring_mode = AccessAnomalyConfig.default_scoring_mode
+
+    def test_top_k(self):
+        model = data_set.get_default_access_anomaly_model()
+
+        tenant_col = model.tenant_col
+        user_col = model.user_col
+        res_col = model.res_col
+        output_col = model.output_col
+        k = 5
+
+        # the inter test pairs are the highest scoring ones, so seen pairs must be excluded
+        history_model = AccessAnomalyModel(
+            UserResourceFeatureVectorMapping(
+                tenant_col,
+                user_col,
+                model.user_vec_col,
+                res_col,
+                model.res_vec_col,
+                data_set.inter_test.select(tenant_col, user_col, res_col),
+                model.user_res_feature_vector_mapping.user2component_mappings_df,
+                model.user_res_feature_vector_mapping.res2component_mappings_df,
+                model.user_res_feature_vector_mapping.user_feature_vector_mapping_df,
+                model.user_res_feature_vector_mapping.res_feature_vector_mapping_df,
+            ),
+            output_col,
+        )
+
+        def sort(pdf):
+            return pdf.sort_values(
+                [tenant_col, output_col, user_col, res_col],
+                ascending=[True, False, True, True],
+            )
+
+        for the_model in [model, history_model]:
+            history_access_df = (
+                the_model.user_res_feature_vector_mapping.history_access_df
+            )
+            candidates = the_model.user_mapping_df.select(tenant_col, user_col).join(
+                the_model.res_mapping_df.select(tenant_col, res_col),
+                tenant_col,
+            )
+
+            if history_access_df is not None:
+                candidates = candidates.join(
+                    history_access_df,
+                    [tenant_col, user_col, res_col],
+                    how="left_anti",
+                )
+
+            expected = (
+                sort(
+                    the_model.transform(candidates)
+                    .select(tenant_col, user_col, res_col, output_col)
+                    .toPandas(),
+                )
+                .groupby(tenant_col)
+                .head(k)
+                .reset_index(drop=True)
+            )
+
+            # small blocks so that the norm bounds prune
+            top_k = sort(
+                the_model.top_k(k, max_block_elements=16).toPandas(),
+            ).reset_index(drop=True)
+
+            assert len(top_k) == k * candidates.select(tenant_col).distinct().count()
+            assert_frame_equal(expected, top_k, check_exact=False)
+
+        with self.assertRaises(ValueError):
+            model.top_k(0)
+
+    def test_broadcast_scoring(self):
+        model = data_set.get_default_access_anomaly_model()
+
+        tenant_col = model.tenant_col
+        user_col = model.user_col
+        res_col = model.res_col
+
+        history_model = AccessAnomalyModel(
+            UserResourceFeatureVectorMapping(
+                tenant_col,
+                user_col,
+                model.user_vec_col,
+                res_col,
+                model.res_vec_col,
+                data_set.intra_test.select(tenant_col, user_col, res_col),
+                model.user_res_feature_vector_mapping.user2component_mappings_df,
+                model.user_res_feature_vector_mapping.res2component_mappings_df,
+                model.user_res_feature_vector_mapping.user_feature_vector_mapping_df,
+                model.user_res_feature_vector_mapping.res_feature_vector_mapping_df,
+            ),
+            model.output_col,
+        )
+
+        test_df = data_set.inter_test.union(data_set.intra_test)
+
+        for the_model in [model, history_model]:
+            assert not the_model.use_broadcast()
+            joined_scored = (
+                the_model.transform(test_df)
+                .orderBy(tenant_col, user_col, res_col)
+                .toPandas()
+            )
+
+            the_model.broadcast_max_rows = the_model.mapping_rows
+            assert the_model.use_broadcast()
+
+            try:
+                broadcast_scored = (
+                    the_model.transform(test_df)
+                    .orderBy(tenant_col, user_col, res_col)
+                    .toPandas()
+                )
+            finally:
+                the_model.broadcast_max_rows = None
+
+            assert_frame_equal(joined_scored, broadcast_scored, check_exact=False)
+
+    def test_packed_keys_do_not_collide(self):
+        # the concatenations of ("t1", "a") and ("t1a", "") are equal without a separator
+        keys = make_keys(["t1", "t1a"], ["a", ""])
+        assert keys[0] != keys[1]
+
+        users = PackedLatentMapping.from_pandas(
+            pd.DataFrame(
+                {
+                    "tenant": ["t1", "t1a"],
+                    "user": ["a", ""],
+                    "vec": [[1.0, 0.0], [0.0, 1.0]],
+                }
+            ),
+            "tenant",
+            "user",
+            "vec",
+        )
+        resources = PackedLatentMapping.from_pandas(
+            pd.DataFrame(
+                {
+                    "tenant": ["t1", "t1a"],
+                    "res": ["r", "r"],
+                    "vec": [[2.0, 3.0], [2.0, 3.0]],
+                }
+            ),
+            "tenant",
+            "res",
+            "vec",
+        )
+        packed_model = PackedAccessAnomalyModel(
+            "tenant",
+            "user",
+            "res",
+            "anomaly_score",
+            users,
+            resources,
+            make_keys(["t1"], ["a"], ["r"]),
+        )
+
+        scores = packed_model.score(
+            ["t1", "t1a"], ["a", ""], ["r", "r"], preserve_history=False
+        )
+        assert list(scores) == [2.0, 3.0]
+
+        # only the seen pair of the first tenant is zeroed
+        scores = packed_model.score(["t1", "t1a"], ["a", ""], ["r", "r"])
+        assert list(scores) == [0.0, 3.0]
+
+        # the scalar lookups find the same rows, including the empty name
+        assert [
+            packed_model.score_one(tenant, user, "r", preserve_history=False)
+            for tenant, user in [("t1", "a"), ("t1a", "")]
+        ] == [2.0, 3.0]
+        assert (
+            sorted_find(np.sort(make_keys(["t1", "t0"], ["", "a"])), make_key("t1", ""))
+            == 1
+        )
+
+        # nulls do not collide with their string representations
+        assert len(set(make_keys([None, "None", "nan"], ["a"] * 3))) == 3
+        assert make_key(None, "a") == make_key(np.nan, "a")
+
+        # integral tenants have the same keys whatever their dtype
+        assert list(make_keys(pd.Series([1, 2]), ["a", "b"])) == list(
+            make_keys(pd.Series([1.0, 2.0]), ["a", "b"])
+        )
+        assert make_keys(pd.Series([1.0, np.nan]), ["a", "b"])[0] == make_key(1, "a")
+
+    def test_export(self):
+        model = data_set.get_default_access_anomaly_model()
+
+        tenant_col = model.tenant_col
+        user_col = model.user_col
+        res_col = model.res_col
+        output_col = model.output_col
+
+        test_pdf = (
+            model.transform(data_set.inter_test.union(data_set.intra_test))
+            .orderBy(tenant_col, user_col, res_col)
+            .toPandas()
+        )
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            path = os.path.join(tmpdirname, "model.bin")
+            model.export(path)
+
+            for mmap_mode in ["r", None]:
+                packed = PackedAccessAnomalyModel.load(path, mmap_mode=mmap_mode)
+
+                assert packed.output_col == output_col
+                assert packed.has_components == model.has_components
+                assert packed.users.vectors.dtype == np.float32
+
+                scores = packed.score(
+                    test_pdf[tenant_col],
+                    test_pdf[user_col],
+                    test_pdf[res_col],
+                )
+                assert np.allclose(scores, test_pdf[output_col], atol=1e-4)
+
+                for _, row in test_pdf.head(20).iterrows():
+                    assert np.isclose(
+                        packed.score_one(row[tenant_col], row[user_col], row[res_col]),
+                        row[output_col],
+                        atol=1e-4,
+                    )
+
+                assert np.isnan(packed.score_one(0, "no-such-user", "no-such-res"))
+
+                del packed
+
     def test_enrich_and_normalize(self):
         training = Dataset.create_new_training(1.0).cache()
 
@@ -747,6 +1114,93 @@ class TestAccessAnomaly(unittest.TestCase):
             assert abs(stats.mean) < epsilon, stats
             assert abs(stats.std - 1.0) < epsilon, stats
 
+    def test_separate_tenants(self):
+        access_anomaly = AccessAnomaly(
+            tenantCol=AccessAnomalyConfig.default_tenant_col,
+            maxIter=10,
+            separateTenants=True,
+            maxConcurrentTenants=2,
+            storageLevel=StorageLevel.DISK_ONLY,
+        )
+
+        assert access_anomaly.cache_report is None
+        model = access_anomaly.fit(data_set.training)
+        model.preserve_history = False
+
+        # the intermediates are released and accounted for per stage
+        cache_report = access_anomaly.cache_report
+        assert cache_report is not None
+        assert {
+            "AccessAnomaly.enrich_and_normalize",
+            "AccessAnomaly.train_cf",
+            "AccessAnomalyModel",
+            "ConnectedComponents",
+        } <= set(cache_report.keys())
+
+        # the model's mappings are kept checkpoints, which do not depend on the released intermediates
+        for mapping_df in [model.user_mapping_df, model.res_mapping_df]:
+            assert (
+                mapping_df._jdf.queryExecution().analyzed().nodeName() == "LogicalRDD"
+            )
+
+        assert (
+            model.user_mapping_df.select(
+                AccessAnomalyConfig.default_tenant_col,
+                AccessAnomalyConfig.default_user_col,
+            )
+            .distinct()
+            .count()
+            == data_set.num_users
+        )
+
+        assert (
+            model.res_mapping_df.select(
+                AccessAnomalyConfig.default_tenant_col,
+                AccessAnomalyConfig.default_res_col,
+            )
+            .distinct()
+            .count()
+            == data_set.num_resources
+        )
+
+        self.report_cross_access(model)
+
+        with self.assertRaises(ValueError):
+            access_anomaly._train_cf_per_tenant(None, data_set.training, [])
+
+    def test_warm_start(self):
+        model = data_set.get_default_access_anomaly_model()
+
+        # warm started models are trained per tenant
+        with self.assertRaises(ValueError):
+            AccessAnomaly(
+                tenantCol=AccessAnomalyConfig.default_tenant_col,
+                maxIter=3,
+                initialModel=model,
+            ).fit(data_set.training)
+
+        access_anomaly = AccessAnomaly(
+            tenantCol=AccessAnomalyConfig.default_tenant_col,
+            maxIter=3,
+            separateTenants=True,
+            initialModel=model,
+        )
+
+        warm_model = access_anomaly.fit(data_set.training)
+        warm_model.preserve_history = False
+
+        assert (
+            warm_model.user_mapping_df.select(
+                AccessAnomalyConfig.default_tenant_col,
+                AccessAnomalyConfig.default_user_col,
+            )
+            .distinct()
+            .count()
+            == data_set.num_users
+        )
+
+        self.report_cross_access(warm_model)
+
     def test_data_match_for_cf(self):
         tenant_col = AccessAnomalyConfig.default_tenant_col
         user_col = AccessAnomalyConfig.default_user_col
@@ -956,3 +1410,59 @@ class TestConnectedComponents:
 
         assert user2components.select("component").distinct().count() == 3
         assert res2components.select("component").distinct().count() == 3
+
+    def test_local_and_iterative_agree(self):
+        tenant_col = "tenant"
+        user_col = "user"
+        res_col = "res"
+
+        df = (
+            spark.createDataFrame(
+                DataFactory(single_component=False).create_clustered_training_data(),
+            )
+            .withColumn(tenant_col, f.lit(0))
+            .unionByName(
+                spark.createDataFrame(
+                    [[f"user{ii}", f"res{ii + (ii % 2)}", 1.0, 1] for ii in range(8)],
+                    ["user", "res", "likelihood", tenant_col],
+                ),
+            )
+        )
+
+        def collect(the_engine_df: DataFrame, name_col: str) -> Set:
+            return {
+                (row[tenant_col], row[name_col], row["component"])
+                for row in the_engine_df.collect()
+            }
+
+        local_users, local_res = ConnectedComponents(
+            tenant_col,
+            user_col,
+            res_col,
+        ).transform(df)
+        iter_users, iter_res = ConnectedComponents(
+            tenant_col,
+            user_col,
+            res_col,
+            max_local_edges=None,
+        ).transform(df)
+
+        assert collect(local_users, user_col) == collect(iter_users, user_col)
+        assert collect(local_res, res_col) == collect(iter_res, res_col)
+        assert (
+            local_users.filter(f.col(tenant_col) == 1)
+            .select("component")
+            .distinct()
+            .count()
+            == 5
+        )
+
+        capped_users, _ = ConnectedComponents(
+            tenant_col,
+            user_col,
+            res_col,
+            max_local_edges=None,
+            max_iter=1,
+        ).transform(df)
+
+        assert capped_users.count() == iter_users.count()
@@ -3,8 +3,12 @@
 
 import unittest
 from typing import Type
+import numpy as np
 from pyspark.sql import DataFrame, types as t, functions as f
-from synapse.ml.cyber.anomaly.complement_access import ComplementAccessTransformer
+from synapse.ml.cyber.anomaly.complement_access import (
+    ComplementAccessTransformer,
+    sample_complement,
+)
 from synapsemltest.cyber.explain_tester import ExplainTester
 from synapsemltest.spark import *
 
@@ -103,6 +107,100 @@ class TestComplementAccessTransformer(unittest.TestCase):
         )
         assert complement_df.agg(f.max("res").alias("max_res")).first()["max_res"] <= 5
 
+    def test_seeded_complement_access_transformer(self):
+        df = self.create_dataframe().cache()
+
+        def sample(the_df: DataFrame, seed: int) -> list:
+            return sorted(
+                tuple(row)
+                for row in ComplementAccessTransformer(
+                    "tenant",
+                    ["user", "res"],
+                    3,
+                    seed,
+                )
+                .transform(the_df)
+                .collect()
+            )
+
+        first = sample(df, 42)
+        assert len(first) > 0
+        assert sample(df.repartition(7), 42) == first
+        assert sample(df.coalesce(1).orderBy(f.desc("user")), 42) == first
+
+    def test_chunked_complement_access_transformer(self):
+        df = self.create_dataframe().cache()
+
+        def sample(the_df: DataFrame) -> DataFrame:
+            # force the rejection sampling, several chunks per tenant
+            return ComplementAccessTransformer(
+                "tenant",
+                ["user", "res"],
+                3,
+                42,
+                max_enumerated_cells=0,
+                max_candidates_per_task=4,
+            ).transform(the_df)
+
+        complement_df = sample(df).cache()
+        assert complement_df.count() > 0
+
+        assert (
+            complement_df.select("tenant", "user", "res").distinct().count()
+            == complement_df.count()
+        )
+        assert complement_df.join(df, ["tenant", "user", "res"]).count() == 0
+
+        limits = {
+            row["tenant"]: row
+            for row in df.groupBy("tenant")
+            .agg(f.max("user").alias("max_user"), f.max("res").alias("max_res"))
+            .collect()
+        }
+
+        for row in complement_df.collect():
+            assert 0 <= row["user"] <= limits[row["tenant"]]["max_user"]
+            assert 0 <= row["res"] <= limits[row["tenant"]]["max_res"]
+
+        assert sorted(map(tuple, sample(df.repartition(7)).collect())) == sorted(
+            map(tuple, complement_df.collect()),
+        )
+
+
+class TestSampleComplement(unittest.TestCase):
+    def test_sample_complement(self):
+        rng = np.random.default_rng(0)
+        observed = np.stack(
+            [
+                rng.integers(3, 10, 50),
+                rng.integers(100, 120, 50),
+                rng.integers(0, 2, 50),
+            ],
+            axis=1,
+        )
+
+        observed_set = set(map(tuple, observed))
+
+        for max_enumerated_cells in [0, 1000]:
+            samples = sample_complement(observed, 100, rng, max_enumerated_cells)
+            assert samples.shape[1] == 3 and len(samples) > 0
+
+            assert (samples.min(axis=0) >= observed.min(axis=0)).all()
+            assert (samples.max(axis=0) <= observed.max(axis=0)).all()
+
+            sampled_set = set(map(tuple, samples))
+            assert len(sampled_set) == len(samples)
+            assert not sampled_set & observed_set
+
+            if max_enumerated_cells > 0:
+                # the exact mode returns exactly the requested number of tuples
+                assert len(samples) == 100
+
+        # asking for more than the complement set returns all of it
+        num_cells = int(np.prod(observed.max(axis=0) - observed.min(axis=0) + 1))
+        samples = sample_complement(observed, 10 * num_cells, rng)
+        assert len(samples) == num_cells - len(observed_set)
+
 
 class TestComplementAccessTransformerExplain(ExplainTester):
     def test_explain(self):
@@ -111,7 +209,14 @@ class TestComplementAccessTransformerExplain(ExplainTester):
         def counts(c: int, tt: Type):
             return tt not in types or c > 0
 
-        params = ["partitionKey", "indexedColNamesArr", "complementsetFactor"]
+        params = [
+            "partitionKey",
+            "indexedColNamesArr",
+            "complementsetFactor",
+            "maxEnumeratedCells",
+            "maxCandidatesPerTask",
+            "seedParam",
+        ]
 
         self.check_explain(
             ComplementAccessTransformer("partition_key", ["indexed_col_names_arr"], 2),
@@ -0,0 +1,106 @@
+# Copyright (C) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See LICENSE in project root for information.
+
+import unittest
+
+import numpy as np
+from synapse.ml.cyber.anomaly.local_als import LocalALS, random_factors
+
+
+def reference_solve(
+    als: LocalALS,
+    num_dst: int,
+    dst_index: np.ndarray,
+    src_index: np.ndarray,
+    ratings: np.ndarray,
+    src_factors: np.ndarray,
+) -> np.ndarray:
+    """
+    the (unconstrained) update of Spark's ALS computed entity by entity
+    """
+    rank = als.rank
+    dst_factors = np.zeros((num_dst, rank))
+
+    for dst in range(num_dst):
+        ata = (
+            src_factors.T @ src_factors
+            if als.implicit_prefs
+            else np.zeros((rank, rank))
+        )
+        atb = np.zeros(rank)
+        num_explicits = 0
+
+        for src, rating in zip(src_index[dst_index == dst], ratings[dst_index == dst]):
+            ff = src_factors[src]
+
+            if als.implicit_prefs:
+                c1 = als.alpha * abs(rating)
+                ata += c1 * np.outer(ff, ff)
+                atb += (1.0 + c1) * ff if rating > 0.0 else 0.0
+                num_explicits += int(rating > 0.0)
+            else:
+                ata += np.outer(ff, ff)
+                atb += rating * ff
+                num_explicits += 1
+
+        if num_explicits > 0:
+            ata += als.reg_param * num_explicits * np.eye(rank)
+            dst_factors[dst] = np.linalg.solve(ata, atb)
+
+    return dst_factors
+
+
+class TestLocalALS(unittest.TestCase):
+    def test_solve_matches_reference(self):
+        rng = np.random.default_rng(0)
+        num_src, num_dst, num_ratings, rank = 30, 20, 300, 4
+        src_index = rng.integers(0, num_src, num_ratings)
+        dst_index = rng.integers(
+            0, num_dst - 1, num_ratings
+        )  # the last one has no ratings
+        src_factors = random_factors(num_src, rank, rng)
+
+        for implicit_prefs in [False, True]:
+            # negative ratings contribute to A^T A with implicit feedback
+            ratings = rng.normal(size=num_ratings)
+            als = LocalALS(
+                rank=rank,
+                max_iter=1,
+                reg_param=0.1,
+                implicit_prefs=implicit_prefs,
+                alpha=2.0,
+                nonnegative=False,
+                chunk_size=7,
+            )
+
+            actual = als._solve(num_dst, dst_index, src_index, ratings, src_factors)
+            expected = reference_solve(
+                als, num_dst, dst_index, src_index, ratings, src_factors
+            )
+
+            assert np.allclose(actual, expected)
+            assert (actual[-1] == 0.0).all()
+
+    def test_fit_nonnegative(self):
+        rng = np.random.default_rng(1)
+        num_users, num_items, num_ratings, rank = 40, 30, 400, 5
+        user_index = rng.integers(0, num_users, num_ratings)
+        item_index = rng.integers(0, num_items, num_ratings)
+        ratings = rng.uniform(-1.0, 5.0, num_ratings)
+
+        als = LocalALS(rank=rank, max_iter=5, reg_param=0.1, implicit_prefs=True)
+        user_factors, item_factors = als.fit(
+            user_index,
+            item_index,
+            ratings,
+            random_factors(num_users, rank, rng),
+            random_factors(num_items, rank, rng),
+        )
+
+        assert user_factors.shape == (num_users, rank)
+        assert item_factors.shape == (num_items, rank)
+        assert (user_factors >= 0.0).all() and (item_factors >= 0.0).all()
+
+
+if __name__ == "__main__":
+    result = unittest.main()
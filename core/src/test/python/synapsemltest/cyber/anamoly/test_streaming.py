@@ -0,0 +1,112 @@
+# Copyright (C) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See LICENSE in project root for information.
+
+import os
+import tempfile
+import unittest
+from typing import Dict, List
+from pyspark.sql import DataFrame, types as t
+from synapse.ml.cyber.anomaly.collaborative_filtering import (
+    AccessAnomalyModel,
+    _UserResourceFeatureVectorMapping as UserResourceFeatureVectorMapping,
+)
+from synapse.ml.cyber.anomaly.streaming import StreamingAccessAnomalyScorer
+from synapsemltest.spark import *
+
+
+def create_model(scale: float) -> AccessAnomalyModel:
+    user_df = sc.createDataFrame(
+        [
+            ("t1", "user0", [scale, 0.0]),
+            ("t1", "user1", [0.0, scale]),
+        ],
+        ["tenant", "user", "user_vector"],
+    )
+
+    res_df = sc.createDataFrame(
+        [
+            ("t1", "res0", [1.0, 0.0]),
+            ("t1", "res1", [0.0, 1.0]),
+        ],
+        ["tenant", "res", "res_vector"],
+    )
+
+    return AccessAnomalyModel(
+        UserResourceFeatureVectorMapping(
+            "tenant",
+            "user",
+            "user_vector",
+            "res",
+            "res_vector",
+            None,
+            None,
+            None,
+            user_df,
+            res_df,
+        ),
+        "anomaly_score",
+    )
+
+
+class TestStreamingAccessAnomalyScorer(unittest.TestCase):
+    def test_streaming_scoring(self):
+        schema = t.StructType(
+            [
+                t.StructField("tenant", t.StringType()),
+                t.StructField("user", t.StringType()),
+                t.StructField("res", t.StringType()),
+            ],
+        )
+
+        batches: Dict[int, List] = {}
+
+        def sink(scored_df: DataFrame, batch_id: int):
+            batches[batch_id] = [
+                (row["user"], row["res"], row["anomaly_score"])
+                for row in scored_df.collect()
+            ]
+
+        scorer = StreamingAccessAnomalyScorer(create_model(1.0), sink)
+        assert scorer.model_version == 1
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            input_dir = os.path.join(tmpdirname, "input")
+
+            def add_events(name: str):
+                sc.createDataFrame(
+                    [("t1", "user0", "res0"), ("t1", "user1", "res0")],
+                    schema,
+                ).coalesce(1).write.parquet(os.path.join(input_dir, name))
+
+            add_events("first")
+
+            query = (
+                scorer.write_stream(
+                    sc.readStream.schema(schema).parquet(
+                        os.path.join(input_dir, "*"),
+                    ),
+                )
+                .option("checkpointLocation", os.path.join(tmpdirname, "checkpoint"))
+                .start()
+            )
+
+            try:
+                query.processAllAvailable()
+                assert scorer.swap_model(create_model(2.0)) == 2
+
+                add_events("second")
+                query.processAllAvailable()
+            finally:
+                query.stop()
+
+        metrics = scorer.batch_metrics
+        assert [mm.model_version for mm in metrics] == [1, 2]
+        assert all(mm.batch_seconds > 0.0 for mm in metrics)
+
+        first, second = [sorted(batches[mm.batch_id]) for mm in metrics]
+        assert first == [("user0", "res0", 1.0), ("user1", "res0", 0.0)]
+        assert second == [("user0", "res0", 2.0), ("user1", "res0", 0.0)]
+
+
+if __name__ == "__main__":
+    result = unittest.main()
@@ -1,6 +1,8 @@
 # Copyright (C) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License. See LICENSE in project root for information.
 
+import os
+import tempfile
 import unittest
 from typing import Type
 from pyspark.sql import types as t, functions as f
@@ -147,6 +149,156 @@ class TestIndexers(unittest.TestCase):
             == orig_df.collect()
         )
 
+    def test_multi_indexer_stacked_fit(self):
+        df = self.create_sample_dataframe()
+
+        # a null partition gets its own numbering (and offset) as well
+        null_partition_df = df.union(
+            sc.createDataFrame([(None, "c", "C", 1, 1)], df.schema),
+        )
+
+        for reset_per_partition in [True, False]:
+            the_indexers = [
+                indexers.IdIndexer("user", "tenant", "actual_uid", reset_per_partition),
+                indexers.IdIndexer("res", "tenant", "actual_rid", reset_per_partition),
+            ]
+
+            model = indexers.MultiIndexer(the_indexers).fit(null_partition_df)
+
+            for indexer in the_indexers:
+                expected = indexer.fit(null_partition_df).vocab_df
+                actual = model.get_model_by_input_col(indexer.input_col).vocab_df
+
+                assert sorted(actual.collect(), key=str) == sorted(
+                    expected.collect(),
+                    key=str,
+                )
+
+        for reset_per_partition in [True, False]:
+            the_indexers = [
+                indexers.IdIndexer("user", "tenant", "actual_uid", reset_per_partition),
+                indexers.IdIndexer("res", "tenant", "actual_rid", reset_per_partition),
+            ]
+
+            model = indexers.MultiIndexer(the_indexers).fit(df)
+
+            # the vocabularies built from the stacked distinct match the per column ones
+            for indexer in the_indexers:
+                expected = indexer.fit(df).vocab_df
+                actual = model.get_model_by_input_col(indexer.input_col).vocab_df
+
+                assert [(ff.name, ff.dataType) for ff in actual.schema] == [
+                    (ff.name, ff.dataType) for ff in expected.schema
+                ]
+                assert sorted(actual.collect()) == sorted(expected.collect())
+
+            cols = ["tenant", "user", "res", "actual_uid", "actual_rid"]
+
+            assert model.use_broadcast()
+            broadcast_df = model.undo_transform(
+                model.transform(df).select("tenant", "actual_uid", "actual_rid"),
+            ).select(*cols)
+
+            model.broadcast_max_rows = None
+            assert not model.use_broadcast()
+            joined_df = model.undo_transform(
+                model.transform(df).select("tenant", "actual_uid", "actual_rid"),
+            ).select(*cols)
+
+            assert sorted(broadcast_df.collect()) == sorted(joined_df.collect())
+
+    def test_id_indexer_partial_fit(self):
+        df = self.create_sample_dataframe()
+
+        for reset_per_partition in [True, False]:
+            indexer = indexers.IdIndexer(
+                "user",
+                "tenant",
+                "actual_uid",
+                reset_per_partition,
+            )
+            model = indexer.fit(df.filter(f.col("user") != "b"))
+            extended_model = model.partial_fit(df)
+
+            old_vocab = model.vocab_df.collect()
+            new_vocab = extended_model.vocab_df
+
+            # existing values keep their indices
+            assert new_vocab.join(
+                model.vocab_df,
+                ["tenant", "user", "actual_uid"],
+            ).count() == len(old_vocab)
+
+            assert new_vocab.count() == df.select("tenant", "user").distinct().count()
+
+            if reset_per_partition:
+                assert (
+                    new_vocab.filter(
+                        (f.col("tenant") == "1") & (f.col("user") == "b"),
+                    ).first()["actual_uid"]
+                    == 2
+                )
+                assert (
+                    new_vocab.filter(f.col("tenant") == "3").first()["actual_uid"] == 1
+                )
+            else:
+                assert sorted(
+                    [row["actual_uid"] for row in new_vocab.collect()],
+                ) == list(range(1, new_vocab.count() + 1))
+
+    def test_id_indexer_save_and_update(self):
+        df = self.create_sample_dataframe()
+
+        for reset_per_partition in [True, False]:
+            indexer = indexers.IdIndexer(
+                "user",
+                "tenant",
+                "actual_uid",
+                reset_per_partition,
+            )
+            initial_df = df.filter(f.col("user") != "b")
+            model = indexer.fit(initial_df)
+
+            with tempfile.TemporaryDirectory() as tmpdirname:
+                path = os.path.join(tmpdirname, "vocab_store")
+                model.save(path)
+
+                loaded_model = indexers.IdIndexerModel.load(sc, path)
+                assert loaded_model.reset_per_partition == reset_per_partition
+                assert sorted(loaded_model.vocab_df.collect()) == sorted(
+                    model.vocab_df.collect(),
+                )
+
+                # nothing new
+                assert loaded_model.update(initial_df) is loaded_model
+
+                updated_model = loaded_model.update(df)
+                expected_model = model.partial_fit(df)
+
+                assert sorted(updated_model.vocab_df.collect()) == sorted(
+                    expected_model.vocab_df.collect(),
+                )
+                assert len(os.listdir(os.path.join(path, "vocab"))) == 2
+                assert len(os.listdir(os.path.join(path, "partition_max"))) == 2
+
+                # the update was persisted
+                reloaded_model = indexers.IdIndexerModel.load(sc, path)
+                assert sorted(reloaded_model.vocab_df.collect()) == sorted(
+                    expected_model.vocab_df.collect(),
+                )
+
+                # the new values are numbered from the stored maximal indices
+                assert updated_model.update(df) is updated_model
+                assert sorted(
+                    updated_model.update(
+                        df.withColumn("user", f.concat("user", f.lit("_new"))),
+                    ).vocab_df.collect(),
+                ) == sorted(
+                    expected_model.partial_fit(
+                        df.withColumn("user", f.concat("user", f.lit("_new"))),
+                    ).vocab_df.collect(),
+                )
+
 
 class TestIdIndexerExplain(ExplainTester):
     def test_explain(self):
@@ -1,14 +1,33 @@
 # Copyright (C) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License. See LICENSE in project root for information.
 
+import os
+import tempfile
 import unittest
 from typing import Type
 from pyspark.sql import functions as f, types as t
 from synapse.ml.cyber.feature import LinearScalarScaler, StandardScalarScaler
+from synapse.ml.cyber.feature.scalers import (
+    PerPartitionScalarScalerModel,
+    StandardScalarScalerConfig,
+    StandardScalarScalerModel,
+)
 from synapsemltest.cyber.explain_tester import ExplainTester
 from synapsemltest.spark import *
 
 
+class ClippedStandardScalarScalerModel(StandardScalarScalerModel):
+    """an indirect subclass of PerPartitionScalarScalerModel (to test load)"""
+
+    def _transform(self, df):
+        new_df = super()._transform(df)
+
+        return new_df.withColumn(
+            self.output_col,
+            f.least(f.col(self.output_col), f.lit(1.0)),
+        )
+
+
 class TestScalers(unittest.TestCase):
     def create_sample_dataframe(self):
         schema = t.StructType(
@@ -117,6 +136,133 @@ class TestScalers(unittest.TestCase):
                 assert len(tenant_scores) == 1
                 assert tenant_scores[0] == 0.0
 
+    def test_broadcast_and_shuffled_stats_agree(self):
+        df = self.create_sample_dataframe()
+
+        for scaler in [
+            LinearScalarScaler("score", "tenant", "new_score", 1, 2, use_pandas=False),
+            StandardScalarScaler("score", "tenant", "new_score", use_pandas=False),
+        ]:
+            broadcast_model = scaler.fit(df)
+            assert broadcast_model.stats_rows == 3
+            assert broadcast_model.use_broadcast()
+
+            shuffled_model = scaler.fit(df)
+            shuffled_model.broadcast_max_rows = 2
+            assert not shuffled_model.use_broadcast()
+
+            broadcast_df = broadcast_model.transform(df)
+            shuffled_df = shuffled_model.transform(df)
+
+            assert broadcast_df.columns == shuffled_df.columns
+            assert sorted(broadcast_df.collect()) == sorted(shuffled_df.collect())
+
+    def test_save_and_load(self):
+        df = self.create_sample_dataframe()
+
+        for scaler in [
+            LinearScalarScaler("score", "tenant", "new_score", 1, 2, use_pandas=False),
+            LinearScalarScaler("score", None, "new_score", 5, 9, use_pandas=False),
+            StandardScalarScaler("score", "tenant", "new_score", 2.0, use_pandas=False),
+            StandardScalarScaler("score", None, "new_score", use_pandas=False),
+        ]:
+            model = scaler.fit(df)
+
+            with tempfile.TemporaryDirectory() as tmpdirname:
+                path = os.path.join(tmpdirname, "scaler")
+                model.save(path)
+                loaded_model = PerPartitionScalarScalerModel.load(sc, path)
+
+                assert type(loaded_model) is type(model)
+                assert loaded_model.partition_key == model.partition_key
+                assert sorted(loaded_model.transform(df).collect()) == sorted(
+                    model.transform(df).collect(),
+                )
+
+        # the class is recorded explicitly, so indirect subclasses are loaded as well
+        for partition_key in ["tenant", None]:
+            fitted_model = StandardScalarScaler(
+                "score",
+                partition_key,
+                "new_score",
+                use_pandas=False,
+            ).fit(df)
+            model = ClippedStandardScalarScalerModel(
+                "score",
+                partition_key,
+                "new_score",
+                fitted_model.per_group_stats,
+                use_pandas=False,
+            )
+
+            with tempfile.TemporaryDirectory() as tmpdirname:
+                path = os.path.join(tmpdirname, "scaler")
+                model.save(path)
+                loaded_model = PerPartitionScalarScalerModel.load(sc, path)
+
+                assert type(loaded_model) is ClippedStandardScalarScalerModel
+                assert sorted(loaded_model.transform(df).collect()) == sorted(
+                    model.transform(df).collect(),
+                )
+
+    def test_partial_fit(self):
+        df = self.create_sample_dataframe()
+        # t3 appears only in the second batch, t2 in both
+        first_df = df.filter(f.col("name").isin("5", "6", "7"))
+        second_df = df.filter(~f.col("name").isin("5", "6", "7"))
+
+        for scaler in [
+            LinearScalarScaler("score", "tenant", "new_score", 1, 2, use_pandas=False),
+            LinearScalarScaler("score", None, "new_score", 5, 9, use_pandas=False),
+            StandardScalarScaler("score", "tenant", "new_score", 2.0, use_pandas=False),
+            StandardScalarScaler("score", None, "new_score", use_pandas=False),
+        ]:
+            model = scaler.fit(df)
+            merged_model = scaler.fit(first_df).partial_fit(second_df)
+
+            assert type(merged_model) is type(model)
+
+            expected = sorted(model.transform(df).collect())
+            actual = sorted(merged_model.transform(df).collect())
+
+            assert len(expected) == len(actual)
+
+            for expected_row, actual_row in zip(expected, actual):
+                assert expected_row.asDict().keys() == actual_row.asDict().keys()
+
+                for key, value in expected_row.asDict().items():
+                    if isinstance(value, float):
+                        assert abs(value - actual_row[key]) < 1e-6, key
+                    else:
+                        assert value == actual_row[key], key
+
+    def test_partial_fit_without_mergeable_stats(self):
+        df = self.create_sample_dataframe()
+        mean_token = StandardScalarScalerConfig.mean_token
+        std_token = StandardScalarScalerConfig.std_token
+
+        # e.g., models fitted before the count and m2 statistics were kept
+        for partition_key, per_group_stats in [
+            (None, {mean_token: 1.0, std_token: 2.0}),
+            (
+                "tenant",
+                sc.createDataFrame(
+                    [("t1", 1.0, 2.0)],
+                    ["tenant", mean_token, std_token],
+                ),
+            ),
+        ]:
+            model = StandardScalarScalerModel(
+                "score",
+                partition_key,
+                "new_score",
+                per_group_stats,
+                use_pandas=False,
+            )
+
+            with self.assertRaises(ValueError):
+                model.partial_fit(df)
+
 
 class TestStandardScalarScalerExplain(ExplainTester):
     def test_explain(self):
@@ -0,0 +1,76 @@
+# Copyright (C) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See LICENSE in project root for information.
+
+import json
+import unittest
+from synapse.ml.cyber.anomaly.collaborative_filtering import AccessAnomaly
+from synapse.ml.cyber.benchmark import (
+    SparkMetrics,
+    StageTimer,
+    benchmark_stages,
+    run_benchmark,
+    stage_results,
+)
+from synapsemltest.spark import *
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_run_benchmark(self):
+        results = run_benchmark(
+            spark,
+            ["tiny"],
+            {"maxIter": 2, "applyImplicitCf": False, "complementsetFactor": 1},
+            top_k=3,
+            scoring_modes=True,
+        )
+
+        # the results are reported as JSON
+        results = json.loads(json.dumps(results))
+
+        assert results["spark_version"] == spark.version
+        assert len(results["results"]) == 1
+
+        result = results["results"][0]
+        assert result["scale"] == "tiny"
+        assert result["num_edges"] > 0
+        assert result["fit_seconds"] > 0.0
+        assert result["transform_seconds"] > 0.0
+        assert set(result["stages"].keys()) == set(benchmark_stages.keys())
+
+        for stage in result["stages"].values():
+            assert not stage["skipped"]
+            assert stage["seconds"] > 0.0
+            assert stage["calls"] >= 1
+
+        assert result["top_k"]["k"] == 3
+        assert result["top_k"]["num_candidates"] > 0
+        assert result["top_k"]["same_pairs"]
+
+        assert set(result["scoring_modes"].keys()) == {"native", "pandas", "udf"}
+
+        for scoring_mode in ["pandas", "udf"]:
+            assert (
+                result["scoring_modes"][scoring_mode]["max_abs_diff_from_native"] < 1e-6
+            )
+
+        with self.assertRaises(ValueError):
+            run_benchmark(spark, ["huge"])
+
+    def test_skipped_stages(self):
+        # stages which did not run (e.g., complement sampling with implicit CF) are reported as skipped
+        stages = stage_results(StageTimer(spark), SparkMetrics(spark))
+
+        assert set(stages.keys()) == set(benchmark_stages.keys())
+        assert all(stage == {"skipped": True, "calls": 0} for stage in stages.values())
+
+    def test_stage_timer_restores_functions(self):
+        original = AccessAnomaly.__dict__["_get_scaled_df"]
+
+        with StageTimer(spark):
+            assert AccessAnomaly.__dict__["_get_scaled_df"] is not original
+
+        assert AccessAnomaly.__dict__["_get_scaled_df"] is original
+
+
+if __name__ == "__main__":
+    result = unittest.main()
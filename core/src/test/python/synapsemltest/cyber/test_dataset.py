@@ -0,0 +1,79 @@
+# Copyright (C) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See LICENSE in project root for information.
+
+import unittest
+from pyspark.sql import functions as f
+from synapse.ml.cyber.anomaly.collaborative_filtering import AccessAnomalyConfig
+from synapse.ml.cyber.dataset import DistributedDataFactory
+from synapsemltest.spark import *
+
+tenant_col = AccessAnomalyConfig.default_tenant_col
+user_col = AccessAnomalyConfig.default_user_col
+res_col = AccessAnomalyConfig.default_res_col
+likelihood_col = AccessAnomalyConfig.default_likelihood_col
+
+
+def department(the_col: str) -> f.Column:
+    return f.element_at(f.split(f.col(the_col), "_"), 1)
+
+
+class TestDistributedDataFactory(unittest.TestCase):
+    def test_clustered_training_data(self):
+        # small blocks so that departments are generated by several tasks
+        factory = DistributedDataFactory(num_tenants=2, users_per_block=3)
+        df = factory.create_clustered_training_data(spark).cache()
+
+        assert df.columns == [tenant_col, user_col, res_col, likelihood_col]
+        assert df.count() == df.select(tenant_col, user_col, res_col).distinct().count()
+        assert df.filter(
+            (f.col(likelihood_col) < 500) | (f.col(likelihood_col) > 1000),
+        ).rdd.isEmpty()
+
+        for tenant in ["tenant_0", "tenant_1"]:
+            tenant_df = df.filter(f.col(tenant_col) == tenant)
+
+            # same users and resources as DataFactory
+            for dep, (num_users, num_resources) in [
+                ("hr", (7, 30)),
+                ("fin", (5, 25)),
+                ("eng", (10, 50)),
+            ]:
+                dep_df = tenant_df.filter(department(user_col) == dep)
+                assert dep_df.select(user_col).distinct().count() == num_users
+                assert (
+                    dep_df.filter(f.col(res_col) != "ffa")
+                    .select(res_col)
+                    .distinct()
+                    .count()
+                    == num_resources
+                )
+
+            # all users access ffa, and no resources of other departments
+            assert tenant_df.filter(f.col(res_col) == "ffa").count() == 22
+            assert tenant_df.filter(
+                (f.col(res_col) != "ffa")
+                & (department(user_col) != department(res_col)),
+            ).rdd.isEmpty()
+
+        # reproducible
+        other_df = factory.create_clustered_training_data(spark)
+        assert sorted(df.collect()) == sorted(other_df.collect())
+
+    def test_noise_and_inter_test_data(self):
+        factory = DistributedDataFactory(single_component=False)
+
+        noisy_df = factory.create_clustered_training_data(spark, noise_ratio=0.1)
+        assert not noisy_df.filter(
+            department(user_col) != department(res_col),
+        ).rdd.isEmpty()
+        assert noisy_df.filter(f.col(res_col) == "ffa").rdd.isEmpty()
+
+        inter_df = factory.create_clustered_inter_test_data(spark)
+        assert inter_df.count() > 0
+        assert inter_df.filter(
+            department(user_col) == department(res_col),
+        ).rdd.isEmpty()
+
+
+if __name__ == "__main__":
+    result = unittest.main()
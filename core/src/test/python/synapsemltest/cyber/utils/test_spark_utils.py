@@ -1,7 +1,13 @@
+import threading
 import unittest
 
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Tuple
+from unittest import mock
 
+from py4j.protocol import Py4JError
+
+from pyspark import StorageLevel
 from pyspark.sql import DataFrame
 from pyspark.sql.types import StructType, StructField, StringType
 
@@ -9,6 +15,7 @@ from pyspark.ml import Transformer
 from pyspark.ml.param.shared import Param, Params
 
 from synapse.ml.cyber.utils.spark_utils import (
+    CacheScope,
     DataFrameUtils,
     ExplainBuilder,
     HasSetInputCol,
@@ -75,6 +82,180 @@ class TestDataFrameUtils(unittest.TestCase):
         ]
         assert result.collect() == expected
 
+    def test_zip_without_partitions_with_start_index(self):
+        dataframe = self.create_sample_dataframe().repartition(3)
+        result = DataFrameUtils.zip_with_index(
+            df=dataframe,
+            start_index=10,
+            col_name="idx",
+        )
+
+        assert result.columns == ["tenant", "user", "idx"]
+        assert sorted(row["idx"] for row in result.collect()) == [10, 11, 12, 13]
+        assert sorted(result.drop("idx").collect()) == sorted(dataframe.collect())
+
+        # indices follow the row order of the input
+        assert [row["idx"] for row in result.collect()] == [10, 11, 12, 13]
+
+    def test_zip_without_partitions_falls_back_to_rdd(self):
+        dataframe = self.create_sample_dataframe().repartition(3)
+
+        # both implementations number the rows in the same order
+        for order_by_col in [[], "user"]:
+            the_df = dataframe.orderBy(order_by_col) if order_by_col else dataframe
+            sequence_df = DataFrameUtils._zip_with_sequence(the_df, 10, "idx")
+            rdd_df = DataFrameUtils._zip_with_rdd_index(the_df, 10, "idx")
+
+            assert [(ff.name, ff.dataType) for ff in sequence_df.schema] == [
+                (ff.name, ff.dataType) for ff in rdd_df.schema
+            ]
+            assert sequence_df.collect() == rdd_df.collect()
+
+        # without the (private) JVM method the RDD implementation is used
+        with mock.patch.object(
+            DataFrameUtils,
+            "_zip_with_sequence",
+            side_effect=Py4JError("Method withSequenceColumn does not exist"),
+        ):
+            result = DataFrameUtils.zip_with_index(
+                df=dataframe,
+                start_index=10,
+                col_name="idx",
+                order_by_col="user",
+            )
+
+        assert result.collect() == [
+            ("OrgA", "Alice", 10),
+            ("OrgA", "Bob", 11),
+            ("OrgB", "Joe", 12),
+            ("OrgA", "Joe", 13),
+        ]
+
+    def test_union_all(self):
+        dfs = [sc.createDataFrame([(ii, str(ii))], ["id", "name"]) for ii in range(7)]
+
+        result = DataFrameUtils.union_all(dfs)
+        assert sorted(row["id"] for row in result.collect()) == list(range(7))
+        assert DataFrameUtils.union_all(dfs[:1]) is dfs[0]
+
+        with self.assertRaises(ValueError):
+            DataFrameUtils.union_all([])
+
+    def test_truncate_lineage(self):
+        dataframe = self.create_sample_dataframe().filter("tenant = 'OrgA'")
+        result = DataFrameUtils.truncate_lineage(dataframe)
+
+        assert sorted(result.collect()) == sorted(dataframe.collect())
+        assert "Filter" not in result._jdf.queryExecution().optimizedPlan().toString()
+
+
+class TestCacheScope(unittest.TestCase):
+    def test_cache_scope(self):
+        df = sc.createDataFrame([(ii, str(ii)) for ii in range(100)], ["id", "name"])
+
+        unscoped_df = CacheScope.cache(df.filter("id > 10"), "unscoped")
+        assert CacheScope.current() is None
+        assert unscoped_df.storageLevel == StorageLevel.MEMORY_AND_DISK_DESER
+
+        with CacheScope(StorageLevel.DISK_ONLY) as scope:
+            assert CacheScope.current() is scope
+
+            first_df = CacheScope.cache(df.filter("id > 20"), "first")
+            second_df = CacheScope.cache(df.filter("id > 30"), "second")
+            assert first_df.storageLevel == StorageLevel.DISK_ONLY
+
+            with CacheScope() as inner_scope:
+                inner_df = CacheScope.cache(df.filter("id > 40"), "inner")
+                assert inner_df.storageLevel == StorageLevel.MEMORY_AND_DISK
+
+            assert CacheScope.current() is scope
+            assert not inner_df.is_cached
+            assert set(inner_scope.pinned_bytes.keys()) == {"inner"}
+
+            assert first_df.count() == 79
+            report = scope.report()
+            assert set(report.keys()) == {"first", "second"}
+            assert report["first"] is None or report["first"] > 0
+            assert report["second"] in [0, None]
+
+        assert CacheScope.current() is None
+        assert not first_df.is_cached and not second_df.is_cached
+        assert unscoped_df.is_cached
+        assert scope.pinned_bytes == report
+
+        unscoped_df.unpersist()
+
+    def test_cache_scope_checkpoint_and_keep(self):
+        df = sc.createDataFrame([(ii, str(ii)) for ii in range(100)], ["id", "name"])
+        # with a checkpoint directory (e.g., set by the benchmark) the checkpoints are reliable,
+        # whose files are not released with the scope
+        local_checkpoints = (
+            df.sparkSession.sparkContext._jsc.sc().getCheckpointDir().isEmpty()
+        )
+
+        with CacheScope(StorageLevel.MEMORY_ONLY) as scope:
+            checkpointed_df = CacheScope.checkpoint(df.filter("id > 10"), "checkpoint")
+            kept_df = CacheScope.keep(checkpointed_df.filter("id > 20"), "kept")
+
+            assert (
+                CacheScope._checkpoint_rdd(checkpointed_df) is not None
+            ) == local_checkpoints
+            assert kept_df.count() == 79
+
+        report = scope.pinned_bytes
+        assert set(report.keys()) == {"checkpoint", "kept"}
+        assert report["checkpoint"] is None or report["checkpoint"] > 0
+        assert report["kept"] is None or report["kept"] > 0
+
+        # the checkpoint is released with the scope, the kept dataframe
+        # (whose lineage included it) is not as its lineage is truncated
+        assert CacheScope._checkpoint_rdd(checkpointed_df) is None
+        assert kept_df._jdf.queryExecution().analyzed().nodeName() == "LogicalRDD"
+        assert (CacheScope._checkpoint_rdd(kept_df) is not None) == local_checkpoints
+        assert kept_df.count() == 79
+
+    def test_concurrent_cache_scopes(self):
+        df = sc.createDataFrame([(ii, str(ii)) for ii in range(100)], ["id", "name"])
+        entered = threading.Barrier(2)
+        released = threading.Barrier(2)
+        results = {}
+
+        def fit(name: str, threshold: int):
+            with CacheScope(StorageLevel.DISK_ONLY) as scope:
+                # both scopes are active at the same time
+                entered.wait()
+                assert CacheScope.current() is scope
+
+                cached_df = CacheScope.cache(df.filter(f"id > {threshold}"), name)
+                inherited = CacheScope.inheritable(CacheScope.current)
+
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    inherited_scope = executor.submit(inherited).result()
+
+                # wait for the other scope to be cached before either is released
+                released.wait()
+                results[name] = (scope, inherited_scope, cached_df, cached_df.is_cached)
+
+        threads = [
+            threading.Thread(target=fit, args=("first", 10)),
+            threading.Thread(target=fit, args=("second", 20)),
+        ]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        # an assertion failing in a thread only shows up as a missing result
+        assert set(results.keys()) == {"first", "second"}
+        assert CacheScope.current() is None
+
+        for name, (scope, inherited_scope, cached_df, was_cached) in results.items():
+            assert inherited_scope is scope
+            assert set(scope.pinned_bytes.keys()) == {name}
+            assert was_cached and not cached_df.is_cached
+
 
 class TestExplainBuilder(unittest.TestCase):
     class ExplainableObj(Transformer, HasSetInputCol, HasSetOutputCol):
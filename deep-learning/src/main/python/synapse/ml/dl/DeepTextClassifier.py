@@ -1,6 +1,12 @@
+import hashlib
+import json
+
+import numpy as np
 from horovod.spark.lightning import TorchEstimator
 import torch
 from pyspark.ml.param.shared import Param, Params
+from pyspark.sql import functions as F
+from pyspark.sql.types import ArrayType, IntegerType, ShortType, StructField, StructType
 from pytorch_lightning.utilities import _module_available
 from synapse.ml.dl.DeepTextModel import DeepTextModel
 from synapse.ml.dl.LitDeepTextModel import LitDeepTextModel
@@ -63,6 +69,14 @@ class DeepTextClassifier(TorchEstimator, TextPredictionParams):
         "whether to train the model from scratch or not, if set to False then param additional_layers_to_train need to be specified.",
     )
 
+    tokenization_cache_dir = Param(
+        Params._dummy(),
+        "tokenization_cache_dir",
+        "A directory (any path Spark can read and write) where the tokenized training data is cached, "
+        "keyed by checkpoint, max_token_len and a fingerprint of the data, so that later fits on the same data "
+        "skip tokenization, if None then the rows are tokenized on the fly",
+    )
+
     @keywords_catch
     def __init__(
         self,
@@ -75,6 +89,7 @@ class DeepTextClassifier(TorchEstimator, TextPredictionParams):
         max_token_len=128,
         learning_rate=None,
         train_from_scratch=True,
+        tokenization_cache_dir=None,
         # Classifier args
         label_col="label",
         text_col="text",
@@ -135,6 +150,7 @@ class DeepTextClassifier(TorchEstimator, TextPredictionParams):
             max_token_len=128,
             learning_rate=None,
             train_from_scratch=True,
+            tokenization_cache_dir=None,
             feature_cols=["text"],
             label_cols=["label"],
             label_col="label",
@@ -215,12 +231,97 @@ class DeepTextClassifier(TorchEstimator, TextPredictionParams):
     def getTrainFromScratch(self):
         return self.getOrDefault(self.train_from_scratch)
 
+    def setTokenizationCacheDir(self, value):
+        return self._set(tokenization_cache_dir=value)
+
+    def getTokenizationCacheDir(self):
+        return self.getOrDefault(self.tokenization_cache_dir)
+
     def _update_cols(self):
         self.setFeatureCols([self.getTextCol()])
         self.setLabelCols([self.getLabelCol()])
 
     def _fit(self, dataset):
-        return super()._fit(dataset)
+        if self.getTokenizationCacheDir() is None:
+            return super()._fit(dataset)
+
+        # train a copy on the tokenized data, so that this estimator still expects the text column
+        tokenized_df = self._get_or_create_tokenized_df(dataset)
+        estimator = self.copy()
+        estimator.setFeatureCols(["input_ids", "attention_mask"])
+        estimator._update_tokenized_transformation_fn()
+        return super(DeepTextClassifier, estimator)._fit(tokenized_df)
+
+    def _get_kept_cols(self):
+        # the columns horovod reads besides the features
+        cols = [self.getLabelCol()]
+        if isinstance(self.getValidation(), str):
+            cols.append(self.getValidation())
+        if self.getSampleWeightCol() is not None:
+            cols.append(self.getSampleWeightCol())
+        return cols
+
+    def _get_tokenization_cache_path(self, dataset):
+        cols = [self.getTextCol()] + self._get_kept_cols()
+        # an order insensitive fingerprint of the data, computed in a single pass
+        fingerprint = dataset.select(
+            F.count(F.lit(1)).alias("rows"),
+            F.sum(F.xxhash64(*cols).cast("decimal(38,0)")).alias("hash"),
+        ).first()
+        tokenizer = self.getTokenizer()
+        key = hashlib.sha1(
+            json.dumps(
+                [
+                    self.getCheckpoint(),
+                    type(tokenizer).__name__,
+                    getattr(tokenizer, "name_or_path", None),
+                    self.getMaxTokenLen(),
+                    cols,
+                    fingerprint["rows"],
+                    str(fingerprint["hash"]),
+                ]
+            ).encode("utf-8")
+        ).hexdigest()
+        return "{}/{}".format(self.getTokenizationCacheDir().rstrip("/"), key)
+
+    def _get_or_create_tokenized_df(self, dataset):
+        spark = dataset.sparkSession
+        path = self._get_tokenization_cache_path(dataset)
+        # spark writes _SUCCESS last, so a partially written cache is tokenized again
+        if not _path_exists(spark, "{}/_SUCCESS".format(path)):
+            self._tokenize_df(dataset).write.mode("overwrite").parquet(path)
+        return spark.read.parquet(path)
+
+    def _tokenize_df(self, dataset):
+        text_col = self.getTextCol()
+        kept_cols = self._get_kept_cols()
+        max_token_len = self.getMaxTokenLen()
+        tokenizer = self.getTokenizer()
+
+        schema = StructType(
+            [
+                StructField("input_ids", ArrayType(IntegerType())),
+                StructField("attention_mask", ArrayType(ShortType())),
+            ]
+            + [dataset.schema[c] for c in kept_cols]
+        )
+
+        def tokenize(pdfs):
+            for pdf in pdfs:
+                encoding = tokenizer(
+                    pdf[text_col].tolist(),
+                    max_length=max_token_len,
+                    padding="max_length",
+                    truncation=True,
+                    return_attention_mask=True,
+                    return_tensors="np",
+                )
+                yield pdf[kept_cols].assign(
+                    input_ids=list(encoding["input_ids"].astype(np.int32)),
+                    attention_mask=list(encoding["attention_mask"].astype(np.int16)),
+                )[schema.fieldNames()]
+
+        return dataset.mapInPandas(tokenize, schema)
 
     # override this method to provide a correct default backend
     def _get_or_create_backend(self):
@@ -266,6 +367,19 @@ class DeepTextClassifier(TorchEstimator, TextPredictionParams):
         self.setTransformationRemovedFields(transformation_removed_fields)
         self.setTransformationFn(_encoding_text)
 
+    def _update_tokenized_transformation_fn(self):
+        label_col = self.getLabelCol()
+
+        def _widen_tokens(row):
+            return {
+                "input_ids": np.asarray(row["input_ids"], dtype=np.int64),
+                "attention_mask": np.asarray(row["attention_mask"], dtype=np.int64),
+                "labels": torch.tensor(row[label_col], dtype=int),
+            }
+
+        self.setTransformationRemovedFields([label_col])
+        self.setTransformationFn(_widen_tokens)
+
     def get_model_class(self):
         return DeepTextModel
 
@@ -286,3 +400,10 @@ class DeepTextClassifier(TorchEstimator, TextPredictionParams):
             text_col=self.getTextCol(),
             prediction_col=self.getPredictionCol(),
         )
+
+
+def _path_exists(spark, path):
+    jvm = spark.sparkContext._jvm
+    hadoop_path = jvm.org.apache.hadoop.fs.Path(path)
+    fs = hadoop_path.getFileSystem(spark.sparkContext._jsc.hadoopConfiguration())
+    return fs.exists(hadoop_path)
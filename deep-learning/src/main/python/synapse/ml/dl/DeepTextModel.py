@@ -2,15 +2,18 @@ from horovod.spark.lightning import TorchModel
 import numpy as np
 import torch
 from horovod.spark.lightning import TorchModel
-from synapse.ml.dl.PredictionParams import TextPredictionParams
+from synapse.ml.dl.PredictionParams import (
+    HasPredictionBatchSizeParam,
+    TextPredictionParams,
+)
 from pyspark.ml.param import Param, Params, TypeConverters
 from pyspark.sql.functions import col, udf
 from pyspark.sql.types import DoubleType
-from synapse.ml.dl.utils import keywords_catch
+from synapse.ml.dl.utils import keywords_catch, transform_in_batches
 from transformers import AutoTokenizer
 
 
-class DeepTextModel(TorchModel, TextPredictionParams):
+class DeepTextModel(TorchModel, TextPredictionParams, HasPredictionBatchSizeParam):
     tokenizer = Param(Params._dummy(), "tokenizer", "tokenizer")
 
     checkpoint = Param(
@@ -19,6 +22,14 @@ class DeepTextModel(TorchModel, TextPredictionParams):
 
     max_token_len = Param(Params._dummy(), "max_token_len", "max_token_len")
 
+    sort_by_length = Param(
+        Params._dummy(),
+        "sort_by_length",
+        "whether batched prediction (see prediction_batch_size) groups texts of similar lengths "
+        "into the same batch to reduce padding, the output keeps the original row order",
+        typeConverter=TypeConverters.toBoolean,
+    )
+
     @keywords_catch
     def __init__(
         self,
@@ -37,6 +48,8 @@ class DeepTextModel(TorchModel, TextPredictionParams):
         label_col="label",
         text_col="text",
         prediction_col="prediction",
+        prediction_batch_size=None,
+        sort_by_length=True,
     ):
         super(DeepTextModel, self).__init__()
 
@@ -50,6 +63,8 @@ class DeepTextModel(TorchModel, TextPredictionParams):
             text_col="text",
             label_col="label",
             prediction_col="prediction",
+            prediction_batch_size=None,
+            sort_by_length=True,
             feature_columns=["text"],
             label_columns=["label"],
             outputCols=["output"],
@@ -76,6 +91,12 @@ class DeepTextModel(TorchModel, TextPredictionParams):
     def getMaxTokenLen(self):
         return self.getOrDefault(self.max_token_len)
 
+    def setSortByLength(self, value):
+        return self._set(sort_by_length=value)
+
+    def getSortByLength(self):
+        return self.getOrDefault(self.sort_by_length)
+
     def _update_cols(self):
         self.setFeatureColumns([self.getTextCol()])
         self.setLabelColoumns([self.getLabelCol()])
@@ -104,13 +125,58 @@ class DeepTextModel(TorchModel, TextPredictionParams):
 
         return predict_fn
 
+    def get_batch_prediction_fn(self):
+        text_col = self.getTextCol()
+        max_token_len = self.getMaxTokenLen()
+        tokenizer = self.getTokenizer()
+
+        def predict_batch_fn(model, pdf):
+            # pad to the longest text of the batch rather than to max_token_len
+            data = tokenizer(
+                list(pdf[text_col]),
+                max_length=max_token_len,
+                padding="longest",
+                truncation=True,
+                return_attention_mask=True,
+                return_tensors="pt",
+            )
+            with torch.no_grad():
+                outputs = model(**data)
+                pred = torch.nn.functional.softmax(outputs.logits, dim=-1)
+
+            return pred.numpy()
+
+        return predict_batch_fn
+
+    def _get_order_fn(self):
+        if not self.getSortByLength():
+            return None
+
+        text_col = self.getTextCol()
+
+        # the number of characters approximates the number of tokens
+        def order_fn(pdf):
+            return np.argsort(pdf[text_col].str.len().to_numpy(), kind="stable")
+
+        return order_fn
+
     # pytorch_lightning module has its own optimizer configuration
     def getOptimizer(self):
         return None
 
     def _transform(self, df):
         self._update_cols()
-        output_df = super()._transform(df)
+        if self.getPredictionBatchSize() is None:
+            output_df = super()._transform(df)
+        else:
+            output_df = transform_in_batches(
+                df,
+                self.getModel(),
+                self.get_batch_prediction_fn(),
+                self.getOutputCols()[0],
+                self.getPredictionBatchSize(),
+                self._get_order_fn(),
+            )
         argmax = udf(lambda v: float(np.argmax(v)), returnType=DoubleType())
         pred_df = output_df.withColumn(
             self.getPredictionCol(), argmax(col(self.getOutputCols()[0]))
@@ -11,6 +11,7 @@ from pyspark.context import SparkContext
 from pyspark.ml.param.shared import Param, Params
 from pytorch_lightning.utilities import _module_available
 from synapse.ml.dl.DeepVisionModel import DeepVisionModel
+from synapse.ml.dl.ImageDecodePipeline import ImageDecodePipeline
 from synapse.ml.dl.LitDeepVisionModel import LitDeepVisionModel
 from synapse.ml.dl.utils import keywords_catch, get_or_create_backend
 from synapse.ml.dl.PredictionParams import VisionPredictionParams
@@ -65,6 +66,15 @@ class DeepVisionClassifier(TorchEstimator, VisionPredictionParams):
         "A composition of transforms used to transform and augnment the input image, should be of type torchvision.transforms.Compose",
     )
 
+    image_decoder = Param(
+        Params._dummy(),
+        "image_decoder",
+        "An ImageDecodePipeline used to decode (and optionally cache) the images during training, "
+        "its num_workers, use_processes and prefetch configure the reader pool which decodes the rows "
+        "(each reader worker with its own copy, whose metrics are logged every log_every_n_images), "
+        "if None then the images are opened synchronously row by row",
+    )
+
     @keywords_catch
     def __init__(
         self,
@@ -75,6 +85,7 @@ class DeepVisionClassifier(TorchEstimator, VisionPredictionParams):
         loss_name="cross_entropy",
         dropout_aux=0.7,
         transform_fn=None,
+        image_decoder=None,
         # Classifier args
         label_col="label",
         image_col="image",
@@ -131,6 +142,7 @@ class DeepVisionClassifier(TorchEstimator, VisionPredictionParams):
             loss_name="cross_entropy",
             dropout_aux=0.7,
             transform_fn=None,
+            image_decoder=None,
             feature_cols=["image"],
             label_cols=["label"],
             label_col="label",
@@ -200,6 +212,12 @@ class DeepVisionClassifier(TorchEstimator, VisionPredictionParams):
     def getTransformFn(self):
         return self.getOrDefault(self.transform_fn)
 
+    def setImageDecoder(self, value):
+        return self._set(image_decoder=value)
+
+    def getImageDecoder(self):
+        return self.getOrDefault(self.image_decoder)
+
     def _update_input_shapes(self):
         if self.getInputShapes() is None:
             if self.getBackbone().startswith("inception"):
@@ -239,16 +257,39 @@ class DeepVisionClassifier(TorchEstimator, VisionPredictionParams):
             image_col = self.getImageCol()
             label_col = self.getLabelCol()
             transform = self.getTransformFn()
+            image_decoder = self.getImageDecoder()
+
+            if image_decoder is not None:
+                self._update_reader_params(image_decoder)
 
             def _transform_row(row):
                 path = row[image_col]
                 label = row[label_col]
-                image = Image.open(path).convert("RGB")
+                if image_decoder is not None:
+                    # runs in a reader worker, which is one of the decode pool (see _update_reader_params)
+                    image = image_decoder.decode(path)
+                else:
+                    image = Image.open(path).convert("RGB")
                 image = transform(image).numpy()
                 return {image_col: image, label_col: label}
 
             self.setTransformationFn(_transform_row)
 
+    def _update_reader_params(self, image_decoder):
+        # rows are transformed by the petastorm reader workers, so they form the decode pool,
+        # and the async data loader queue prefetches (whole batches) ahead of the training loop
+        if not self.isSet(self.train_reader_num_workers):
+            self.setTrainReaderNumWorker(image_decoder.num_workers)
+        if not self.isSet(self.reader_pool_type):
+            self.setReaderPoolType(
+                "process" if image_decoder.use_processes else "thread"
+            )
+        if not self.isSet(self.train_async_data_loader_queue_size):
+            batch_size = self.getBatchSize() or 32
+            self.setTrainAsyncDataLoaderQueueSize(
+                max(1, -(-image_decoder.prefetch // batch_size))
+            )
+
     def get_model_class(self):
         return DeepVisionModel
 
@@ -6,14 +6,17 @@ import torch
 import torchvision.transforms as transforms
 from horovod.spark.lightning import TorchModel
 from PIL import Image
-from synapse.ml.dl.PredictionParams import VisionPredictionParams
+from synapse.ml.dl.PredictionParams import (
+    HasPredictionBatchSizeParam,
+    VisionPredictionParams,
+)
 from pyspark.ml.param import Param, Params, TypeConverters
 from pyspark.sql.functions import col, udf
 from pyspark.sql.types import DoubleType
-from synapse.ml.dl.utils import keywords_catch
+from synapse.ml.dl.utils import keywords_catch, transform_in_batches
 
 
-class DeepVisionModel(TorchModel, VisionPredictionParams):
+class DeepVisionModel(TorchModel, VisionPredictionParams, HasPredictionBatchSizeParam):
     transform_fn = Param(
         Params._dummy(),
         "transform_fn",
@@ -36,6 +39,7 @@ class DeepVisionModel(TorchModel, VisionPredictionParams):
         label_col="label",
         image_col="image",
         prediction_col="prediction",
+        prediction_batch_size=None,
     ):
         super(DeepVisionModel, self).__init__()
 
@@ -48,6 +52,7 @@ class DeepVisionModel(TorchModel, VisionPredictionParams):
             label_col="label",
             image_col="image",
             prediction_col="prediction",
+            prediction_batch_size=None,
             feature_columns=["image"],
             label_columns=["label"],
             outputCols=["output"],
@@ -106,6 +111,32 @@ class DeepVisionModel(TorchModel, VisionPredictionParams):
 
         return predict_fn
 
+    def get_batch_prediction_fn(self):
+        # a single image of the input shape, the batch dimension is added by stacking
+        image_shape = self.getInputShapes()[0][1:]
+        image_col = self.getImageCol()
+        transform = self.getTransformFn()
+
+        def decode(image):
+            if type(image) == str:
+                image = Image.open(image).convert("RGB")
+                return transform(image).reshape(image_shape)
+            # arrow decodes nested arrays as object arrays of arrays,
+            # which numpy stacks as float64 while the model expects float32
+            return torch.tensor(np.array(list(image)), dtype=torch.float32).reshape(
+                image_shape
+            )
+
+        def predict_batch_fn(model, pdf):
+            data = torch.stack([decode(image) for image in pdf[image_col]])
+
+            with torch.no_grad():
+                pred = model(data)
+
+            return pred.numpy()
+
+        return predict_batch_fn
+
     # pytorch_lightning module has its own optimizer configuration
     def getOptimizer(self):
         return None
@@ -113,7 +144,16 @@ class DeepVisionModel(TorchModel, VisionPredictionParams):
     def _transform(self, df):
         self._update_transform_fn()
         self._update_cols()
-        output_df = super()._transform(df)
+        if self.getPredictionBatchSize() is None:
+            output_df = super()._transform(df)
+        else:
+            output_df = transform_in_batches(
+                df,
+                self.getModel(),
+                self.get_batch_prediction_fn(),
+                self.getOutputCols()[0],
+                self.getPredictionBatchSize(),
+            )
         argmax = udf(lambda v: float(np.argmax(v)), returnType=DoubleType())
         pred_df = output_df.withColumn(
             self.getPredictionCol(), argmax(col(self.getOutputCols()[0]))
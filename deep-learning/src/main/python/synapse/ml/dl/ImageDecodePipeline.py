@@ -0,0 +1,180 @@
+# Copyright (C) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See LICENSE in project root for information.
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+_logger = logging.getLogger(__name__)
+
+
+def _decode_image(path, resize_to):
+    image = Image.open(path).convert("RGB")
+    if resize_to is not None:
+        width, height = image.size
+        scale = resize_to / min(width, height)
+        # keep the aspect ratio and only downscale, so that cached images are never larger than the originals
+        if scale < 1.0:
+            width, height = max(1, round(width * scale)), max(1, round(height * scale))
+            image = image.resize((width, height), Image.BILINEAR)
+        # then center crop to (at most) resize_to x resize_to, as transforms.Resize + CenterCrop do
+        crop_width, crop_height = min(width, resize_to), min(height, resize_to)
+        left, top = (width - crop_width) // 2, (height - crop_height) // 2
+        image = image.crop((left, top, left + crop_width, top + crop_height))
+    return np.asarray(image)
+
+
+def _cache_path(path, cache_dir, resize_to):
+    stat = os.stat(path)
+    key = hashlib.sha1(
+        "{}:{}:{}:{}".format(
+            os.path.abspath(path), stat.st_mtime_ns, stat.st_size, resize_to
+        ).encode("utf-8")
+    ).hexdigest()
+    return os.path.join(cache_dir, key[:2], key + ".npy")
+
+
+def _load_or_decode(path, cache_dir, resize_to):
+    """
+    Returns the decoded image as a uint8 (height, width, 3) array, whether it was read from the cache,
+    and the seconds it took.
+    """
+    start = time.perf_counter()
+    cache_path = _cache_path(path, cache_dir, resize_to) if cache_dir else None
+
+    if cache_path is not None and os.path.exists(cache_path):
+        return np.load(cache_path), True, time.perf_counter() - start
+
+    array = _decode_image(path, resize_to)
+
+    if cache_path is not None:
+        # write to a temporary file first, so that concurrent readers never see a partial file
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(cache_path), suffix=".tmp", delete=False
+        ) as tmp:
+            np.save(tmp, array)
+        os.replace(tmp.name, cache_path)
+
+    return array, False, time.perf_counter() - start
+
+
+class ImageDecodePipeline(object):
+    """
+    Decode images (paths) into RGB arrays, optionally through a cache of decoded (and resized) images.
+
+    When used as the image_decoder of DeepVisionClassifier, the petastorm reader workers are the decode pool:
+    num_workers, use_processes and prefetch configure the reader, and each reader worker decodes its rows
+    one at a time with its own (pickled) copy of the pipeline. The metrics of the driver's instance
+    then stay empty, set log_every_n_images to log the metrics of each copy from the reader workers.
+
+    Parameters
+    ----------
+    num_workers: the number of reader workers decoding concurrently
+    use_processes: run the reader workers in processes rather than threads
+    prefetch: the number of images decoded ahead of the training loop (rounded up to whole batches),
+        defaults to twice num_workers
+    cache_dir: an optional local directory where decoded (and resized) images are cached,
+        so that later epochs skip decoding; random augmentations are applied after the cache
+    resize_to: optionally downscale images (keeping their aspect ratio) so that their shorter side
+        is of this size, then center crop them to resize_to x resize_to before caching, as
+        transforms.Resize(resize_to) followed by transforms.CenterCrop(resize_to) would;
+        should be at least the size the transform crops to
+    log_every_n_images: log the throughput metrics (at INFO level) every this many images
+    """
+
+    def __init__(
+        self,
+        num_workers=4,
+        use_processes=False,
+        prefetch=None,
+        cache_dir=None,
+        resize_to=None,
+        log_every_n_images=None,
+    ):
+        if num_workers <= 0:
+            raise ValueError(
+                "num_workers should be positive, found: {}".format(num_workers)
+            )
+
+        self.num_workers = num_workers
+        self.use_processes = use_processes
+        self.prefetch = prefetch if prefetch is not None else 2 * num_workers
+        self.cache_dir = cache_dir
+        self.resize_to = resize_to
+        self.log_every_n_images = log_every_n_images
+
+        self._lock = threading.Lock()
+        self.reset_metrics()
+
+    def __getstate__(self):
+        # the lock and the metrics are local to each process
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self.reset_metrics()
+
+    def reset_metrics(self):
+        self._images = 0
+        self._cache_hits = 0
+        self._decode_seconds = 0.0
+        self._start_time = None
+
+    def _record(self, hit, seconds):
+        with self._lock:
+            if self._start_time is None:
+                self._start_time = time.perf_counter() - seconds
+            self._images += 1
+            self._cache_hits += int(hit)
+            self._decode_seconds += seconds
+            log = (
+                self.log_every_n_images is not None
+                and self._images % self.log_every_n_images == 0
+            )
+
+        if log:
+            _logger.info(
+                "ImageDecodePipeline (pid %d): %s", os.getpid(), self.metrics()
+            )
+
+    def metrics(self):
+        """
+        Returns the throughput metrics of this process since the first decoded image (or reset_metrics):
+        the number of images, cache hits and misses, the decode seconds summed over the threads,
+        and the images per second of wall clock time.
+        """
+        with self._lock:
+            elapsed = (
+                time.perf_counter() - self._start_time
+                if self._start_time is not None
+                else 0.0
+            )
+            return {
+                "images": self._images,
+                "cache_hits": self._cache_hits,
+                "cache_misses": self._images - self._cache_hits,
+                "decode_seconds": self._decode_seconds,
+                "elapsed_seconds": elapsed,
+                "images_per_second": self._images / elapsed if elapsed > 0 else 0.0,
+            }
+
+    def decode_array(self, path):
+        """
+        Decodes a single image in the calling thread (through the cache if any).
+        """
+        array, hit, seconds = _load_or_decode(path, self.cache_dir, self.resize_to)
+        self._record(hit, seconds)
+        return array
+
+    def decode(self, path):
+        return Image.fromarray(self.decode_array(path))
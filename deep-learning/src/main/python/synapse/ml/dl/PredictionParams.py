@@ -105,6 +105,31 @@ class HasPredictionColParam(Params):
         return self.getOrDefault(self.prediction_col)
 
 
+class HasPredictionBatchSizeParam(Params):
+    prediction_batch_size = Param(
+        Params._dummy(),
+        "prediction_batch_size",
+        "number of rows scored by a single forward pass of the model in transform, "
+        "if None then rows are scored one at a time.",
+    )
+
+    def __init__(self):
+        super(HasPredictionBatchSizeParam, self).__init__()
+        self._setDefault(prediction_batch_size=None)
+
+    def setPredictionBatchSize(self, value):
+        """
+        Sets the value of :py:attr:`prediction_batch_size`.
+        """
+        return self._set(prediction_batch_size=value)
+
+    def getPredictionBatchSize(self):
+        """
+        Gets the value of prediction_batch_size or its default value.
+        """
+        return self.getOrDefault(self.prediction_batch_size)
+
+
 class VisionPredictionParams(HasLabelColParam, HasImageColParam, HasPredictionColParam):
     def __init__(self):
         super(VisionPredictionParams, self).__init__()
@@ -5,5 +5,6 @@ from synapse.ml.dl.DeepTextClassifier import *
 from synapse.ml.dl.DeepTextModel import *
 from synapse.ml.dl.DeepVisionClassifier import *
 from synapse.ml.dl.DeepVisionModel import *
+from synapse.ml.dl.ImageDecodePipeline import *
 from synapse.ml.dl.LitDeepTextModel import *
 from synapse.ml.dl.LitDeepVisionModel import *
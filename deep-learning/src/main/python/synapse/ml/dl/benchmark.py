@@ -0,0 +1,181 @@
+# Copyright (C) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See LICENSE in project root for information.
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+from pyspark.sql import SparkSession
+from pyspark.sql.types import DoubleType
+from synapse.ml.dl.DeepVisionModel import DeepVisionModel
+from synapse.ml.dl.ImageDecodePipeline import ImageDecodePipeline
+from synapse.ml.dl.LitDeepVisionModel import LitDeepVisionModel
+
+"""
+Benchmark the rows/second of DeepVisionModel.transform when scoring one row per forward pass
+(the default) against batched scoring (prediction_batch_size) on generated images,
+or the images/second of decoding them one at a time (as each reader worker of DeepVisionClassifier does)
+without and with an ImageDecodePipeline (with a cold and a warm cache).
+
+Usage:
+    python -m synapse.ml.dl.benchmark --backbone resnet50 --batch-sizes 16,64 --output results.json
+    python -m synapse.ml.dl.benchmark --mode decoding --resize-to 256
+"""
+
+
+def generate_images(folder, num_images, size=256, seed=0):
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(num_images):
+        path = os.path.join(folder, "image_{}.jpg".format(i))
+        pixels = rng.integers(0, 256, size=(size, size, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(path)
+        paths.append(path)
+    return paths
+
+
+def create_vision_model(backbone, num_classes):
+    input_shape = (
+        [-1, 3, 299, 299] if backbone.startswith("inception") else [-1, 3, 224, 224]
+    )
+    lit_model = LitDeepVisionModel(
+        backbone=backbone,
+        additional_layers_to_train=0,
+        num_classes=num_classes,
+        input_shape=input_shape,
+        optimizer_name="adam",
+        loss_name="cross_entropy",
+        label_col="label",
+        image_col="image",
+    )
+    # the metadata horovod keeps for a scalar label column
+    metadata = {
+        "label": {
+            "spark_data_type": DoubleType,
+            "is_sparse_vector_only": False,
+            "shape": 1,
+            "intermediate_format": "nochange",
+            "max_size": 1,
+        }
+    }
+    return DeepVisionModel(
+        model=lit_model,
+        input_shapes=[input_shape],
+        _metadata=metadata,
+        label_col="label",
+        image_col="image",
+    )
+
+
+def time_transform(model, df, batch_size):
+    model.setPredictionBatchSize(batch_size)
+    start = time.perf_counter()
+    model.transform(df).write.format("noop").mode("overwrite").save()
+    return time.perf_counter() - start
+
+
+def run_benchmark(spark, backbone, num_images, batch_sizes, num_classes=10):
+    with tempfile.TemporaryDirectory() as folder:
+        paths = generate_images(folder, num_images)
+        df = spark.createDataFrame(
+            [(path, 0.0) for path in paths], ["image", "label"]
+        ).cache()
+        df.count()
+
+        model = create_vision_model(backbone, num_classes)
+        results = []
+        for batch_size in [None] + batch_sizes:
+            seconds = time_transform(model, df, batch_size)
+            results.append(
+                {
+                    "prediction_batch_size": batch_size,
+                    "seconds": seconds,
+                    "rows_per_second": num_images / seconds,
+                }
+            )
+
+        df.unpersist()
+
+    return {
+        "spark_version": spark.version,
+        "default_parallelism": spark.sparkContext.defaultParallelism,
+        "backbone": backbone,
+        "num_images": num_images,
+        "results": results,
+    }
+
+
+def run_decode_benchmark(num_images, resize_to, size=512):
+    with tempfile.TemporaryDirectory() as folder, tempfile.TemporaryDirectory() as cache_dir:
+        paths = generate_images(folder, num_images, size=size)
+
+        start = time.perf_counter()
+        for path in paths:
+            Image.open(path).convert("RGB").load()
+        sequential_seconds = time.perf_counter() - start
+
+        results = {"sequential": {"images_per_second": num_images / sequential_seconds}}
+
+        image_decoder = ImageDecodePipeline(cache_dir=cache_dir, resize_to=resize_to)
+        for name in ["cold_cache", "warm_cache"]:
+            image_decoder.reset_metrics()
+            for path in paths:
+                image_decoder.decode_array(path)
+            results[name] = image_decoder.metrics()
+
+    return {
+        "num_images": num_images,
+        "image_size": size,
+        "resize_to": resize_to,
+        "results": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmark synapse.ml.dl")
+    parser.add_argument(
+        "--mode", choices=["inference", "decoding"], default="inference"
+    )
+    parser.add_argument("--backbone", default="resnet50")
+    parser.add_argument("--num-images", type=int, default=512)
+    parser.add_argument(
+        "--batch-sizes",
+        default="16,64",
+        help="comma separated prediction batch sizes compared with scoring one row at a time",
+    )
+    parser.add_argument("--resize-to", type=int, default=None)
+    parser.add_argument("--master", default="local[*]")
+    parser.add_argument("--output", default=None, help="a JSON file (default stdout)")
+    args = parser.parse_args(argv)
+
+    if args.mode == "decoding":
+        results = run_decode_benchmark(args.num_images, args.resize_to)
+    else:
+        spark = (
+            SparkSession.builder.master(args.master)
+            .appName("synapse.ml.dl benchmark")
+            .getOrCreate()
+        )
+
+        results = run_benchmark(
+            spark,
+            args.backbone,
+            args.num_images,
+            [int(batch_size) for batch_size in args.batch_sizes.split(",")],
+        )
+    output = json.dumps(results, indent=2)
+
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
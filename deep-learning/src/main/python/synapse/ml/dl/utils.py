@@ -1,11 +1,18 @@
 # Copyright (C) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License. See LICENSE in project root for information.
 
+import io
 import sys
+import threading
 
+import numpy as np
+import torch
 from functools import wraps
 from horovod.spark.common.backend import SparkBackend
 from pyspark.context import SparkContext
+from pyspark.ml.functions import array_to_vector
+from pyspark.sql.functions import col
+from pyspark.sql.types import ArrayType, DoubleType, StructField, StructType
 
 
 def keywords_catch(func):
@@ -52,3 +59,76 @@ def _find_num_proc(use_gpu):
         sc = SparkContext.getOrCreate()
         return sc._jsc.sc().getExecutorMemoryStatus().size() - 1
     return None
+
+
+def serialize_model(model):
+    buffer = io.BytesIO()
+    torch.save(model, buffer)
+    return buffer.getvalue()
+
+
+def deserialize_model(serialized_model):
+    model = torch.load(io.BytesIO(serialized_model))
+    model.eval()
+    return model
+
+
+_broadcast_models = {}
+_broadcast_models_lock = threading.Lock()
+
+
+def _get_broadcast_model(model_id, broadcast_model):
+    """
+    Deserialize a broadcast model once per (reused) Python worker,
+    only the model of the latest transform is kept.
+    """
+    with _broadcast_models_lock:
+        if model_id not in _broadcast_models:
+            _broadcast_models.clear()
+            _broadcast_models[model_id] = deserialize_model(broadcast_model.value)
+        return _broadcast_models[model_id]
+
+
+def transform_in_batches(
+    df, model, predict_batch_fn, output_col, batch_size, order_fn=None
+):
+    """
+    Score a dataframe with Arrow-batched `mapInPandas`, one forward pass per batch of rows.
+
+    Parameters
+    ----------
+    df: the dataframe to score
+    model: the torch model, broadcast and deserialized once per Python worker
+    predict_batch_fn: a function (model, pandas dataframe of at most batch_size rows) ->
+        2-D numpy array with one row of predictions per input row (in the same order)
+    output_col: the name of the appended predictions column (a vector)
+    batch_size: the number of rows per forward pass
+    order_fn: an optional function (pandas dataframe) -> permutation of its rows,
+        applied to each Arrow batch before it is cut into batches (e.g. to group rows of similar sizes),
+        the predictions are returned in the original row order
+    """
+    if batch_size is None or batch_size <= 0:
+        raise ValueError("batch_size should be positive, found: {}".format(batch_size))
+
+    broadcast_model = df.sparkSession.sparkContext.broadcast(serialize_model(model))
+    model_id = broadcast_model._jbroadcast.id()
+    schema = StructType(
+        df.schema.fields + [StructField(output_col, ArrayType(DoubleType()))]
+    )
+
+    def predict(pdfs):
+        the_model = _get_broadcast_model(model_id, broadcast_model)
+
+        for pdf in pdfs:
+            order = order_fn(pdf) if order_fn is not None else np.arange(len(pdf))
+            preds = [None] * len(pdf)
+            for start in range(0, len(pdf), batch_size):
+                rows = order[start : start + batch_size]
+                batch_preds = predict_batch_fn(the_model, pdf.iloc[rows])
+                for row, pred in zip(rows, batch_preds.astype("float64")):
+                    preds[row] = pred
+            yield pdf.assign(**{output_col: preds})
+
+    return df.mapInPandas(predict, schema).withColumn(
+        output_col, array_to_vector(col(output_col))
+    )
@@ -52,3 +52,49 @@ def test_bert_base_cased():
         assert accuracy > 0.5
 
     spark.stop()
+
+
+def test_tokenization_cache(tmp_path):
+    spark = SparkSession.builder.master("local[*]").getOrCreate()
+
+    df = spark.createDataFrame(
+        [("a short sentence", 0), ("a somewhat longer sentence to tokenize", 1)],
+        ["text", "label"],
+    )
+
+    checkpoint = "bert-base-cased"
+    max_token_len = 16
+    deep_text_classifier = DeepTextClassifier(
+        checkpoint=checkpoint,
+        num_classes=2,
+        max_token_len=max_token_len,
+        tokenization_cache_dir=str(tmp_path),
+    )
+
+    tokenized_df = deep_text_classifier._get_or_create_tokenized_df(df)
+    assert len(list(tmp_path.iterdir())) == 1
+    assert tokenized_df.schema["input_ids"].dataType.elementType.typeName() == "integer"
+    assert (
+        tokenized_df.schema["attention_mask"].dataType.elementType.typeName() == "short"
+    )
+
+    tokenizer = deep_text_classifier.getTokenizer()
+    for row in tokenized_df.collect():
+        text = df.filter(df.label == row.label).first().text
+        encoding = tokenizer(
+            text, max_length=max_token_len, padding="max_length", truncation=True
+        )
+        assert row.input_ids == encoding["input_ids"]
+        assert row.attention_mask == encoding["attention_mask"]
+
+    # the same data is read back from the cache
+    deep_text_classifier._get_or_create_tokenized_df(df)
+    assert len(list(tmp_path.iterdir())) == 1
+
+    # a different max_token_len, or different data, are tokenized again
+    deep_text_classifier.setMaxTokenLen(8)
+    deep_text_classifier._get_or_create_tokenized_df(df)
+    assert len(list(tmp_path.iterdir())) == 2
+
+    deep_text_classifier._get_or_create_tokenized_df(df.limit(1))
+    assert len(list(tmp_path.iterdir())) == 3
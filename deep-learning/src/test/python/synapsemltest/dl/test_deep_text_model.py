@@ -1,6 +1,7 @@
 # Copyright (C) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License. See LICENSE in project root for information.
 
+import numpy as np
 import pytest
 import torch
 from pyspark.sql import SparkSession
@@ -80,3 +81,60 @@ def test_lit_deep_text_model():
     trainer = Trainer(callbacks=callbacks, max_epochs=epochs)
     trainer.fit(model, train_dataloaders=train_loader)
     trainer.test(model, dataloaders=test_loader)
+
+
+def test_batched_prediction():
+    spark = SparkSession.builder.master("local[*]").getOrCreate()
+
+    texts = [
+        "i feel happy today",
+        "what a long and winding sentence, it goes on and on before it finally ends",
+        "sad",
+        "i am not sure how i feel about this",
+        "angry!",
+    ]
+    df = spark.createDataFrame([(text, 0.0) for text in texts], ["text", "label"])
+
+    checkpoint = "bert-base-cased"
+    tokenizer = AutoTokenizer.from_pretrained(checkpoint)
+    max_token_len = 128
+    lit_model = LitDeepTextModel(
+        checkpoint=checkpoint,
+        additional_layers_to_train=0,
+        num_labels=6,
+        optimizer_name="adam",
+        loss_name="cross_entropy",
+        label_col="label",
+        text_col="text",
+    )
+    lit_model.eval()
+
+    # per row with padding to max_token_len
+    expected = []
+    for text in texts:
+        data = tokenizer(
+            text,
+            max_length=max_token_len,
+            padding="max_length",
+            truncation=True,
+            return_attention_mask=True,
+            return_tensors="pt",
+        )
+        with torch.no_grad():
+            logits = lit_model(**data).logits
+        expected.append(torch.nn.functional.softmax(logits, dim=-1).numpy()[0])
+
+    for sort_by_length in [False, True]:
+        deep_text_model = DeepTextModel(
+            model=lit_model,
+            checkpoint=checkpoint,
+            tokenizer=tokenizer,
+            max_token_len=max_token_len,
+            prediction_batch_size=2,
+            sort_by_length=sort_by_length,
+        )
+        pred_df = deep_text_model.transform(df).toPandas()
+
+        assert list(pred_df["text"]) == texts
+        outputs = np.stack([v.toArray() for v in pred_df["output"]])
+        assert np.allclose(outputs, np.stack(expected), atol=1e-4)
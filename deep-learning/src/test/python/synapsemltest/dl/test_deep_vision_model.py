@@ -7,12 +7,15 @@ from os.path import join
 
 import numpy as np
 import torch
+import torchvision.transforms as transforms
 from PIL import Image
+from pyspark.sql import SparkSession
 from pytorch_lightning import Trainer
 from pytorch_lightning.callbacks import Callback
 from torch.utils.data import DataLoader, Dataset
 
 from synapse.ml.dl import *
+from synapse.ml.dl.benchmark import generate_images
 
 
 class MyDummyCallback(Callback):
@@ -115,3 +118,88 @@ def test_lit_deep_vision_model(transform, get_data_path):
     trainer = Trainer(callbacks=callbacks, max_epochs=epochs)
     trainer.fit(model, train_dataloaders=train_loader)
     trainer.test(model, dataloaders=test_loader)
+
+
+def test_batched_prediction(tmp_path):
+    spark = SparkSession.builder.master("local[*]").getOrCreate()
+
+    transform = transforms.Compose(
+        [
+            transforms.CenterCrop(224),
+            transforms.ToTensor(),
+            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+        ]
+    )
+    paths = generate_images(str(tmp_path), 5)
+    df = spark.createDataFrame([(path, 0.0) for path in paths], ["image", "label"])
+
+    lit_model = LitDeepVisionModel(
+        backbone="resnet18",
+        additional_layers_to_train=0,
+        num_classes=3,
+        input_shape=[-1, 3, 224, 224],
+        optimizer_name="adam",
+        loss_name="cross_entropy",
+        label_col="label",
+        image_col="image",
+    )
+    lit_model.eval()
+
+    # batches of 2, 2 and 1 rows
+    deep_vision_model = DeepVisionModel(
+        model=lit_model,
+        input_shapes=[[-1, 3, 224, 224]],
+        transform_fn=transform,
+        prediction_batch_size=2,
+    )
+    pred_df = deep_vision_model.transform(df).toPandas()
+
+    with torch.no_grad():
+        expected = lit_model(
+            torch.stack([transform(Image.open(path).convert("RGB")) for path in paths])
+        ).numpy()
+
+    assert list(pred_df["image"]) == paths
+    outputs = np.stack([v.toArray() for v in pred_df["output"]])
+    assert np.allclose(outputs, expected, atol=1e-4)
+    assert list(pred_df["prediction"]) == list(
+        np.argmax(expected, axis=1).astype(float)
+    )
+
+
+def test_batched_prediction_of_arrays():
+    spark = SparkSession.builder.master("local[*]").getOrCreate()
+
+    input_shape = [-1, 3, 64, 64]
+    images = np.random.RandomState(0).rand(3, 3 * 64 * 64)
+    df = spark.createDataFrame(
+        [(image.tolist(), 0.0) for image in images], ["image", "label"]
+    )
+
+    lit_model = LitDeepVisionModel(
+        backbone="resnet18",
+        additional_layers_to_train=0,
+        num_classes=3,
+        input_shape=input_shape,
+        optimizer_name="adam",
+        loss_name="cross_entropy",
+        label_col="label",
+        image_col="image",
+    )
+    lit_model.eval()
+
+    # the array column is read as float64, the model runs in float32
+    deep_vision_model = DeepVisionModel(
+        model=lit_model,
+        input_shapes=[input_shape],
+        prediction_batch_size=2,
+    )
+    pred_df = deep_vision_model.transform(df).toPandas()
+
+    with torch.no_grad():
+        expected = lit_model(
+            torch.tensor(images, dtype=torch.float32).reshape(input_shape)
+        ).numpy()
+
+    outputs = np.stack([v.toArray() for v in pred_df["output"]])
+    assert np.allclose(outputs, expected, atol=1e-4)
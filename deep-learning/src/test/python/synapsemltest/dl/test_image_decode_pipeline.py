@@ -0,0 +1,81 @@
+# Copyright (C) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See LICENSE in project root for information.
+
+import logging
+import pickle
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from synapse.ml.dl import *
+from synapse.ml.dl.benchmark import generate_images
+
+
+def test_image_decode_pipeline(tmp_path):
+    paths = generate_images(str(tmp_path / "images"), 10, size=64)
+    expected = [np.asarray(Image.open(path).convert("RGB")) for path in paths]
+
+    image_decoder = ImageDecodePipeline(cache_dir=str(tmp_path / "cache"))
+
+    decoded = [image_decoder.decode_array(path) for path in paths]
+    assert all(np.array_equal(a, b) for a, b in zip(decoded, expected))
+    metrics = image_decoder.metrics()
+    assert metrics["images"] == 10
+    assert metrics["cache_misses"] == 10
+    assert metrics["images_per_second"] > 0
+
+    # the second epoch reads the cache
+    cached = [image_decoder.decode_array(path) for path in paths]
+    assert all(np.array_equal(a, b) for a, b in zip(cached, expected))
+    assert image_decoder.metrics()["cache_hits"] == 10
+
+    # the cache is kept across processes, the metrics are not
+    unpickled = pickle.loads(pickle.dumps(image_decoder))
+    assert unpickled.metrics()["images"] == 0
+    assert np.array_equal(np.asarray(unpickled.decode(paths[0])), expected[0])
+    assert unpickled.metrics()["cache_hits"] == 1
+
+
+def test_image_decode_pipeline_resize(tmp_path):
+    paths = generate_images(str(tmp_path / "images"), 2, size=100)
+
+    image_decoder = ImageDecodePipeline(num_workers=1, resize_to=32)
+    assert image_decoder.decode_array(paths[0]).shape == (32, 32, 3)
+
+    # images are never upscaled
+    image_decoder = ImageDecodePipeline(num_workers=1, resize_to=200)
+    assert image_decoder.decode_array(paths[1]).shape == (100, 100, 3)
+
+    # a wide image keeps its aspect ratio and is center cropped:
+    # red, green and blue thirds, only green is left
+    pixels = np.zeros((60, 180, 3), dtype=np.uint8)
+    for channel in range(3):
+        pixels[:, 60 * channel : 60 * (channel + 1), channel] = 255
+    wide_path = str(tmp_path / "wide.png")
+    Image.fromarray(pixels).save(wide_path)
+
+    image_decoder = ImageDecodePipeline(num_workers=1, resize_to=30)
+    decoded = image_decoder.decode_array(wide_path)
+    assert decoded.shape == (30, 30, 3)
+    assert (decoded[:, 1:-1, 1] == 255).all()
+    assert (decoded[:, 1:-1, [0, 2]] == 0).all()
+
+    with pytest.raises(ValueError):
+        ImageDecodePipeline(num_workers=0)
+
+
+def test_image_decode_pipeline_logs_metrics(tmp_path, caplog):
+    paths = generate_images(str(tmp_path / "images"), 4, size=32)
+
+    # the copy of a reader worker only reports its metrics through the log
+    image_decoder = pickle.loads(
+        pickle.dumps(ImageDecodePipeline(num_workers=1, log_every_n_images=2))
+    )
+
+    with caplog.at_level(logging.INFO, logger="synapse.ml.dl.ImageDecodePipeline"):
+        for path in paths:
+            image_decoder.decode(path)
+
+    assert len(caplog.records) == 2
+    assert "'images': 4" in caplog.records[-1].getMessage()
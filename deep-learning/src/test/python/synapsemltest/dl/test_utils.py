@@ -0,0 +1,44 @@
+# Copyright (C) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See LICENSE in project root for information.
+
+import numpy as np
+import torch
+from pyspark.sql import SparkSession
+
+from synapse.ml.dl.utils import transform_in_batches
+
+
+def test_transform_in_batches_matches_row_wise_prediction():
+    spark = SparkSession.builder.master("local[*]").getOrCreate()
+
+    torch.manual_seed(0)
+    model = torch.nn.Linear(4, 2)
+    model.eval()
+
+    features = np.random.RandomState(0).rand(7, 4)
+    df = spark.createDataFrame(
+        [(ii, row.tolist()) for ii, row in enumerate(features)], ["id", "features"]
+    ).repartition(2)
+
+    def predict_batch_fn(the_model, pdf):
+        with torch.no_grad():
+            return the_model(
+                torch.tensor(np.stack(pdf["features"]), dtype=torch.float32)
+            ).numpy()
+
+    with torch.no_grad():
+        expected = np.stack(
+            [
+                model(torch.tensor(row, dtype=torch.float32)).numpy()
+                for row in features
+            ]
+        )
+
+    # batches which do not divide the partitions, with and without reordering the rows
+    for order_fn in [None, lambda pdf: np.argsort(-pdf["id"].to_numpy())]:
+        pred_df = transform_in_batches(
+            df, model, predict_batch_fn, "output", 3, order_fn=order_fn
+        ).toPandas()
+
+        outputs = np.stack([v.toArray() for v in pred_df["output"]])
+        assert np.allclose(outputs, expected[pred_df["id"].to_numpy()], atol=1e-6)